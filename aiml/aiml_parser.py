@@ -1,5 +1,6 @@
 import logging
 
+import xml.parsers.expat
 import xml.sax.xmlreader
 import xml.sax.handler
 
@@ -24,8 +25,12 @@ class AimlHandler(xml.sax.handler.ContentHandler):
     _STATE_inside_template = 7
     _STATE_after_template = 8
 
-    def __init__(self):
+    def __init__(self, category_callback=None):
+        # Completed categories are passed to category_callback as ((pattern, that, topic),
+        # template) the moment their </category> tag is parsed.  Without a callback, they are
+        # collected in the categories dictionary instead.
         self.categories = {}
+        self._category_callback = category_callback
         self._state = self._STATE_outside_aiml
         self._version = ""
         self._namespace = ""
@@ -113,13 +118,18 @@ class AimlHandler(xml.sax.handler.ContentHandler):
         try:
             self._start_element(name, attr)
         except AimlParserError as msg:
-            # Print the error message
-            logger.error("PARSE ERROR: %s", msg)
+            self._parse_error(msg)
 
-            self._num_parse_errors += 1  # increment error count
-            # In case of a parse error, if we're inside a category, skip it.
-            if self._state >= self._STATE_inside_category:
-                self._skip_current_category = True
+    def _parse_error(self, msg):
+        """Record the parse error msg.  If we're inside a category, the rest of it is skipped.
+        """
+        # Print the error message
+        logger.error("PARSE ERROR: %s", msg)
+
+        self._num_parse_errors += 1  # increment error count
+        # In case of a parse error, if we're inside a category, skip it.
+        if self._state >= self._STATE_inside_category:
+            self._skip_current_category = True
 
     def _start_element(self, name, attr):
         if name == "aiml":
@@ -247,12 +257,7 @@ class AimlHandler(xml.sax.handler.ContentHandler):
         try:
             self._characters(ch)
         except AimlParserError as msg:
-            # Print the message
-            logger.error("PARSE ERROR: %s", msg)
-            self._num_parse_errors += 1  # increment error count
-            # In case of a parse error, if we're inside a category, skip it.
-            if self._state >= self._STATE_inside_category:
-                self._skip_current_category = True
+            self._parse_error(msg)
 
     def _characters(self, ch):
         text = str(ch)
@@ -331,11 +336,7 @@ class AimlHandler(xml.sax.handler.ContentHandler):
         try:
             self._end_element(name)
         except AimlParserError as msg:
-            logger.error("PARSE ERROR: %s", msg)
-            self._num_parse_errors += 1  # increment error count
-            # In case of a parse error, if we're inside a category, skip it.
-            if self._state >= self._STATE_inside_category:
-                self._skip_current_category = True
+            self._parse_error(msg)
 
     def _end_element(self, name):
         """Verify that an AIML end element is valid in the current
@@ -366,7 +367,7 @@ class AimlHandler(xml.sax.handler.ContentHandler):
             # element in the categories dictionary.
             key = (self._current_pattern.strip(), self._current_that.strip(),
                    self._current_topic.strip())
-            self.categories[key] = self._elem_stack[-1]
+            self._emit_category(key, self._elem_stack[-1])
             self._whitespace_behavior_stack.pop()
         elif name == "pattern":
             # </pattern> tags are only legal in the InsidePattern state
@@ -405,6 +406,13 @@ class AimlHandler(xml.sax.handler.ContentHandler):
             # Unexpected closing tag
             raise AimlParserError("%s: Unexpected </%s> tag " % (self._location, name))
 
+    def _emit_category(self, key, template):
+        """Hand over a completed category."""
+        if self._category_callback is None:
+            self.categories[key] = template
+        else:
+            self._category_callback(key, template)
+
     # A dictionary containing a validation information for each AIML element. The keys are the
     # names of the elements.  The values are a tuple of three items. The first is a list containing
     # the names of REQUIRED attributes, the second is a list of OPTIONAL attributes, and the third
@@ -547,11 +555,231 @@ class AimlHandler(xml.sax.handler.ContentHandler):
         return True
 
 
-def create_parser():
+class ExpatAimlHandler(AimlHandler):
+    """An AimlHandler fed directly by an ExpatAimlParser.
+
+    It builds exactly the same categories, and reports exactly the same errors, as AimlHandler.
+    The common transitions of the parser's state machine are looked up in tables keyed by
+    (state, tag name); anything else, including every error case, goes through the generic
+    AimlHandler code.  It also relies on pyexpat passing attributes as plain dictionaries of
+    strings, which saves converting every attribute set found inside templates.
+    """
+    # names of the elements that can be nested inside <template> elements
+    _template_children = frozenset(AimlHandler._validation_info_101) - {"template"}
+    # text is only significant in these states
+    _text_states = frozenset([AimlHandler._STATE_inside_pattern, AimlHandler._STATE_inside_that,
+                              AimlHandler._STATE_inside_template])
+
+    def __init__(self, category_callback=None):
+        super().__init__(category_callback)
+        # The pyexpat parser feeding this handler.  Text is only delivered while we're inside a
+        # <pattern>, <that> or <template> element; the rest of the document is mostly
+        # whitespace between tags.
+        self._expat = None
+        self._start_table = {
+            (self._STATE_inside_aiml, "category"): self._start_category,
+            (self._STATE_inside_category, "pattern"): self._start_pattern,
+            (self._STATE_after_pattern, "that"): self._start_that,
+            (self._STATE_after_pattern, "template"): self._start_template,
+            (self._STATE_after_that, "template"): self._start_template,
+        }
+        self._end_table = {
+            (self._STATE_after_template, "category"): self._end_category,
+            (self._STATE_inside_pattern, "pattern"): self._end_pattern,
+            (self._STATE_inside_that, "that"): self._end_that,
+            (self._STATE_inside_template, "template"): self._end_template,
+        }
+        for name in self._template_children:
+            self._start_table[self._STATE_inside_template, name] = self._start_template_child
+            self._end_table[self._STATE_inside_template, name] = self._end_template_child
+
+    def startElement(self, name, attr):
+        # If we're inside an unknown element, or skipping the current category, ignore
+        # everything until we're out again.
+        if self._current_unknown != "" or self._skip_current_category:
+            return
+        try:
+            self._start_table.get((self._state, name), self._start_element)(name, attr)
+        except AimlParserError as msg:
+            self._parse_error(msg)
+
+    def characters(self, ch):
+        if self._state not in self._text_states or self._skip_current_category:
+            return
+        if self._state == self._STATE_inside_pattern:
+            # no element can be open inside a pattern, so there's nothing to check.
+            self._current_pattern += ch
+            return
+        if self._current_unknown != "":
+            return
+        try:
+            self._characters(ch)
+        except AimlParserError as msg:
+            self._parse_error(msg)
+
+    def endElement(self, name):
+        if self._state == self._STATE_outside_aiml:
+            return
+        if self._current_unknown != "" or self._skip_current_category:
+            AimlHandler.endElement(self, name)
+            return
+        try:
+            self._end_table.get((self._state, name), self._end_element)(name)
+        except AimlParserError as msg:
+            self._parse_error(msg)
+
+    def _push_whitespace_behavior(self, attr):
+        # Same as AimlHandler._push_whitespace_behavior(), without raising a KeyError for every
+        # element that has no "xml:space" attribute.
+        space = attr.get("xml:space")
+        if space is None:
+            self._whitespace_behavior_stack.append(self._whitespace_behavior_stack[-1])
+        elif space == "default" or space == "preserve":
+            self._whitespace_behavior_stack.append(space)
+        else:
+            raise AimlParserError("%s: Invalid value for xml:space attribute" % self._location)
+
+    # The handlers below mirror the corresponding cases of AimlHandler._start_element() and
+    # AimlHandler._end_element().
+
+    def _start_category(self, name, attr):
+        self._state = self._STATE_inside_category
+        self._current_pattern = ""
+        self._current_that = ""
+        if not self._inside_topic:
+            self._current_topic = "*"
+        self._elem_stack = []
+        self._push_whitespace_behavior(attr)
+
+    def _start_pattern(self, name, attr):
+        self._state = self._STATE_inside_pattern
+        self._expat.CharacterDataHandler = self.characters
+
+    def _start_that(self, name, attr):
+        self._state = self._STATE_inside_that
+        self._expat.CharacterDataHandler = self.characters
+
+    def _start_template(self, name, attr):
+        if self._state == self._STATE_after_pattern:
+            self._current_that = "*"
+        self._state = self._STATE_inside_template
+        self._expat.CharacterDataHandler = self.characters
+        self._elem_stack.append(['template', {}])
+        self._push_whitespace_behavior(attr)
+
+    def _start_template_child(self, name, attr):
+        self._validate_elem_start(name, attr, self._version)
+        self._elem_stack.append([name, attr])
+        self._push_whitespace_behavior(attr)
+        if name == "condition":
+            self._found_default_li_stack.append(False)
+
+    def _end_category(self, name):
+        self._state = self._STATE_inside_aiml
+        key = (self._current_pattern.strip(), self._current_that.strip(),
+               self._current_topic.strip())
+        self._emit_category(key, self._elem_stack[-1])
+        self._whitespace_behavior_stack.pop()
+
+    def _end_pattern(self, name):
+        self._state = self._STATE_after_pattern
+        self._expat.CharacterDataHandler = None
+
+    def _end_that(self, name):
+        self._state = self._STATE_after_that
+        self._expat.CharacterDataHandler = None
+
+    def _end_template(self, name):
+        self._state = self._STATE_after_template
+        self._expat.CharacterDataHandler = None
+        self._whitespace_behavior_stack.pop()
+
+    def _end_template_child(self, name):
+        elem = self._elem_stack.pop()
+        self._elem_stack[-1].append(elem)
+        self._whitespace_behavior_stack.pop()
+        if elem[0] == "condition":
+            self._found_default_li_stack.pop()
+
+
+class ExpatAimlParser(xml.sax.xmlreader.Locator):
+    """An AIML parser built directly on pyexpat, without the xml.sax layer in between.
+
+    Implements the part of the xml.sax XMLReader interface that is used with AIML parsers:
+    parse() and getContentHandler().  Like the SAX parser, it raises xml.sax.SAXParseException
+    if the document isn't well-formed XML.  The parser is also the document locator of its
+    handler.
+    """
+    # Tag and attribute names are interned across documents, so the handler's dictionary
+    # lookups and comparisons mostly succeed on identity.
+    _names = {}
+
+    def __init__(self, category_callback=None):
+        self._handler = ExpatAimlHandler(category_callback)
+        self._parser = None
+        self._system_id = None
+
+    def getContentHandler(self):
+        return self._handler
+
+    def getColumnNumber(self):
+        return None if self._parser is None else self._parser.ErrorColumnNumber
+
+    def getLineNumber(self):
+        return 1 if self._parser is None else self._parser.ErrorLineNumber
+
+    def getPublicId(self):
+        return None
+
+    def getSystemId(self):
+        return self._system_id
+
+    def parse(self, source):
+        """Parse the AIML document source, which is either a filename or a binary file object.
+        """
+        handler = self._handler
+        parser = xml.parsers.expat.ParserCreate(intern=self._names)
+        # deliver runs of text in a single call instead of line by line
+        parser.buffer_text = True
+        parser.buffer_size = 65536
+        parser.StartElementHandler = handler.startElement
+        parser.EndElementHandler = handler.endElement
+        # the handler installs a CharacterDataHandler whenever it enters a state in which text
+        # is significant.
+        handler._expat = parser
+        self._parser = parser
+        handler.setDocumentLocator(self)
+        if isinstance(source, str):
+            self._system_id = source
+            in_file = open(source, "rb")
+        else:
+            self._system_id = getattr(source, "name", None)
+            in_file = source
+        try:
+            parser.ParseFile(in_file)
+        except xml.parsers.expat.ExpatError as e:
+            raise xml.sax.SAXParseException(xml.parsers.expat.ErrorString(e.code), e, self)
+        finally:
+            if in_file is not source:
+                in_file.close()
+
+
+def create_parser(backend="sax", category_callback=None):
     """Create and return an AIML parser object.
+
+    The backend argument selects the implementation: "sax" uses the xml.sax framework, "expat"
+    returns an ExpatAimlParser, which is faster.  Both produce the same categories.
+
+    If category_callback is given, the parser's handler passes each category to it as soon as
+    the category is complete, instead of collecting the document's categories in its
+    categories dictionary.
     """
+    if backend == "expat":
+        return ExpatAimlParser(category_callback)
+    if backend != "sax":
+        raise ValueError("backend must be in ['sax', 'expat']")
     parser = xml.sax.make_parser()
-    handler = AimlHandler()
+    handler = AimlHandler(category_callback)
     parser.setContentHandler(handler)
     # parser.setFeature(xml.sax.handler.feature_namespaces, True)
     return parser
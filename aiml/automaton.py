@@ -0,0 +1,171 @@
+"""
+This module implements the Automaton class, a pattern-matching engine that finds the same
+matches as PatternMgr._match(), in time linear in the length of the input.
+
+The node tree of a PatternMgr is compiled into a nondeterministic automaton with one state per
+node.  The input, the 'that' and the topic are matched as a single stream of words, in which
+separator tokens stand for the <that> and <topic> parts of the patterns.  The automaton is
+simulated one token at a time, keeping the active states in the order in which backtracking
+would try them: wildcards end as early as possible, and "_" beats literal words, which beat the
+bot name, which beats "*".  When two paths reach the same state at the same token, only the
+preferred one is kept, since both would continue the same way.  So every token is handled by
+each state at most once, whatever the patterns look like.
+
+Usage:
+    > automaton = Automaton(brain)
+    > path, template, spans = automaton.match(("HELLO", "WORLD"), ("*",), ("*",))
+"""
+import time
+
+from . import pattern_mgr
+
+
+# keys of the node tree
+_KEYS = pattern_mgr.PatternMgr
+# separator tokens of the word stream, and the end of the stream
+_THAT_SEPARATOR = 0
+_TOPIC_SEPARATOR = 1
+_END = 2
+
+
+class _State():
+    """A state of the automaton, compiled from a node of the tree."""
+    __slots__ = ("underscore", "literals", "bot_name", "star", "that", "topic", "template",
+                 "wildcard")
+
+    def __init__(self, wildcard):
+        self.underscore = self.bot_name = self.star = self.that = self.topic = None
+        self.template = None
+        self.literals = {}
+        # whether the state is entered through a wildcard, which may match more words
+        self.wildcard = wildcard
+
+
+class Automaton():
+    """Automaton finding the matches of a PatternMgr's patterns.  It reflects the patterns at
+    the time it was created; changes to the PatternMgr afterwards aren't picked up.
+    """
+
+    def __init__(self, patterns):
+        self._bot_name = patterns._botName
+        self._num_states = 0
+        self._start = self._compile(patterns._root, False)
+
+    def num_states(self):
+        """Return the number of states of the automaton."""
+        return self._num_states
+
+    def _compile(self, node, wildcard):
+        state = _State(wildcard)
+        self._num_states += 1
+        for key, child in node.items():
+            if key == _KEYS._TEMPLATE:
+                state.template = child
+            elif key == _KEYS._UNDERSCORE:
+                state.underscore = self._compile(child, True)
+            elif key == _KEYS._STAR:
+                state.star = self._compile(child, True)
+            elif key == _KEYS._BOT_NAME:
+                state.bot_name = self._compile(child, False)
+            elif key == _KEYS._THAT:
+                state.that = self._compile(child, False)
+            elif key == _KEYS._TOPIC:
+                state.topic = self._compile(child, False)
+            elif isinstance(key, str):
+                # one state for each word of a compressed chain
+                target = self._compile(child, False)
+                for word in reversed(child.get(_KEYS._RUN, ())):
+                    chain = _State(False)
+                    self._num_states += 1
+                    chain.literals[word] = target
+                    target = chain
+                state.literals[key] = target
+        return state
+
+    def match(self, words, that_words, topic_words, deadline=None):
+        """Match the word tuples of an input, a 'that' and a topic, normalized as by
+        PatternMgr._normalize().
+
+        Returns a tuple (path, template, spans).  path and template are what PatternMgr._match()
+        returns.  spans has a (part, start, end) tuple for every wildcard of the matching
+        pattern, in order, where part is 0 for the input, 1 for the 'that' and 2 for the topic,
+        and the wildcard matched words[start:end] of that part.  Returns (None, None, None) if
+        nothing matches.  MatchTimeout is raised if deadline, a time.monotonic() value, passes.
+        """
+        tokens = list(words)
+        tokens.append(_THAT_SEPARATOR)
+        tokens.extend(that_words)
+        tokens.append(_TOPIC_SEPARATOR)
+        tokens.extend(topic_words)
+        tokens.append(_END)
+        offsets = (0, len(words) + 1, len(words) + len(that_words) + 2)
+
+        # a thread is a tuple (state, path, spans, start): path and spans are linked lists of
+        # (item, rest) tuples, in reverse order, and start is the position of the first word of
+        # the wildcard the thread is in
+        threads = [(self._start, None, None, None)]
+        bot_name = self._bot_name
+        match = None
+        for position, token in enumerate(tokens):
+            if deadline is not None and time.monotonic() > deadline:
+                raise pattern_mgr.MatchTimeout(self._path_names(threads[0][1]))
+            next_threads = []
+            seen = set()
+
+            def add(state, path, spans, start):
+                if state not in seen:
+                    seen.add(state)
+                    next_threads.append((state, path, spans, start))
+
+            for state, path, spans, start in threads:
+                if state.wildcard:
+                    # the wildcard ends here, unless the thread stays in it below
+                    closed = ((start, position), spans)
+                else:
+                    closed = spans
+                if isinstance(token, str):
+                    if state.underscore is not None:
+                        add(state.underscore, (_KEYS._UNDERSCORE, path), closed, position)
+                    child = state.literals.get(token)
+                    if child is not None:
+                        add(child, (token, path), closed, None)
+                    if state.bot_name is not None and token == bot_name:
+                        add(state.bot_name, (token, path), closed, None)
+                    if state.star is not None:
+                        add(state.star, (_KEYS._STAR, path), closed, position)
+                    if state.wildcard:
+                        add(state, path, spans, start)
+                    continue
+                # the end of a part of the input
+                if token == _THAT_SEPARATOR and state.that is not None:
+                    add(state.that, (_KEYS._THAT, path), closed, None)
+                elif token == _TOPIC_SEPARATOR and state.topic is not None:
+                    add(state.topic, (_KEYS._TOPIC, path), closed, None)
+                if state.template is not None:
+                    # a match; the threads behind this one can't beat it
+                    match = (state.template, path, closed)
+                    break
+            threads = next_threads
+            if not threads:
+                break
+
+        if match is None:
+            return (None, None, None)
+        template, path, spans = match
+        spans = self._to_list(spans)
+        for i, (start, end) in enumerate(spans):
+            part = 0 if start < offsets[1] else 1 if start < offsets[2] else 2
+            spans[i] = (part, start - offsets[part], end - offsets[part])
+        return (self._to_list(path), template, spans)
+
+    @staticmethod
+    def _to_list(linked):
+        items = []
+        while linked is not None:
+            item, linked = linked
+            items.append(item)
+        items.reverse()
+        return items
+
+    def _path_names(self, path):
+        return [_KEYS._KEY_NAMES.get(key, key) for key in self._to_list(path)]
@@ -0,0 +1,283 @@
+"""
+This module reports the shape of a brain, and the memory it takes up, for capacity planning and
+for checking the effect of memory optimizations.
+
+analyze() walks the node tree of a PatternMgr once, keeping only counters and the few
+templates it reports, and returns a dictionary with:
+    - the number of nodes, and the bytes they take up, by depth and by source file.  A node is
+      put down to a file if all the categories below it come from that file, and to None if
+      they come from several;
+    - histograms of the fanout of the nodes, and of the length of the chains of nodes with a
+      single child and no template.  Histogram buckets are powers of two: bucket n holds the
+      values from n up to 2 * n - 1;
+    - the number of edges that are wildcards;
+    - the biggest templates;
+    - the templates that are identical to others, and the memory the copies take up.  Copies
+      that are shared (see Kernel.set_template_sharing()) take up no memory of their own.
+The bytes of the nodes include the tuples of compressed words and the summaries the matcher
+keeps; those of templates include their elements, attribute dictionaries and text.  Elements
+shared by several templates are counted once in the totals.
+
+Usage:
+    > report = analyze(kernel._brain)  # or kernel.brain_report()
+    > print(format_report(report))
+
+    python -m aiml.brain_report [--top N] [--json] standard.brn
+    python -m aiml.brain_report [--top N] [--json] sets/standard/*.aiml
+"""
+import argparse
+import collections
+import glob
+import json
+import logging
+import sys
+
+from . import pattern_mgr
+
+
+_KEYS = pattern_mgr.PatternMgr
+# edges that are wildcards, by name
+_WILDCARDS = {_KEYS._UNDERSCORE: "_", _KEYS._STAR: "*", _KEYS._BOT_NAME: "bot name"}
+# the source of the categories below a node before any were found, and when they come from
+# more than one file
+_UNSET = object()
+_SEVERAL = object()
+
+
+def _bucket(value):
+    """Return the histogram bucket of value: the greatest power of two not above it, or 0."""
+    return 1 << (value.bit_length() - 1) if value > 0 else 0
+
+
+def _node_bytes(node):
+    """Return the bytes taken up by the node dictionary, its compressed words and summaries."""
+    num_bytes = sys.getsizeof(node)
+    for key in (_KEYS._RUN, _KEYS._LENGTHS, _KEYS._CONTEXTS):
+        if key in node:
+            num_bytes += sys.getsizeof(node[key])
+            if key == _KEYS._CONTEXTS:
+                num_bytes += sum(sys.getsizeof(words) for words in node[key] if words)
+    return num_bytes
+
+
+def _template_size(elem, seen):
+    """Return the (bytes, elements) of the template elem, not counting the elements and
+    attribute dictionaries whose ids are in seen, and add the ids of the others to seen.
+    """
+    num_bytes = num_elements = 0
+    stack = [elem]
+    while stack:
+        elem = stack.pop()
+        if id(elem) in seen:
+            continue
+        seen.add(id(elem))
+        num_elements += 1
+        num_bytes += sys.getsizeof(elem)
+        if id(elem[1]) not in seen:
+            seen.add(id(elem[1]))
+            num_bytes += sys.getsizeof(elem[1])
+        for child in elem[2:]:
+            if isinstance(child, list):
+                stack.append(child)
+            else:
+                num_bytes += sys.getsizeof(child)
+    return num_bytes, num_elements
+
+
+def _template_key(elem):
+    """Return a hashable key that is equal for identical templates.  Attributes starting with
+    "#", which the Kernel keeps for itself, are left out.
+    """
+    attrs = tuple(sorted(item for item in elem[1].items() if not item[0].startswith("#")))
+    return (elem[0], attrs) + tuple(_template_key(child) if isinstance(child, list) else child
+                                    for child in elem[2:])
+
+
+def _category_key(segments):
+    """Return the (pattern, that, topic) of the words of the segments of a path."""
+    words = [" ".join(segment) for segment in segments]
+    return tuple(words + [""] * (3 - len(words)))
+
+
+def analyze(brain, top=10):
+    """Analyze brain, a PatternMgr, and return the report described in the module docstring.
+    The top biggest templates, and groups of duplicate templates, are listed.
+    """
+    depths = collections.defaultdict(lambda: [0, 0])  # depth -> [nodes, bytes]
+    sources = collections.defaultdict(lambda: [0, 0, 0, 0])  # [categories, nodes, bytes,
+                                                              # template bytes]
+    fanouts = collections.Counter()
+    chains = collections.Counter()
+    wildcards = collections.Counter()
+    num_nodes = num_edges = node_bytes = template_bytes = 0
+    biggest = []  # (bytes, elements, key, source) of the biggest templates
+    duplicates = collections.defaultdict(list)  # template key -> [(category key, template)]
+    seen = set()  # ids of the template elements counted so far
+
+    # Depth-first walk.  Every entry is [node, depth, segments, chain, source of the categories
+    # below, children pending, bytes]; the source is known once the children are done.
+    stack = [[brain._root, 0, [[]], 0, _UNSET, None, 0]]
+    while stack:
+        entry = stack[-1]
+        node, depth, segments, chain = entry[:4]
+        if entry[5] is None:
+            # first visit
+            num_nodes += 1
+            num_bytes = entry[6] = _node_bytes(node)
+            node_bytes += num_bytes
+            depths[depth][0] += 1
+            depths[depth][1] += num_bytes
+            children = [(key, child) for key, child in node.items() if key not in brain._LEAF_KEYS]
+            fanouts[_bucket(len(children))] += 1
+            num_edges += len(children)
+            for key, child in children:
+                if key in _WILDCARDS:
+                    wildcards[_WILDCARDS[key]] += 1
+            passing = len(children) == 1 and brain._TEMPLATE not in node
+            if not passing and chain > 0:
+                chains[_bucket(chain)] += 1
+            if brain._TEMPLATE in node:
+                tem = node[brain._TEMPLATE]
+                key = _category_key(segments)
+                source = node.get(brain._SOURCE)
+                entry[4] = source
+                sources[source][0] += 1
+                num_bytes, num_elements = _template_size(tem, set())
+                template_bytes += _template_size(tem, seen)[0]
+                sources[source][3] += num_bytes
+                biggest.append((num_bytes, num_elements, key, source))
+                if len(biggest) > 2 * top:
+                    biggest = sorted(biggest, key=lambda item: item[:2], reverse=True)[:top]
+                duplicates[_template_key(tem)].append((key, tem))
+            entry[5] = []
+            for key, child in children:
+                if key == brain._THAT:
+                    child_segments = segments + [[]]
+                elif key == brain._TOPIC:
+                    child_segments = segments + [[]] * (3 - len(segments))
+                else:
+                    child_segments = segments[:-1] + [
+                        segments[-1] + [brain._KEY_NAMES.get(key, key)] +
+                        list(child.get(brain._RUN, ()))]
+                entry[5].append([child, depth + 1, child_segments, chain + 1 if passing else 0,
+                                 _UNSET, None, 0])
+        if entry[5]:
+            stack.append(entry[5].pop())
+            continue
+        stack.pop()
+        # all children are done; put the node down to the source of its categories
+        if stack:
+            parent = stack[-1]
+            if parent[4] is _UNSET:
+                parent[4] = entry[4]
+            elif parent[4] != entry[4]:
+                parent[4] = _SEVERAL
+        source = None if entry[4] is _SEVERAL or entry[4] is _UNSET else entry[4]
+        sources[source][1] += 1
+        sources[source][2] += entry[6]
+
+    duplicate_groups = []
+    num_duplicates = duplicate_bytes = 0
+    for group in duplicates.values():
+        if len(group) < 2:
+            continue
+        copies = {id(tem): tem for key, tem in group}
+        # every copy besides the first takes up memory of its own, apart from shared elements
+        wasted = sum(_template_size(tem, set())[0] for tem in list(copies.values())[1:])
+        num_duplicates += len(group) - 1
+        duplicate_bytes += wasted
+        duplicate_groups.append({"categories": len(group), "copies": len(copies),
+                                 "bytes": wasted, "example": group[0][0]})
+    duplicate_groups.sort(key=lambda group: (group["bytes"], group["categories"]), reverse=True)
+    biggest = sorted(biggest, key=lambda item: item[:2], reverse=True)[:top]
+
+    return {
+        "categories": brain.num_templates(),
+        "nodes": num_nodes,
+        "node_bytes": node_bytes,
+        "template_bytes": template_bytes,
+        "by_depth": [{"depth": depth, "nodes": depths[depth][0], "bytes": depths[depth][1]}
+                     for depth in sorted(depths)],
+        "by_source": sorted(({"source": source, "categories": counts[0], "nodes": counts[1],
+                              "node_bytes": counts[2], "template_bytes": counts[3]}
+                             for source, counts in sources.items()),
+                            key=lambda item: item["node_bytes"] + item["template_bytes"],
+                            reverse=True),
+        "fanout": dict(sorted(fanouts.items())),
+        "chain_lengths": dict(sorted(chains.items())),
+        "wildcards": dict(wildcards),
+        "wildcard_density": sum(wildcards.values()) / num_edges if num_edges else 0.0,
+        "biggest_templates": [{"bytes": num_bytes, "elements": num_elements, "category": key,
+                               "source": source}
+                              for num_bytes, num_elements, key, source in biggest],
+        "duplicates": num_duplicates,
+        "duplicate_bytes": duplicate_bytes,
+        "duplicate_groups": duplicate_groups[:top],
+    }
+
+
+def format_report(report):
+    """Return the report returned by analyze() as text."""
+    lines = ["%d categories, %d nodes: %.1f MB in nodes, %.1f MB in templates" % (
+        report["categories"], report["nodes"], report["node_bytes"] / 1e6,
+        report["template_bytes"] / 1e6)]
+    lines.append("Nodes by depth:")
+    lines.append("  %5s %8s %12s" % ("depth", "nodes", "bytes"))
+    for row in report["by_depth"]:
+        lines.append("  %5d %8d %12d" % (row["depth"], row["nodes"], row["bytes"]))
+    lines.append("By source file (nodes shared by several files under None):")
+    lines.append("  %10s %8s %12s %14s  %s" % ("categories", "nodes", "node bytes",
+                                               "template bytes", "file"))
+    for row in report["by_source"]:
+        lines.append("  %10d %8d %12d %14d  %s" % (row["categories"], row["nodes"],
+                                                   row["node_bytes"], row["template_bytes"],
+                                                   row["source"]))
+    for title, name in (("Fanout", "fanout"), ("Chain lengths", "chain_lengths")):
+        lines.append("%s (bucket: count):" % title)
+        lines.append("  " + ", ".join("%d: %d" % item for item in report[name].items()))
+    lines.append("Wildcards: %.1f%% of edges (%s)" % (
+        report["wildcard_density"] * 100,
+        ", ".join("%s: %d" % item for item in sorted(report["wildcards"].items()))))
+    lines.append("Biggest templates:")
+    for row in report["biggest_templates"]:
+        lines.append("  %8d bytes %5d elements  %s  (%s)" % (
+            row["bytes"], row["elements"], " | ".join(row["category"]), row["source"]))
+    lines.append("Duplicate templates: %d, taking up %d bytes" % (report["duplicates"],
+                                                                  report["duplicate_bytes"]))
+    for row in report["duplicate_groups"]:
+        lines.append("  %5d categories %5d copies %8d bytes  e.g. %s" % (
+            row["categories"], row["copies"], row["bytes"], " | ".join(row["example"])))
+    return "\n".join(lines)
+
+
+def main(args):
+    arg_parser = argparse.ArgumentParser(
+        prog="python -m aiml.brain_report",
+        description="Report the shape of a brain and the memory it takes up.")
+    arg_parser.add_argument("paths", nargs="+",
+                            help="a saved brain, or AIML files to learn (wildcards allowed)")
+    arg_parser.add_argument("--top", type=int, default=10,
+                            help="number of templates and duplicates to list (default: 10)")
+    arg_parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    options = arg_parser.parse_args(args)
+    logging.disable(logging.CRITICAL)
+
+    from .kernel import Kernel
+    kernel = Kernel()
+    if len(options.paths) == 1 and not options.paths[0].endswith((".aiml", ".xml")):
+        kernel.load_brain(options.paths[0])
+    else:
+        kernel.set_parser_backend("expat")
+        for pattern in options.paths:
+            for path in sorted(glob.glob(pattern)):
+                kernel.learn(path)
+    report = kernel.brain_report(options.top)
+    if options.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(format_report(report))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,82 @@
+"""
+This module implements the BrainWatcher class, which keeps the brain of a Kernel up to date with
+the AIML files on disk.
+
+The watcher polls the modification times of the files, so it works everywhere and needs no
+third-party packages.  Changed, new and deleted files are handed to Kernel.rebuild() in one go,
+so a burst of changes produces a single new version of the brain.
+
+Usage:
+    > watcher = kernel.watch(["aiml/*.aiml"], interval=5)
+    > ...
+    > watcher.stop()
+"""
+import glob
+import logging
+import os
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class BrainWatcher(threading.Thread):
+    """Thread polling a set of AIML files for changes, and rebuilding the brain of a Kernel when
+    they change.
+
+    file_paths is a list of paths, which may include wildcards.  If it's None, the files the
+    kernel has learned from are watched.
+    """
+
+    def __init__(self, kernel, file_paths=None, interval=2.0):
+        super().__init__(name="aiml-watcher")
+        self.daemon = True
+        self._kernel = kernel
+        if file_paths is not None and not isinstance(file_paths, (list, tuple)):
+            file_paths = [file_paths]
+        self._file_paths = file_paths
+        self._interval = interval
+        self._stop_event = threading.Event()
+        self._stats = self._scan()
+
+    def _scan(self):
+        """Return a dictionary mapping each watched file to its (mtime_ns, size)."""
+        if self._file_paths is None:
+            files = self._kernel.learned_files()
+        else:
+            files = [f for file_path in self._file_paths
+                     for f in glob.glob(os.path.abspath(file_path))]
+        stats = {}
+        for f in files:
+            try:
+                st = os.stat(f)
+            except OSError:
+                continue
+            stats[f] = (st.st_mtime_ns, st.st_size)
+        return stats
+
+    def poll(self):
+        """Check the files once, and rebuild the brain if any of them changed.
+        Returns the list of changed files.
+        """
+        stats = self._scan()
+        changed = [f for f, stat in stats.items() if self._stats.get(f) != stat]
+        changed.extend(f for f in self._stats if f not in stats)
+        self._stats = stats
+        if changed:
+            logger.info("Rebuilding brain, changed files: %s", ", ".join(changed))
+            self._kernel.rebuild(changed, background=False)
+        return changed
+
+    def run(self):
+        while not self._stop_event.wait(self._interval):
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Error rebuilding brain:")
+
+    def stop(self):
+        """Stop watching, and wait for a rebuild in progress to finish."""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
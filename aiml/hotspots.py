@@ -0,0 +1,317 @@
+"""
+This module finds the categories of a brain that make matching expensive, before they show up
+as latency spikes.
+
+HotspotProfiler replays a corpus of inputs through a Kernel, with the pattern matcher
+instrumented, and counts for every category how often it was matched, the nodes the matcher
+visited to find it, the branches it gave up on along the way (backtracks), and the <srai>
+reductions its template went through.  find_risky_patterns() flags the patterns whose shape is
+known to make backtracking expensive, without matching anything:
+    - adjacent wildcards, like "* * FOO", which split the same words in every possible way;
+    - three or more wildcards in one part of a pattern;
+    - a "_" wildcard at a node with many children, since "_" is tried before every other
+      branch of the node.
+The report ranks the categories, and the files they come from, by the nodes visited.
+
+Usage:
+    > profiler = HotspotProfiler(kernel)
+    > profiler.replay(inputs)
+    > print(format_report(profiler.report()))
+
+    python -m aiml.hotspots --corpus inputs.txt [--top N] [--json] sets/standard/*.aiml
+"""
+import argparse
+import collections
+import glob
+import json
+import logging
+import sys
+
+from . import pattern_mgr
+
+
+_KEYS = pattern_mgr.PatternMgr
+_WILDCARD_WORDS = ("_", "*")
+# the number of children from which a node with a "_" wildcard is flagged
+DEFAULT_MAX_FANOUT = 16
+
+
+def _fanout(node):
+    """Return the number of children of node."""
+    return sum(1 for key in node if key not in _KEYS._LEAF_KEYS)
+
+
+def find_risky_patterns(brain, max_fanout=DEFAULT_MAX_FANOUT):
+    """Return a dictionary mapping the (pattern, that, topic) of every category of brain, a
+    PatternMgr, with a risky shape to a list of descriptions of what makes it risky.
+    """
+    risky = {}
+    for key, node in brain._iter_categories():
+        issues = []
+        for name, part in zip(("pattern", "that", "topic"), key):
+            words = part.split()
+            wildcards = [word in _WILDCARD_WORDS for word in words]
+            if any(a and b for a, b in zip(wildcards, wildcards[1:])):
+                issues.append("adjacent wildcards in the %s" % name)
+            if sum(wildcards) >= 3:
+                issues.append("%d wildcards in the %s" % (sum(wildcards), name))
+        # follow the pattern down the tree, to find the fanout of the nodes "_" leaves
+        node = brain._root
+        words = key[0].split()
+        i = 0
+        while i < len(words) and node is not None:
+            word = words[i]
+            if word == "_":
+                fanout = _fanout(node)
+                if fanout >= max_fanout:
+                    issues.append('"_" at a node with %d children, %s' % (
+                        fanout, 'after "%s"' % " ".join(words[:i]) if i else "first"))
+                node = node.get(_KEYS._UNDERSCORE)
+            elif word == "*":
+                node = node.get(_KEYS._STAR)
+            elif word == "BOT_NAME":
+                node = node.get(_KEYS._BOT_NAME)
+            else:
+                node = node.get(word)
+                if node is not None:
+                    i += len(node.get(_KEYS._RUN, ()))
+            i += 1
+        if issues:
+            risky[key] = issues
+    return risky
+
+
+class HotspotProfiler():
+    """Measures the cost of matching the categories of a Kernel's brain, on the inputs passed
+    to replay().
+
+    While replaying, the match cache, the automaton and the srai memo are bypassed, so that
+    every match is done and measured by the backtracking matcher.  The brain must not be
+    replaced (see Kernel.rebuild()) while the profiler is in use.
+    """
+
+    def __init__(self, kernel):
+        self._kernel = kernel
+        self._brain = kernel._brain
+        # maps the id of the node holding every template to the (pattern, that, topic) of the
+        # category; built when needed
+        self._categories = None
+        # [matches, nodes visited, backtracks, srai hops, most nodes visited by one match] of
+        # every category, by (pattern, that, topic); None for inputs that matched nothing
+        self._stats = collections.defaultdict(lambda: [0, 0, 0, 0, 0])
+        self._num_inputs = 0
+
+    def replay(self, inputs, session_id="_hotspots"):
+        """Respond to every input in inputs, in the session session_id, and record the cost of
+        the matches.  Returns the responses.
+        """
+        kernel = self._kernel
+        brain = self._brain
+        stats = self._stats
+        counts = [0, 0]  # nodes visited and backtracks of the current match
+        matching = [False]
+        # the categories whose templates are being processed, innermost last
+        active = []
+        match = brain.match
+        cached_match = brain._cached_match
+        match_node = brain._match
+        respond_to_state = kernel._respond_to_state
+
+        def profiled_match(*args, **kwargs):
+            matching[0] = True
+            try:
+                return match(*args, **kwargs)
+            finally:
+                matching[0] = False
+
+        def profiled_cached_match(*args, **kwargs):
+            if not matching[0]:
+                # star() repeats the match; it's not counted again
+                return cached_match(*args, **kwargs)
+            counts[0] = counts[1] = 0
+            result = cached_match(*args, **kwargs)
+            key = self._category(result[0]) if result[1] is not None else None
+            entry = stats[key]
+            entry[0] += 1
+            entry[1] += counts[0]
+            entry[2] += counts[1]
+            entry[4] = max(entry[4], counts[0])
+            if active:
+                if len(active) > 1 and active[-2] is not None:
+                    stats[active[-2]][3] += 1
+                active[-1] = key
+            return result
+
+        def profiled_match_node(*args, **kwargs):
+            counts[0] += 1
+            result = match_node(*args, **kwargs)
+            if result[1] is None:
+                counts[1] += 1
+            return result
+
+        def profiled_respond_to_state(*args, **kwargs):
+            active.append(None)
+            try:
+                return respond_to_state(*args, **kwargs)
+            finally:
+                active.pop()
+
+        saved = (brain._match_cache, brain._engine, kernel._srai_memo)
+        brain._match_cache = kernel._srai_memo = None
+        brain._engine = "backtracking"
+        brain.match = profiled_match
+        brain._cached_match = profiled_cached_match
+        brain._match = profiled_match_node
+        kernel._respond_to_state = profiled_respond_to_state
+        try:
+            responses = []
+            for input in inputs:
+                responses.append(kernel.respond(input, session_id))
+                self._num_inputs += 1
+            return responses
+        finally:
+            del brain.match, brain._cached_match, brain._match, kernel._respond_to_state
+            brain._match_cache, brain._engine, kernel._srai_memo = saved
+
+    def _category(self, path):
+        """Return the (pattern, that, topic) of the category at the end of path, the pattern
+        path returned by PatternMgr._match().
+        """
+        brain = self._brain
+        if self._categories is None:
+            self._categories = {id(node): key for key, node in brain._iter_categories()}
+        node = brain._root
+        i = 0
+        while i < len(path):
+            key = path[i]
+            if isinstance(key, str):
+                if key in node:
+                    node = node[key]
+                    i += len(node.get(brain._RUN, ()))
+                else:
+                    node = node[brain._BOT_NAME]
+            else:
+                node = node[key]
+            i += 1
+        return self._categories[id(node)]
+
+    def report(self, top=20, max_fanout=DEFAULT_MAX_FANOUT):
+        """Return a dictionary with the totals of the inputs replayed so far, and the top
+        categories and files ranked by the nodes visited to match them.  Every category comes
+        with its matches, nodes visited, backtracks, srai hops, the most nodes visited by a
+        single match, and the issues found by find_risky_patterns(); "risky" lists the top
+        categories with a risky shape, whether they were matched or not.
+        """
+        brain = self._brain
+        sources = {}
+        for source in brain.sources():
+            for key in brain._files[source]:
+                sources[key] = source
+        risky = find_risky_patterns(brain, max_fanout)
+        categories = []
+        files = collections.defaultdict(lambda: [0, 0, 0, 0, 0])
+        for key, (matches, nodes, backtracks, hops, max_nodes) in self._stats.items():
+            source = sources.get(key)
+            categories.append({"category": key, "source": source, "matches": matches,
+                               "nodes": nodes, "backtracks": backtracks, "srai_hops": hops,
+                               "max_nodes": max_nodes, "issues": risky.get(key, [])})
+            totals = files[source]
+            for i, value in enumerate((matches, nodes, backtracks, hops)):
+                totals[i] += value
+        for key in risky:
+            files[sources.get(key)][4] += 1
+        categories.sort(key=lambda row: (row["nodes"], row["max_nodes"]), reverse=True)
+        return {
+            "inputs": self._num_inputs,
+            "matches": sum(row["matches"] for row in categories),
+            "nodes": sum(row["nodes"] for row in categories),
+            "backtracks": sum(row["backtracks"] for row in categories),
+            "srai_hops": sum(row["srai_hops"] for row in categories),
+            "categories": categories[:top],
+            "files": sorted(({"source": source, "matches": totals[0], "nodes": totals[1],
+                              "backtracks": totals[2], "srai_hops": totals[3],
+                              "risky": totals[4]} for source, totals in files.items()),
+                            key=lambda row: (row["nodes"], row["risky"]), reverse=True)[:top],
+            "risky": [{"category": key, "source": sources.get(key), "issues": issues}
+                      for key, issues in sorted(risky.items(),
+                                                key=lambda item: -len(item[1]))[:top]],
+        }
+
+    def reset(self):
+        """Forget the costs recorded so far."""
+        self._stats.clear()
+        self._num_inputs = 0
+
+
+def _category_name(key):
+    return "no match" if key is None else " | ".join(key)
+
+
+def format_report(report):
+    """Return the report returned by HotspotProfiler.report() as text."""
+    lines = ["%d inputs, %d matches: %d nodes visited, %d backtracks, %d <srai> hops" % (
+        report["inputs"], report["matches"], report["nodes"], report["backtracks"],
+        report["srai_hops"])]
+    lines.append("Categories by nodes visited:")
+    lines.append("  %8s %10s %10s %8s %9s  %s" % ("matches", "nodes", "backtracks", "hops",
+                                                  "max nodes", "category (file)"))
+    for row in report["categories"]:
+        lines.append("  %8d %10d %10d %8d %9d  %s (%s)" % (
+            row["matches"], row["nodes"], row["backtracks"], row["srai_hops"], row["max_nodes"],
+            _category_name(row["category"]), row["source"]))
+        for issue in row["issues"]:
+            lines.append("%50s! %s" % ("", issue))
+    lines.append("Files by nodes visited:")
+    lines.append("  %8s %10s %10s %8s %6s  %s" % ("matches", "nodes", "backtracks", "hops",
+                                                  "risky", "file"))
+    for row in report["files"]:
+        lines.append("  %8d %10d %10d %8d %6d  %s" % (
+            row["matches"], row["nodes"], row["backtracks"], row["srai_hops"], row["risky"],
+            row["source"]))
+    lines.append("Risky patterns:")
+    for row in report["risky"]:
+        lines.append("  %s (%s): %s" % (_category_name(row["category"]), row["source"],
+                                        "; ".join(row["issues"])))
+    return "\n".join(lines)
+
+
+def main(args):
+    arg_parser = argparse.ArgumentParser(
+        prog="python -m aiml.hotspots",
+        description="Report the categories that make matching expensive.")
+    arg_parser.add_argument("paths", nargs="+",
+                            help="a saved brain, or AIML files to learn (wildcards allowed)")
+    arg_parser.add_argument("--corpus", help="file of inputs to replay, one per line; without "
+                                             "it, only risky patterns are reported")
+    arg_parser.add_argument("--top", type=int, default=20,
+                            help="number of categories and files to list (default: 20)")
+    arg_parser.add_argument("--max-fanout", type=int, default=DEFAULT_MAX_FANOUT,
+                            help='flag "_" wildcards at nodes with this many children '
+                                 '(default: %d)' % DEFAULT_MAX_FANOUT)
+    arg_parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    options = arg_parser.parse_args(args)
+    logging.disable(logging.CRITICAL)
+
+    from .kernel import Kernel
+    kernel = Kernel()
+    if len(options.paths) == 1 and not options.paths[0].endswith((".aiml", ".xml")):
+        kernel.load_brain(options.paths[0])
+    else:
+        kernel.set_parser_backend("expat")
+        for pattern in options.paths:
+            for path in sorted(glob.glob(pattern)):
+                kernel.learn(path)
+    profiler = HotspotProfiler(kernel)
+    if options.corpus is not None:
+        with open(options.corpus, encoding="utf-8") as corpus:
+            profiler.replay(line.strip() for line in corpus if line.strip())
+    report = profiler.report(options.top, options.max_fanout)
+    if options.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(format_report(report))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,186 @@
+"""
+This module implements the brain journal: an append-only log of the changes made to a brain
+after it was last saved.
+
+A journaled brain consists of a base snapshot, written by PatternMgr.save(), and a journal file
+next to it, holding one marshal record per change.  Appending a record is cheap, so changes can
+be logged as they happen, e.g. when a <learn> tag is processed.  Records are fsynced in batches:
+either when batch_size records are pending, or batch_interval seconds after the first pending
+record, whichever comes first.
+
+Replaying a journal sets the categories it touches to the state they had when the records were
+written, so replaying records that are already contained in the base snapshot is harmless.  This
+is what makes compaction safe: the journal is set aside before the new snapshot is written, and
+only deleted afterwards.
+
+Usage:
+    > journal = Journal(journal_path("brain.brn"))
+    > journal.add("HELLO", "*", "*", template, "hello.aiml")
+    > journal.close()
+    > brain = pattern_mgr.PatternMgr()
+    > brain.restore("brain.brn")
+    > replay(journal_path("brain.brn"), brain)
+"""
+import logging
+import marshal
+import os
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_FORMAT = 1
+
+# record types
+_ADD = 0
+_REMOVE_SOURCE = 1
+
+
+def journal_path(brain_path):
+    """Return the path of the journal belonging to the brain file brain_path."""
+    return brain_path + ".journal"
+
+
+def rotated_path(brain_path):
+    """Return the path a journal is moved to while its brain is compacted."""
+    return brain_path + ".journal.old"
+
+
+def _header():
+    return (JOURNAL_FORMAT, marshal.version)
+
+
+def _read_records(path, brain):
+    """Apply the records of the journal file path to brain (unless brain is None).
+    Return a tuple (number of records, offset of the end of the last complete record).
+    A journal with an unknown header is ignored.
+    """
+    count = 0
+    with open(path, "rb") as in_file:
+        try:
+            if marshal.load(in_file) != _header():
+                logger.warning("Ignoring journal %s, it was written in a different format", path)
+                return 0, 0
+        except (EOFError, ValueError, TypeError):
+            return 0, 0
+        end = in_file.tell()
+        while True:
+            try:
+                record = marshal.load(in_file)
+            except EOFError:
+                break
+            except (ValueError, TypeError):
+                # a record that was only partly written before a crash
+                logger.warning("Ignoring incomplete record at the end of journal %s", path)
+                break
+            if brain is not None:
+                if record[0] == _ADD:
+                    brain.add(*record[1:])
+                elif record[0] == _REMOVE_SOURCE:
+                    brain.remove_source(record[1])
+            count += 1
+            end = in_file.tell()
+    return count, end
+
+
+def replay(path, brain):
+    """Apply the changes logged in the journal file path to the PatternMgr brain.
+    Returns the number of changes applied.  A missing journal counts as an empty one.
+    """
+    if not os.path.exists(path):
+        return 0
+    return _read_records(path, brain)[0]
+
+
+def append_journal(src_path, dst_path):
+    """Append the records of the journal src_path to the journal dst_path, and remove src_path."""
+    _, end = _read_records(src_path, None)
+    header_size = len(marshal.dumps(_header()))
+    with open(src_path, "rb") as in_file, open(dst_path, "ab") as out_file:
+        in_file.seek(header_size)
+        out_file.write(in_file.read(max(0, end - header_size)))
+        out_file.flush()
+        os.fsync(out_file.fileno())
+    os.remove(src_path)
+
+
+class Journal():
+    """Append-only log of the changes made to a brain.
+
+    Opening a journal discards an incomplete record at its end, left behind by a crash, so that
+    new records can be appended.  The methods are thread-safe.
+    """
+
+    def __init__(self, path, batch_size=100, batch_interval=1.0):
+        self._path = path
+        self._batch_size = batch_size
+        self._batch_interval = batch_interval
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._timer = None
+        self._out_file = None
+        self._open()
+
+    def _open(self):
+        """Open the journal file for appending, creating it if necessary."""
+        end = _read_records(self._path, None)[1] if os.path.exists(self._path) else 0
+        out_file = open(self._path, "r+b" if end else "wb")
+        out_file.truncate(end)
+        out_file.seek(end)
+        if not end:
+            marshal.dump(_header(), out_file)
+        self._out_file = out_file
+
+    def add(self, pattern, that, topic, template, source):
+        """Log the addition of a category to the brain."""
+        self._append((_ADD, pattern, that, topic, template, source))
+
+    def remove_source(self, source):
+        """Log the removal of all categories learned from source."""
+        self._append((_REMOVE_SOURCE, source))
+
+    def _append(self, record):
+        with self._lock:
+            marshal.dump(record, self._out_file)
+            self._pending += 1
+            if self._pending >= self._batch_size:
+                self._sync()
+            elif self._timer is None:
+                self._timer = threading.Timer(self._batch_interval, self.sync)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def sync(self):
+        """Flush the pending records to disk."""
+        with self._lock:
+            self._sync()
+
+    def _sync(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._pending and self._out_file is not None:
+            self._out_file.flush()
+            os.fsync(self._out_file.fileno())
+            self._pending = 0
+
+    def rotate(self, rotated):
+        """Move the records logged so far to the journal file rotated, and start over with an
+        empty journal.  If rotated already exists, the records are appended to it.
+        """
+        with self._lock:
+            self._sync()
+            self._out_file.close()
+            if os.path.exists(rotated):
+                append_journal(self._path, rotated)
+            else:
+                os.replace(self._path, rotated)
+            self._open()
+
+    def close(self):
+        """Flush the pending records and close the journal."""
+        with self._lock:
+            self._sync()
+            if self._out_file is not None:
+                self._out_file.close()
+                self._out_file = None
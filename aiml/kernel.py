@@ -1,8 +1,15 @@
 """
 This file contains the public interface to the aiml module.
+
+Modules that are expensive to import and only needed by some features (NumPy for the Big5
+predicates, the XML parsers, the parse cache, ...) are imported where they are used, so that
+importing aiml and creating a Kernel stays fast.  benchmarks/bench_startup.py keeps track of this.
 """
-import configparser
+import array
+import collections
+import contextlib
 import copy
+import gc
 import glob
 import os
 import random
@@ -10,18 +17,15 @@ import re
 import string
 import time
 import threading
-import xml.sax
 import logging
 
-from . import aiml_parser
+from . import journal
 from . import default_subs
 from . import utils
 from . import pattern_mgr
 from . import word_sub
 from . import __version__
 
-import numpy as np
-from . import big5
 import datetime
 
 logger = logging.getLogger(__name__)
@@ -36,10 +40,55 @@ class Kernel():
     _INPUT_HISTORY = "_inputHistory"  # keys to a queue (list) of recent user input
     _OUTPUT_HISTORY = "_outputHistory"  # keys to a queue (list) of recent responses.
     _INPUT_STACK = "_inputStack"  # Should always be empty in between calls to respond()
+    # Elements whose result depends on more than the input, that and topic, or which have side
+    # effects.  Templates containing none of them are pure; see _template_is_pure().
+    _IMPURE_ELEMENTS = frozenset([
+        "condition", "date", "get", "id", "input", "learn", "random", "set", "system", "that",
+    ])
+    _PURE_FLAG = "#pure"  # template attribute caching the result of the purity analysis
+    _ID_ATTR = "#id"  # template attribute holding the id of the category; see set_hit_counting()
+    _OFFLOADED_ATTR = "#offloaded"  # stub attribute: the key of an offloaded template's record
+    _MAX_TIMEOUT_RECORDS = 20  # number of timed out responses timeout_stats() reports
+    _STREAMING_BATCH_SIZE = 500  # number of categories streaming learn adds to the brain at once
 
     def __init__(self):
         self._brain = pattern_mgr.PatternMgr()
+        self._srai_memo = None
+        self._system_executor = None
+        self._share_templates = False
+        self._freeze_gc = False
+        self._template_pool = None  # template_pool.TemplatePool, created when first needed
+        self._hit_counts = None  # array of the hits of every category, indexed by template id
+        self._template_store = None  # template_store.TemplateStore of offloaded templates
+        self._profiler = None  # tag_profiler.TagProfiler, while template profiling is enabled
+        self._plain_processors = None  # the element processors, while they're profiled
+        self._srai_budget = None
+        self._response_deadline = None
+        self._deadline_fallback = ""
+        self._timeout_count = 0
+        self._timeouts = collections.deque(maxlen=self._MAX_TIMEOUT_RECORDS)
+        # how often each of the limits on <srai> recursion was hit
+        self._limit_counts = {"max_depth": 0, "cycle": 0, "budget": 0}
+        self._collapse_srai = False
+        # the srai_aliases.SraiAliases of the brain, while collapsing is enabled
+        self._srai_aliases = None
+        # changes whenever something besides the brain that affects responses changes
+        self._memo_generation = 0
         self._respond_lock = threading.RLock()
+        # notified when a <system> command a response waits for is done; see _process_system()
+        self._system_done = threading.Condition(self._respond_lock)
+        # the sessions whose responses are waiting for a <system> command
+        self._system_sessions = set()
+        # serializes changes to the brain; never acquire _respond_lock while holding it
+        self._brain_lock = threading.RLock()
+        # the brain a thread is currently responding with; see _active_brain()
+        self._local = threading.local()
+        self._background_learn = False
+        self._journal = None
+        self._journal_brain_path = None
+        self._parse_cache = None
+        self._parser_backend = "sax"
+        self._streaming_learn = False
 
         # set up the sessions        
         self._sessions = {}
@@ -100,7 +149,7 @@ class Kernel():
             learn_file_paths (list, tuple): list of AIML files to load by the Kernel
             commands (list, tuple): input strings to pass to respond()
         """
-        start = time.clock()
+        start = time.perf_counter()
         if brain_file_path:
             self.load_brain(brain_file_path)
 
@@ -108,15 +157,19 @@ class Kernel():
         # turned into a single-element list.
         if not isinstance(learn_file_paths, (list, tuple)):
             learn_file_paths = [learn_file_paths]
-        for file_path in learn_file_paths:
-            self.learn(file_path)
+        # one set of changes for all files, so the brain is copied once at most
+        with self._brain_changes() as apply:
+            for file_path in learn_file_paths:
+                self._learn(file_path, apply)
 
         if not isinstance(commands, (list, tuple)):
             commands = [commands]
         for cmd in commands:
             logger.info(self._respond(cmd, self._GLOBAL_SESSION_ID))
+        if self._freeze_gc:
+            self._freeze_brain()
 
-        logger.debug("Kernel bootstrap completed in %.2f seconds", time.clock() - start)
+        logger.debug("Kernel bootstrap completed in %.2f seconds", time.perf_counter() - start)
 
     def version(self):
         """Return the Kernel's version string.
@@ -127,7 +180,7 @@ class Kernel():
         """Return the number of categories the Kernel has learned.
         """
         # there's a one-to-one mapping between templates and categories
-        return self._brain.num_templates()
+        return self._active_brain().num_templates()
 
     def load_brain(self, filename):
         """Attempt to load a previously-saved 'brain' from the
@@ -135,20 +188,95 @@ class Kernel():
 
         NOTE: the current contents of the 'brain' will be discarded!
 
+        The changes logged in the brain's journal (see set_brain_journal()) are applied on top of
+        the saved brain.
         """
         logger.debug("Loading brain from %s...", filename)
-        start = time.clock()
-        self._brain.restore(filename)
-
-        logger.debug("done (%d categories in %.2f seconds)",
-                     self._brain.num_templates(), time.clock() - start)
+        start = time.perf_counter()
+        with self._brain_lock:
+            self._brain.restore(filename)
+            if self._template_pool is not None:
+                # the templates it holds are gone with the old brain
+                self._template_pool.clear()
+            # a journal set aside by an unfinished compaction comes first
+            changes = journal.replay(journal.rotated_path(filename), self._brain)
+            changes += journal.replay(journal.journal_path(filename), self._brain)
+            if self._hit_counts is not None:
+                self._hit_counts = array.array("L")
+                self._brain.replace_templates(self._number_template)
+            self._reset_srai_aliases(self._brain)
+        if self._freeze_gc:
+            self._freeze_brain()
+
+        logger.debug("done (%d categories and %d journaled changes in %.2f seconds)",
+                     self._brain.num_templates(), changes, time.perf_counter() - start)
 
     def save_brain(self, filename):
-        """Dump the contents of the bot's brain to a file on disk."""
+        """Dump the contents of the bot's brain to a file on disk.
+        If the brain journal is enabled for filename, the journal is emptied.
+        """
         logger.info("Saving brain to %s...", filename)
-        start = time.clock()
-        self._brain.save(filename)
-        logger.info("done (%.2f seconds)", time.clock() - start)
+        start = time.perf_counter()
+        with self._brain_lock:
+            if self._journal is not None and self._journal_brain_path == os.path.abspath(filename):
+                # the saved brain contains the journaled changes
+                self._journal.rotate(journal.rotated_path(self._journal_brain_path))
+            self._write_brain(self._brain, filename)
+        logger.info("done (%.2f seconds)", time.perf_counter() - start)
+
+    def set_brain_journal(self, filename, batch_size=100, batch_interval=1.0):
+        """Log all later changes to the brain in the journal of the brain file filename, so that
+        load_brain(filename) restores them, without having to save the whole brain after each
+        change.  Changes are written to disk in batches, of batch_size changes or after
+        batch_interval seconds, whichever comes first.  Pass None to stop logging.
+
+        Enable the journal after bootstrapping, once the brain matches the contents of filename.
+        Call save_brain() or compact_brain() every now and then, to fold the journal into the
+        saved brain.
+        """
+        with self._brain_lock:
+            if self._journal is not None:
+                self._journal.close()
+            self._journal = self._journal_brain_path = None
+            if filename is not None:
+                filename = os.path.abspath(filename)
+                self._journal = journal.Journal(journal.journal_path(filename),
+                                                batch_size, batch_interval)
+                self._journal_brain_path = filename
+
+    def compact_brain(self, background=True):
+        """Save the brain to the file of the brain journal, which empties the journal.
+        Unlike save_brain(), this doesn't stop the brain from being changed while the file is
+        written.  If background is true, the work is done in a new thread, which is returned.
+        """
+        if self._journal is None:
+            raise RuntimeError("The brain journal is not enabled")
+        with self._brain_lock:
+            brain = self._brain.copy()
+            filename = self._journal_brain_path
+            self._journal.rotate(journal.rotated_path(filename))
+        if not background:
+            self._write_brain(brain, filename)
+            return None
+        thread = threading.Thread(target=self._write_brain, args=(brain, filename),
+                                  name="aiml-compact")
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _write_brain(self, brain, filename):
+        """Save brain to filename, and delete the journal set aside for it."""
+        if self._template_store is not None:
+            # saved brains mustn't depend on the store
+            brain = brain.copy()
+            brain.replace_templates(self._load_template)
+        tmp_filename = filename + ".tmp"
+        brain.save(tmp_filename)
+        os.replace(tmp_filename, filename)
+        # only now that the new file is in place is the old journal obsolete
+        rotated = journal.rotated_path(filename)
+        if os.path.exists(rotated):
+            os.remove(rotated)
 
     def get_predicate(self, name, session_id=_GLOBAL_SESSION_ID):
         """Retrieve the current value of the predicate 'name' from the
@@ -159,6 +287,8 @@ class Kernel():
 
         """
         if name == "result":
+            import numpy as np
+            from . import big5
             return big5.best_match(np.array([
                 float(self._sessions[session_id].get("neuroticism",0)),
                 float(self._sessions[session_id].get("extraversion",0)),
@@ -207,6 +337,7 @@ class Kernel():
             #print(float(self._sessions[session_id][name]) +  float(value))
             self._sessions[session_id][name] = str(float(self._sessions[session_id][name]) +  float(value))
         elif name[:6] == "ignore":
+            from . import big5
             big5.ignore_subject(name[7:])
         else:
             self._sessions[session_id][name] = value
@@ -222,9 +353,420 @@ class Kernel():
         If name is not a valid bot predicate, it will be created.
         """
         self._bot_predicates[name] = value
+        self._memo_generation += 1
         # Clumsy hack: if updating the bot name, we must update the name in the brain as well
         if name == "name":
             self._brain.set_bot_name(self.get_bot_predicate("name"))
+            self._reset_srai_aliases(self._brain)
+
+    def set_parse_cache(self, cache_dir):
+        """Cache parsed AIML files in the directory cache_dir.
+        Files whose contents haven't changed since they were cached are not parsed again by
+        learn().  Pass None to disable the cache.
+        """
+        if cache_dir is None:
+            self._parse_cache = None
+        else:
+            from . import parse_cache
+            self._parse_cache = parse_cache.ParseCache(cache_dir)
+
+    def set_parser_backend(self, backend):
+        """Select the AIML parser used by learn(): either "sax" (the default) or "expat", which
+        is faster.  See aiml_parser.create_parser().
+        """
+        if backend not in ("sax", "expat"):
+            raise ValueError("backend must be in ['sax', 'expat']")
+        self._parser_backend = backend
+
+    def set_streaming_learn(self, streaming):
+        """If streaming is true, learn() adds the categories to the brain in small batches as
+        they are parsed, instead of parsing the whole file first.  This bounds the memory needed
+        to learn large AIML files.  The catch is that the categories preceding an XML error are learned,
+        where otherwise a file that isn't well-formed is skipped altogether.
+        """
+        self._streaming_learn = bool(streaming)
+
+    def set_background_learn(self, background):
+        """If background is true, <learn> tags don't learn the file on the spot, but have it
+        reloaded into a new version of the brain in the background; see rebuild().  The file's
+        categories become available to later responses, and a long file doesn't hold up the
+        response containing the tag.
+        """
+        self._background_learn = bool(background)
+
+    def set_match_cache(self, max_size):
+        """Cache the results of the last max_size distinct pattern matches.  Recurring inputs,
+        like greetings, are answered without searching the brain again.  Learning or unlearning
+        anything empties the cache.  Pass 0 to disable the cache, which is the default.
+        """
+        with self._brain_lock:
+            self._brain.set_match_cache(max_size)
+
+    def set_match_engine(self, engine):
+        """Choose the pattern-matching engine: "backtracking", the default, or "automaton", which
+        takes time linear in the length of the input whatever the patterns are, but is slower
+        on typical inputs and is compiled again after every change to the brain.  Both find the
+        same matches.  See PatternMgr.set_match_engine().
+        """
+        with self._brain_lock:
+            self._brain.set_match_engine(engine)
+
+    def set_failure_memo(self, enabled):
+        """If enabled, the pattern matcher remembers the states it failed to match from during
+        each match, which keeps inputs that cause excessive backtracking, such as long runs of
+        one word against patterns with several wildcards, from taking exponential time.  It
+        slows down ordinary matches a little, so it's disabled by default.
+        """
+        with self._brain_lock:
+            self._brain.set_failure_memo(enabled)
+
+    def set_srai_memo(self, max_size):
+        """Remember the results of the last max_size distinct <srai> and <sr> reductions, where
+        the input was only handled by pure templates: templates that have no side effects and
+        whose result only depends on the input, 'that' and the topic (see _IMPURE_ELEMENTS).
+        Standard AIML sets reduce most inputs through several steps of such templates.  The
+        results are forgotten whenever the brain changes.  Pass 0 to disable the memo, which is
+        the default.
+        """
+        self._srai_memo = pattern_mgr.MatchCache(max_size) if max_size > 0 else None
+
+    def set_srai_collapsing(self, collapse):
+        """If collapse is true, categories whose template is nothing but a <srai> with constant
+        text (e.g. <srai>HELLO</srai>) are short-circuited: the chain of such redirects is
+        resolved once, and an input matching the first category is answered by the template at
+        the end of the chain right away.  Responses stay the same: the chain is only followed
+        through categories whose 'that' and topic are "*", and is skipped when a pattern
+        starting with "_" would win for the current 'that' and topic.  Chains ending in a
+        cycle, or longer than the recursion limit, aren't collapsed, and are reported in the
+        log.  The redirects skipped count against the recursion limit and the srai budget, and
+        as matches of their categories, like the reductions they stand for.
+
+        The redirects are collapsed when collapsing is enabled, and the result is kept up to
+        date as the brain changes, so that responses never wait for it.
+        """
+        with self._brain_lock:
+            self._collapse_srai = bool(collapse)
+            if self._collapse_srai:
+                self._reset_srai_aliases(self._brain)
+            else:
+                self._srai_aliases = None
+
+    def set_system_executor(self, executor):
+        """Use executor, a system_pool.SystemExecutor, to run the commands of <system>
+        elements.  It determines the timeout, the output limit, the number of commands that
+        may run at once and caching.  By default, a SystemExecutor with default settings is
+        created when the first command is run.  Responses don't hold up those of other
+        sessions while they wait for a command (see _process_system()).
+        """
+        self._system_executor = executor
+
+    def set_template_sharing(self, enabled):
+        """If enabled, identical templates learned from now on, and identical parts and
+        attributes of templates, are shared instead of kept in memory once for every category
+        (see the template_pool module).  template_pool_stats() reports how much memory this
+        saves.  The pool of templates takes some memory of its own, and keeps every template
+        it has seen alive, even after its categories are removed; disabling sharing once all
+        files are learned frees it, while the templates shared so far stay shared.  Sharing is
+        disabled by default.
+        """
+        with self._brain_lock:
+            self._share_templates = enabled
+            if not enabled:
+                self._template_pool = None
+
+    def set_gc_freeze(self, enabled):
+        """If enabled, bootstrap(), load_brain() and rebuild() finish by moving all objects
+        that are alive at that point, which are mostly the brain, out of the cyclic garbage
+        collector's sight (see gc.freeze()).  A full collection otherwise goes through every
+        node and template of the brain, which pauses responses for longer the bigger the brain
+        is.  Enabling it freezes the objects alive now as well, e.g. after calling learn().
+
+        Frozen objects are still freed once they are no longer referenced, but reference cycles
+        among them aren't collected, so this is meant for brains that are set up once and
+        rarely replaced.  The setting applies to the whole process; disabling it unfreezes all
+        frozen objects, including those frozen by others.
+        """
+        self._freeze_gc = enabled
+        if enabled:
+            self._freeze_brain()
+        else:
+            gc.unfreeze()
+
+    def _freeze_brain(self):
+        """Collect the garbage, then freeze the objects that are left; see set_gc_freeze()."""
+        start = time.perf_counter()
+        gc.collect()
+        gc.freeze()
+        logger.debug("Froze %d objects in %.2f seconds", gc.get_freeze_count(),
+                     time.perf_counter() - start)
+
+    def template_pool_stats(self):
+        """Return a dictionary with the statistics of template sharing, as returned by
+        template_pool.TemplatePool.stats(), or None if no template has been shared yet.
+        """
+        with self._brain_lock:
+            if self._template_pool is None:
+                return None
+            return self._template_pool.stats()
+
+    def set_hit_counting(self, enabled):
+        """If enabled, count how often each category is matched; see category_hits().  The
+        categories learned so far are counted from now on as well.  The counts take 4 to 8
+        bytes per category, plus those of categories removed or replaced since, until they
+        make up half of the counts; disabling counting drops them.
+        """
+        with self._brain_lock:
+            if not enabled:
+                self._hit_counts = None
+            elif self._hit_counts is None:
+                self._hit_counts = array.array("L")
+                self._brain.replace_templates(self._number_template)
+                self._reset_srai_aliases(self._brain)
+
+    def category_hits(self, reset=False):
+        """Return a dictionary mapping the (pattern, that, topic) of every category to the
+        number of times it was matched since hit counting was enabled, or None if it isn't.
+        A category reached through collapsed <srai> redirects (see set_srai_collapsing())
+        counts as matched too.  If reset is true, the counts start over afterwards.
+        """
+        with self._brain_lock:
+            counts = self._hit_counts
+            if counts is None:
+                return None
+            hits = {key: counts[tem[1][self._ID_ATTR]] for key, tem in self._brain.categories()
+                    if self._ID_ATTR in tem[1]}
+            if reset:
+                self._hit_counts = array.array("L", [0]) * len(counts)
+            return hits
+
+    def offload_templates(self, path, min_hits=1, cache_size=1000):
+        """Move the templates of the categories matched fewer than min_hits times since hit
+        counting was enabled (or reset, see category_hits()) to a file at path, so that memory
+        is only taken up by the templates in use.  Offloaded templates are read back when their
+        category is matched, and the last cache_size of them are kept in memory.  Returns the
+        number of templates moved.
+
+        Hit counting must be enabled.  The file mustn't exist yet, and is removed again by
+        close(); calls with the same path share the file and cache of the first one.  Calling
+        it with another path moves the templates offloaded so far to the new file, and removes
+        the old one.  Since the templates of an offloaded category are no longer shared with
+        others, the template pool is emptied (see set_template_sharing()).  Saved brains
+        contain the offloaded templates.
+        """
+        if self._hit_counts is None:
+            raise RuntimeError("Hit counting is not enabled")
+        start = time.perf_counter()
+        # responses are put on hold, so that none is left reading from a store that's closed
+        with self._respond_lock, self._brain_lock:
+            old_store = self._template_store
+            if old_store is None or old_store.path != os.path.abspath(path):
+                from . import template_store
+                self._template_store = template_store.TemplateStore(path, cache_size)
+            else:
+                old_store = None
+            counts = self._hit_counts
+            store = self._template_store
+            moved = []
+
+            def offload(tem):
+                attrs = tem[1]
+                if self._OFFLOADED_ATTR in attrs and old_store is not None:
+                    attrs = dict(attrs)
+                    attrs[self._OFFLOADED_ATTR] = store.add(old_store.get(
+                        attrs[self._OFFLOADED_ATTR]))
+                    return [tem[0], attrs]
+                if (self._OFFLOADED_ATTR in attrs or self._ID_ATTR not in attrs or
+                        counts[attrs[self._ID_ATTR]] >= min_hits):
+                    return tem
+                moved.append(tem)
+                return ["template", {self._ID_ATTR: attrs[self._ID_ATTR],
+                                     self._OFFLOADED_ATTR: store.add(tem)}]
+
+            self._brain.replace_templates(offload)
+            if old_store is not None:
+                old_store.close()
+            if self._template_pool is not None:
+                self._template_pool.clear()
+            self._reset_srai_aliases(self._brain)
+        logger.debug("Offloaded %d templates in %.2f seconds", len(moved),
+                     time.perf_counter() - start)
+        return len(moved)
+
+    def offload_stats(self):
+        """Return a dictionary with the statistics of the store of offloaded templates, as
+        returned by template_store.TemplateStore.stats(), or None if nothing was offloaded.
+        """
+        if self._template_store is None:
+            return None
+        return self._template_store.stats()
+
+    def close(self):
+        """Release the files the Kernel keeps open: the file of offloaded templates, which is
+        removed (see offload_templates()), and the brain journal (see set_brain_journal()).
+        The Kernel can't respond with offloaded templates anymore afterwards.
+        """
+        with self._brain_lock:
+            if self._template_store is not None:
+                self._template_store.close()
+            self.set_brain_journal(None)
+
+    def brain_report(self, top=10):
+        """Return a report of the shape of the brain and the memory it takes up: node counts and
+        bytes by depth and by source file, fanout and chain-length histograms, wildcard density,
+        the top biggest templates, and duplicate templates.  See the brain_report module, which
+        can also be run from the command line.
+        """
+        from . import brain_report
+        return brain_report.analyze(self._active_brain(), top)
+
+    def _number_template(self, tem):
+        """Return a copy of the template tem with an id of its own, which has no hits yet."""
+        self._hit_counts.append(0)
+        attrs = dict(tem[1])
+        attrs[self._ID_ATTR] = len(self._hit_counts) - 1
+        return [tem[0], attrs] + tem[2:]
+
+    def _compact_hit_counts(self, brain):
+        """Give the categories of brain new ids, keeping their hits, if more than half of the
+        ids belong to categories that were removed or replaced since they were handed out, so
+        that reloading files over and over doesn't grow the hit counts without bound.  Returns
+        True if the ids changed, in which case the srai aliases of brain are out of date.
+        """
+        counts = self._hit_counts
+        if counts is None or len(counts) <= 2 * brain.num_templates():
+            return False
+        self._hit_counts = array.array("L")
+
+        def renumber(tem):
+            template_id = tem[1].get(self._ID_ATTR)
+            tem = self._number_template(tem)
+            if template_id is not None and template_id < len(counts):
+                self._hit_counts[-1] = counts[template_id]
+            return tem
+
+        brain.replace_templates(renumber)
+        return True
+
+    def _count_hit(self, tem):
+        """Count a match of the category of the template tem, if it has an id.  The template is
+        recorded for the <srai> memo as well; see _srai().
+        """
+        counts = self._hit_counts
+        template_id = tem[1].get(self._ID_ATTR)
+        if counts is not None and template_id is not None and template_id < len(counts):
+            counts[template_id] += 1
+            hits = getattr(self._local, "hits", None)
+            if hits is not None:
+                hits.append(tem)
+
+    def _load_template(self, tem):
+        """Return the template tem, or the template it stands for if it was offloaded."""
+        key = tem[1].get(self._OFFLOADED_ATTR)
+        return tem if key is None else self._template_store.get(key)
+
+    def set_template_profiling(self, enabled, dump_interval=None):
+        """If enabled, record where the time of processing templates goes: the calls, the
+        cumulative and self time, and the deepest nesting level of every element type, and of
+        the word substitutions (named "wordsub person" etc.); see profile_stats().  The self
+        time of <srai> and <sr> includes matching their input.  If dump_interval isn't None, the
+        statistics are logged every dump_interval seconds.
+
+        Profiling wraps the element processors; disabling it puts the plain ones back, so it
+        costs nothing when disabled.  The statistics are dropped.
+        """
+        with self._respond_lock:
+            if enabled and self._profiler is not None:
+                self._profiler.dump_interval = dump_interval
+            elif enabled:
+                from . import tag_profiler
+                self._profiler = tag_profiler.TagProfiler(dump_interval)
+                self._plain_processors = self._element_processors
+                self._element_processors = {
+                    name: self._profiler.wrap(name, func)
+                    for name, func in self._plain_processors.items()}
+                for name in self._subbers:
+                    self._profile_subber(name)
+            elif self._profiler is not None:
+                self._element_processors = self._plain_processors
+                self._plain_processors = self._profiler = None
+                for subber in self._subbers.values():
+                    # the method of the class shows through again
+                    vars(subber).pop("sub", None)
+
+    def profile_stats(self, reset=False):
+        """Return a dictionary mapping every element type processed since template profiling
+        was enabled (see set_template_profiling()) to a dictionary with its calls, cumulative
+        and self time in seconds, and max_depth, the deepest nesting level of elements it was
+        processed at.  Returns None if profiling is disabled.  If reset is true, the statistics
+        start over afterwards.
+        """
+        profiler = self._profiler
+        if profiler is None:
+            return None
+        return profiler.stats(reset)
+
+    def _profile_subber(self, name):
+        """Have the profiler record the substitutions of the subber name."""
+        subber = self._subbers[name]
+        subber.sub = self._profiler.wrap("wordsub " + name, type(subber).sub.__get__(subber))
+
+    def set_srai_budget(self, max_hops):
+        """Limit the total number of <srai> and <sr> reductions a single response may go
+        through to max_hops.  Reductions beyond the budget yield an empty string.  Pass None to
+        remove the limit, which is the default.  Note that the recursion depth is limited
+        independently, see _MAX_RECURSION_DEPTH.
+        """
+        self._srai_budget = max_hops
+
+    def set_response_deadline(self, seconds, fallback=""):
+        """Give every call to respond() at most the given number of seconds, unless it passes a
+        deadline of its own.  A response that runs out of time is abandoned, and fallback is
+        returned instead; see timeout_stats().  Pass None to remove the limit, which is the
+        default.
+
+        The deadline is checked by the pattern matcher and between template elements, so a
+        single slow element, such as <system>, can overrun it.  Predicates set by the
+        abandoned response keep their new values.
+        """
+        self._response_deadline = seconds
+        self._deadline_fallback = fallback
+
+    def timeout_stats(self):
+        """Return a dictionary with the number of responses that ran out of time ("count"),
+        and a list describing the most recent ones ("recent").  Each item of the list is a
+        dictionary holding the input sentence ("input"), the inputs of the <srai> reductions in
+        progress, starting with the sentence ("stack"), and the pattern path the matcher was
+        exploring ("path"), or None if the deadline passed while processing a template.
+        """
+        return {"count": self._timeout_count, "recent": list(self._timeouts)}
+
+    def srai_limit_stats(self):
+        """Return a dictionary with the number of times a reduction was cut short because it
+        exceeded the maximum recursion depth ("max_depth"), because it was caught in a cycle
+        ("cycle"), or because the response ran out of its <srai> budget ("budget").
+        """
+        return dict(self._limit_counts)
+
+    def srai_memo_stats(self):
+        """Return a dictionary with the hits, misses, hit_rate, size and max_size of the
+        <srai> memo, or None if it is disabled.  See set_srai_memo().
+        """
+        if self._srai_memo is None:
+            return None
+        return self._srai_memo.stats()
+
+    def match_cache_stats(self):
+        """Return a dictionary with the hits, misses, hit_rate, size and max_size of the match
+        cache, or None if it is disabled.  See set_match_cache().
+        """
+        return self._active_brain().match_cache_stats()
+
+    def exact_index_stats(self):
+        """Return a dictionary with the hits, misses, hit_rate and size of the brain's exact
+        index, which answers matches of patterns without wildcards with a single lookup.  See
+        PatternMgr.exact_index_stats().
+        """
+        return self._active_brain().exact_index_stats()
 
     def load_subs(self, filename):
         """Load a substitutions file.
@@ -233,6 +775,7 @@ class Kernel():
         format).  Each section of the file is loaded into its own
         substituter.
         """
+        import configparser
         parser = configparser.ConfigParser()
         parser.read(filename)
         for s in parser.sections():
@@ -243,6 +786,10 @@ class Kernel():
             # iterate over the key,value pairs and add them to the subber
             for k, v in parser.items(s):
                 self._subbers[s][k] = v
+            if self._profiler is not None:
+                self._profile_subber(s)
+        self._memo_generation += 1
+        self._reset_srai_aliases(self._brain)
 
     def _add_session(self, session_id):
         """Create a new session with the specified ID string.
@@ -277,71 +824,477 @@ class Kernel():
     def learn(self, file_path):
         """Load and learn the contents of the specified AIML file.
         If filename includes wildcard characters, all matching files will be loaded and learned.
+
+        Safe to call while other threads respond; see _brain_changes().
+        """
+        with self._brain_changes() as apply:
+            self._learn(file_path, apply)
+
+    def _learn(self, file_path, apply):
+        """Does the work of learn(), making the changes to the brain with apply(); see
+        _brain_changes().
         """
         file_path = os.path.abspath(file_path)
         file_dir = os.path.dirname(file_path)
         for f in glob.iglob(file_path):
             logger.debug("Loading %s...", f)
-            start = time.clock()
-            # Load and parse the AIML file.
-            parser = aiml_parser.create_parser()
-            handler = parser.getContentHandler()
-            try:
-                parser.parse(f)
-            except xml.sax.SAXParseException as msg:
-                logger.error("Parse error: %s", msg)
-                continue
-            # store the pattern/template pairs in the PatternMgr.
-            for (pattern, that, topic), tem in handler.categories.items():
-                # make path to learn files absolute
-                for elem_name, _, *elem_children in tem[2:]:
-                    if elem_name == 'learn':
-                        elem_children[0][2] = os.path.join(file_dir, elem_children[0][2])
-
-                self._brain.add(pattern, that, topic, tem)
+            start = time.perf_counter()
+
+            if self._streaming_learn:
+                # store the pattern/template pairs in the PatternMgr in batches while the file is
+                # parsed, so that responses are only held up while a batch is stored.
+                batch = []
+
+                def learn_batch(brain):
+                    for key, tem in batch:
+                        self._add_category(brain, key, tem, file_dir, f)
+
+                def parsed(key, tem):
+                    batch.append((key, tem))
+                    if len(batch) >= self._STREAMING_BATCH_SIZE:
+                        apply(learn_batch)
+                        batch.clear()
+
+                well_formed = self._parse_file(f, parsed)
+                # the categories preceding an error are learned as well
+                apply(learn_batch)
+                if not well_formed:
+                    continue
+            else:
+                # Load and parse the whole AIML file, then store the pattern/template pairs in
+                # the PatternMgr.
+                categories = {}
+                if not self._parse_file(f, categories.__setitem__):
+                    continue
+
+                def learn_file(brain):
+                    for key, tem in categories.items():
+                        self._add_category(brain, key, tem, file_dir, f)
+
+                apply(learn_file)
             # Parsing was successful.
-            logger.debug("done (%.2f seconds)", time.clock() - start)
+            logger.debug("done (%.2f seconds)", time.perf_counter() - start)
 
-    def respond(self, input, session_id=_GLOBAL_SESSION_ID):
-        """Return the Kernel's response to the input string.
+    def unlearn(self, file_path):
+        """Forget all categories learned from the specified AIML file.
+        Returns the number of categories forgotten.
         """
-        if len(input) == 0:
-            return ""
+        file_path = os.path.abspath(file_path)
+        return self._change_brain(lambda brain: self._remove_source(brain, file_path))
 
-        # prevent other threads from stomping all over us.
-        self._respond_lock.acquire()
+    def _change_brain(self, change):
+        """Call change(brain) to change the brain, and return its result; see
+        _brain_changes().
+        """
+        with self._brain_changes() as apply:
+            return apply(change)
+
+    @contextlib.contextmanager
+    def _brain_changes(self):
+        """Return a context manager for changing the brain without letting respond() see a
+        brain that is being changed.  It provides a function apply(change), which calls
+        change(brain) and returns its result.  No lock is held in between calls.
+
+        As long as no other thread is responding, each change is made in place, and responses
+        are put on hold until it's done.  From the first change that finds a response in
+        progress on, the changes are made to a copy of the brain instead, which is published
+        like in rebuild() when the context is left, so that responses aren't held up.  The brain
+        is copied once at most, however many changes are made.
+        """
+        working = None
+
+        def apply(change):
+            nonlocal working
+            if working is None:
+                if self._respond_lock.acquire(blocking=False):
+                    try:
+                        # responses waiting for a <system> command have let go of the lock, but
+                        # they are still in progress
+                        if not self._system_sessions:
+                            with self._brain_lock:
+                                try:
+                                    return change(self._brain)
+                                finally:
+                                    self._update_srai_aliases()
+                                    if self._compact_hit_counts(self._brain):
+                                        self._reset_srai_aliases(self._brain)
+                    finally:
+                        self._respond_lock.release()
+                # other changes to the brain wait until the copy is published
+                self._brain_lock.acquire()
+                try:
+                    working = self._brain.copy()
+                except BaseException:
+                    self._brain_lock.release()
+                    raise
+            return change(working)
+
+        try:
+            yield apply
+            if working is not None:
+                self._compact_hit_counts(working)
+                self._reset_srai_aliases(working)
+                self._brain = working
+                if self._template_pool is not None:
+                    # the copy has templates of its own; don't keep those of the old version
+                    # alive
+                    self._template_pool.clear()
+        finally:
+            if working is not None:
+                self._brain_lock.release()
+        if working is not None and self._freeze_gc:
+            self._freeze_brain()
+
+    def reload(self, file_path):
+        """Replace the categories learned from the specified AIML file with its current contents.
+        Only the categories of this file are touched, so reloading takes time proportional to the
+        size of the file, not to the size of the brain.  If the file isn't well-formed XML, the
+        categories learned from it before are kept.  If it doesn't exist anymore, they are
+        forgotten.
+
+        Note that a category which the file had overridden, because an earlier file defined the
+        same pattern, isn't restored when the file stops defining it.
+
+        Responses are put on hold while the brain is updated; see rebuild() for a way to update
+        the brain without that.  While responses wait for <system> commands, a copy of the brain
+        is updated instead, like in learn().
+        """
+        file_path = os.path.abspath(file_path)
+        categories = self._parse_for_reload(file_path)
+        if categories is None:
+            return
+        with self._respond_lock:
+            if not self._system_sessions:
+                with self._brain_lock:
+                    self._reload_categories(self._brain, file_path, categories)
+                    self._update_srai_aliases()
+                    if self._compact_hit_counts(self._brain):
+                        self._reset_srai_aliases(self._brain)
+                return
+        # the responses waiting for a <system> command are still in progress, and there may be
+        # no end to them
+        self._change_brain(lambda brain: self._reload_categories(brain, file_path, categories))
+
+    def rebuild(self, file_paths, background=True):
+        """Reload the specified AIML files (see reload()) into a new version of the brain, and
+        switch over to it once it's complete.  Wildcards are expanded like in learn().
+
+        The new version starts out as a copy of the current brain, which keeps serving responses
+        in the meantime.  Responses that are in progress when the switch happens finish with the
+        brain they started with.  If background is true, the work is done in a new thread, which
+        is returned.
+        """
+        if not isinstance(file_paths, (list, tuple)):
+            file_paths = [file_paths]
+        paths = []
+        for file_path in file_paths:
+            file_path = os.path.abspath(file_path)
+            # a path that doesn't match anything anymore may be a deleted file
+            paths.extend(glob.glob(file_path) or [file_path])
+        if not background:
+            self._rebuild(paths)
+            return None
+        thread = threading.Thread(target=self._rebuild, args=(paths,), name="aiml-rebuild")
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _rebuild(self, file_paths):
+        """Does the work of rebuild()."""
+        start = time.perf_counter()
+        parsed = []
+        for file_path in file_paths:
+            categories = self._parse_for_reload(file_path)
+            if categories is not None:
+                parsed.append((file_path, categories))
+        with self._brain_lock:
+            brain = self._brain.copy()
+            for file_path, categories in parsed:
+                self._reload_categories(brain, file_path, categories)
+            brain.set_bot_name(self.get_bot_predicate("name"))
+            self._compact_hit_counts(brain)
+            self._reset_srai_aliases(brain)
+            # publish the new version.  A single assignment, so no locking is needed on the
+            # reading side.
+            self._brain = brain
+            if self._template_pool is not None:
+                # the copy has templates of its own; don't keep those of the old version alive
+                self._template_pool.clear()
+        if self._freeze_gc:
+            self._freeze_brain()
+        logger.debug("Rebuilt brain from %d files in %.2f seconds",
+                     len(parsed), time.perf_counter() - start)
+
+    def _parse_for_reload(self, file_path):
+        """Parse the AIML file file_path and return its categories dictionary, which is empty
+        if the file doesn't exist.  Return None if the file isn't well-formed XML.
+        """
+        categories = {}
+        if os.path.exists(file_path) and not self._parse_file(file_path,
+                                                              categories.__setitem__):
+            logger.error("Not reloading %s", file_path)
+            return None
+        return categories
+
+    def _reload_categories(self, brain, file_path, categories):
+        """Replace the categories learned from file_path in brain with categories."""
+        file_dir = os.path.dirname(file_path)
+        self._remove_source(brain, file_path)
+        for key, tem in categories.items():
+            self._add_category(brain, key, tem, file_dir, file_path)
 
-        # Add the session, if it doesn't already exist
-        self._add_session(session_id)
+    def learned_files(self):
+        """Return a list of the AIML files the brain contains categories from."""
+        return self._brain.sources()
 
-        # split the input into discrete sentences
-        sentences = utils.sentences(input)
-        final_response = ""
-        for s in sentences:
-            # Add the input to the history list before fetching the
-            # response, so that <input/> tags work properly.
-            input_history = self.get_predicate(self._INPUT_HISTORY, session_id)
-            input_history.append(s)
-            del input_history[:-self._MAX_HISTORY_SIZE]
+    def watch(self, file_paths=None, interval=2.0):
+        """Start watching AIML files for changes, and rebuild() the brain with the files that
+        changed.  The files are polled every interval seconds.  file_paths is a list of paths,
+        which may include wildcards; new files matching them are learned as well.  By default,
+        the files returned by learned_files() are watched.
 
-            # Fetch the response
-            response = self._respond(s, session_id)
+        Returns the BrainWatcher doing the work; call its stop() method to stop watching.
+        """
+        from . import brain_watcher
+        watcher = brain_watcher.BrainWatcher(self, file_paths, interval)
+        watcher.start()
+        return watcher
+
+    def _add_category(self, brain, key, tem, file_dir, source):
+        """Add a category parsed from the AIML file source, in the directory file_dir, to
+        brain.
+        """
+        pattern, that, topic = key
+        # make path to learn files absolute
+        for elem_name, _, *elem_children in tem[2:]:
+            if elem_name == 'learn':
+                elem_children[0][2] = os.path.join(file_dir, elem_children[0][2])
+        self._reduce_whitespace(tem)
+        tem[1][self._PURE_FLAG] = self._is_pure(tem)
+        if self._hit_counts is not None:
+            self._hit_counts.append(0)
+            tem[1][self._ID_ATTR] = len(self._hit_counts) - 1
+        # templates must not change after this point, since they may be shared
+        if self._share_templates:
+            if self._template_pool is None:
+                from . import template_pool
+                self._template_pool = template_pool.TemplatePool()
+            tem = self._template_pool.intern(tem)
+        brain.add(pattern, that, topic, tem, source)
+        aliases = self._srai_aliases
+        if aliases is not None and aliases.brain is brain:
+            aliases.added(key, tem)
+        if self._journal is not None:
+            self._journal.add(pattern, that, topic, tem, source)
+
+    def _remove_source(self, brain, source):
+        """Remove the categories learned from the AIML file source from brain."""
+        if self._journal is not None:
+            self._journal.remove_source(source)
+        aliases = self._srai_aliases
+        if aliases is None or aliases.brain is not brain:
+            return brain.remove_source(source)
+        keys = list(brain._files.get(source, ()))
+        count = brain.remove_source(source)
+        for key in keys:
+            aliases.removed(key)
+        return count
+
+    def _reduce_whitespace(self, elem):
+        """Reduce the whitespace of the text elements in elem the way _process_text() does,
+        and mark them as done.
+        """
+        if elem[0] == "text":
+            if elem[1]["xml:space"] == "default":
+                elem[1] = {"xml:space": "preserve"}
+                elem[2] = re.sub(r"\s+", " ", elem[2])
+            return
+        for e in elem[2:]:
+            if isinstance(e, list):
+                self._reduce_whitespace(e)
+
+    def _is_pure(self, elem):
+        """Return True if elem contains none of the _IMPURE_ELEMENTS."""
+        if elem[0] in self._IMPURE_ELEMENTS:
+            return False
+        return all(self._is_pure(e) for e in elem[2:] if isinstance(e, list))
+
+    def _template_is_pure(self, tem):
+        """Return True if the template tem is pure.  The analysis is done when the template is
+        learned; templates from brains saved by older versions are analysed on first use.
+        """
+        try:
+            return tem[1][self._PURE_FLAG]
+        except KeyError:
+            pure = tem[1][self._PURE_FLAG] = self._is_pure(tem)
+            return pure
 
-            # add the data from this exchange to the history lists
-            output_history = self.get_predicate(self._OUTPUT_HISTORY, session_id)
-            output_history.append(response)
-            del output_history[:-self._MAX_HISTORY_SIZE]
+    def _constant_srai(self, tem):
+        """If the template tem is a constant redirect, i.e. a single <srai> element containing
+        only text, return the text.  Otherwise return None.
+        """
+        children = [e for e in tem[2:] if e[0] != "text" or e[2].strip()]
+        if len(children) != 1 or children[0][0] != "srai":
+            return None
+        if any(e[0] != "text" for e in children[0][2:]):
+            return None
+        text = "".join(e[2] for e in children[0][2:])
+        return text if text.strip() else None
+
+    def _reset_srai_aliases(self, brain):
+        """If collapsing is enabled, collapse the <srai> redirects of brain, which is the
+        current brain or about to become it, from scratch.
+        """
+        if not self._collapse_srai:
+            return
+        from . import srai_aliases
+        aliases = srai_aliases.SraiAliases(brain, self._constant_srai,
+                                           lambda text: self._subbers['normal'].sub(text),
+                                           self._MAX_RECURSION_DEPTH)
+        with self._brain_lock:
+            aliases.build()
+            self._srai_aliases = aliases
+
+    def _update_srai_aliases(self):
+        """Bring the collapsed <srai> redirects up to date with the changes made to the brain
+        in place.
+        """
+        if self._srai_aliases is not None:
+            self._srai_aliases.update()
 
-            # append this response to the final response.
-            final_response += (response + "  ")
-        final_response = final_response.strip()
+    def _get_srai_aliases(self, brain):
+        """Return a dictionary mapping id(template) of every collapsed <srai> redirect of brain
+        to the (input, template, guards) it leads to.  It's empty for a brain that has been
+        replaced by now; responses that started with it are answered without collapsing.
+        """
+        aliases = self._srai_aliases
+        if aliases is None or aliases.brain is not brain:
+            return {}
+        return aliases.aliases
+
+    def _active_brain(self):
+        """Return the brain the current thread should use: the one respond() started with, so
+        that a rebuild() doesn't switch brains in the middle of a response.
+        """
+        brain = getattr(self._local, "brain", None)
+        return self._brain if brain is None else brain
+
+    def _parse_file(self, file_path, callback):
+        """Parse the AIML file file_path, or fetch it from the parse cache, and pass each of its
+        categories to callback as ((pattern, that, topic), template).
+        Return False if the file isn't well-formed XML, in which case callback may have been
+        called for some of the categories before the error.
+        """
+        if self._parse_cache is not None:
+            records = self._parse_cache.load_records(file_path)
+            if records is not None:
+                logger.debug("Using cached categories for %s", file_path)
+                for key, tem in records:
+                    callback(key, tem)
+                return True
+            writer = self._parse_cache.writer(file_path)
+
+            def parser_callback(key, tem):
+                writer.add(key, tem)
+                callback(key, tem)
+        else:
+            writer = None
+            parser_callback = callback
+        import xml.sax
+        from . import aiml_parser
+        parser = aiml_parser.create_parser(self._parser_backend, parser_callback)
+        try:
+            parser.parse(file_path)
+        except xml.sax.SAXParseException as msg:
+            logger.error("Parse error: %s", msg)
+            if writer is not None:
+                writer.abort()
+            return False
+        if writer is not None:
+            writer.commit()
+        return True
+
+    def respond(self, input, session_id=_GLOBAL_SESSION_ID, deadline=None):
+        """Return the Kernel's response to the input string.
 
-        assert len(self.get_predicate(self._INPUT_STACK, session_id)) == 0
+        deadline is the number of seconds the response may take, overriding the default set
+        with set_response_deadline().
+        """
+        if len(input) == 0:
+            return ""
 
-        # release the lock and return
-        self._respond_lock.release()
+        # prevent other threads from stomping all over us.
+        self._respond_lock.acquire()
+        # a response of the same session waiting for a <system> command goes first
+        while session_id in self._system_sessions:
+            self._system_done.wait()
+        # stick to the current version of the brain until we're done, even if a rebuild()
+        # publishes a new one.
+        outer_brain = getattr(self._local, "brain", None)
+        self._local.brain = self._brain
+        outer_deadline = getattr(self._local, "deadline", None)
+        if deadline is None:
+            deadline = self._response_deadline
+        if deadline is not None:
+            deadline += time.monotonic()
+        if outer_deadline is not None:
+            deadline = outer_deadline if deadline is None else min(deadline, outer_deadline)
+        self._local.deadline = deadline
+        try:
+            # Add the session, if it doesn't already exist
+            self._add_session(session_id)
+            stack_depth = len(self.get_predicate(self._INPUT_STACK, session_id))
+
+            # split the input into discrete sentences
+            sentences = utils.sentences(input)
+            final_response = ""
+            for s in sentences:
+                # Add the input to the history list before fetching the
+                # response, so that <input/> tags work properly.
+                input_history = self.get_predicate(self._INPUT_HISTORY, session_id)
+                input_history.append(s)
+                del input_history[:-self._MAX_HISTORY_SIZE]
+
+                # Fetch the response
+                try:
+                    response = self._respond(s, session_id)
+                    timed_out = False
+                except pattern_mgr.MatchTimeout as timeout:
+                    response = self._abandon_response(s, timeout, stack_depth, session_id)
+                    timed_out = True
+
+                # add the data from this exchange to the history lists
+                output_history = self.get_predicate(self._OUTPUT_HISTORY, session_id)
+                output_history.append(response)
+                del output_history[:-self._MAX_HISTORY_SIZE]
+
+                # append this response to the final response.
+                final_response += (response + "  ")
+                if timed_out:
+                    break  # the remaining sentences would run out of time as well
+            final_response = final_response.strip()
+
+            assert len(self.get_predicate(self._INPUT_STACK, session_id)) == stack_depth
+        finally:
+            # release the lock and return
+            self._local.brain = outer_brain
+            self._local.deadline = outer_deadline
+            self._respond_lock.release()
         return final_response
 
+    def _abandon_response(self, input, timeout, stack_depth, session_id):
+        """Clean up after the response to the sentence input ran out of time, record the
+        timeout, and return the fallback response.
+        """
+        input_stack = self.get_predicate(self._INPUT_STACK, session_id)
+        logger.warning("Response deadline exceeded (input='%s', path=%s)", input,
+                       None if timeout.path is None else ' '.join(timeout.path))
+        self._timeout_count += 1
+        self._timeouts.append({"input": input, "stack": input_stack[stack_depth:],
+                               "path": None if timeout.path is None else ' '.join(timeout.path)})
+        self.set_predicate(self._INPUT_STACK, input_stack[:stack_depth], session_id)
+        return self._deadline_fallback
+
     # This version of _respond() just fetches the response for some input.
     # It does not mess with the input and output histories.  Recursive calls to respond() spawned
     # from tags like <srai> should call this function instead of respond().
@@ -355,7 +1308,25 @@ class Kernel():
         input_stack = self.get_predicate(self._INPUT_STACK, session_id)
         if len(input_stack) > self._MAX_RECURSION_DEPTH:
             logger.warning("Maximum recursion depth exceeded (input='%s')", input)
+            self._limit_counts["max_depth"] += 1
+            # a truncated response mustn't be memoized
+            self._local.impure = True
             return ""
+        if not input_stack:
+            # a new response.  Keep track of the (input, that, topic) states the reductions
+            # in progress are in, to catch cycles; the epoch changes whenever an impure template
+            # is used, because that may lead to a different response to the same input.
+            self._local.states = set()
+            self._local.epoch = 0
+            self._local.hops = 0
+        else:
+            self._local.hops += 1
+            if self._srai_budget is not None and self._local.hops > self._srai_budget:
+                logger.warning("<srai> budget of %d reductions exceeded (input='%s')",
+                               self._srai_budget, input)
+                self._limit_counts["budget"] += 1
+                self._local.impure = True
+                return ""
 
         # push the input onto the input stack
         input_stack = self.get_predicate(self._INPUT_STACK, session_id)
@@ -376,14 +1347,18 @@ class Kernel():
 
         # Determine the final response.
         response = ""
-        elem = self._brain.match(subbed_input, subbed_that, subbed_topic)
-        if elem is None:
-            logger.warning("No match found for input: %s", input)
+        state = (' '.join(subbed_input.upper().split()), ' '.join(subbed_that.upper().split()),
+                 ' '.join(subbed_topic.upper().split()), self._local.epoch)
+        if state in self._local.states:
+            # nothing has changed since we were here before, so we'd go round in circles
+            logger.warning("<srai> cycle detected (input='%s')", input)
+            self._limit_counts["cycle"] += 1
+            self._local.impure = True
         else:
-            # Process the element into a response string.
-            response += self._process_element(elem, session_id).strip()
-            response += " "
-        response = response.strip()
+            self._local.states.add(state)
+            response = self._respond_to_state(input_stack, subbed_input, subbed_that,
+                                              subbed_topic, session_id)
+            self._local.states.discard(state)
 
         # pop the top entry off the input stack.
         input_stack = self.get_predicate(self._INPUT_STACK, session_id)
@@ -392,6 +1367,71 @@ class Kernel():
 
         return response
 
+    def _respond_to_state(self, input_stack, subbed_input, subbed_that, subbed_topic,
+                          session_id):
+        """Match the substituted input, that and topic, and return the processed template."""
+        response = ""
+        brain = self._active_brain()
+        elem = brain.match(subbed_input, subbed_that, subbed_topic,
+                           getattr(self._local, "deadline", None))
+        if elem is not None and self._hit_counts is not None:
+            self._count_hit(elem)
+        entered = None
+        if elem is not None and self._collapse_srai:
+            alias = self._get_srai_aliases(brain).get(id(elem))
+            if alias is not None:
+                entered = self._enter_srai_alias(brain, alias, input_stack, subbed_that,
+                                                 subbed_topic)
+                if entered is not None:
+                    elem = alias[1]
+        if elem is None:
+            logger.warning("No match found for input: %s", input_stack[-1])
+        else:
+            if self._template_store is not None:
+                elem = self._load_template(elem)
+            if not self._template_is_pure(elem):
+                self._local.impure = True
+                self._local.epoch += 1
+            # Process the element into a response string.
+            response += self._process_element(elem, session_id).strip()
+            response += " "
+        if entered is not None:
+            # leave the chain of redirects
+            self._local.states.difference_update(entered)
+            input_stack = self.get_predicate(self._INPUT_STACK, session_id)
+            del input_stack[-len(entered):]
+            self.set_predicate(self._INPUT_STACK, input_stack, session_id)
+        return response.strip()
+
+    def _enter_srai_alias(self, brain, alias, input_stack, subbed_that, subbed_topic):
+        """Take the shortcut of the collapsed chain of redirects alias (see
+        set_srai_collapsing()), if it ends up where following the chain one <srai> at a time
+        would.  The inputs of the redirects are pushed onto the input stack, and the
+        reductions they stand for are counted against the srai budget, and as category hits.
+        Return the states entered (see _respond()), or None if the guards of the chain fail,
+        or a reduction would run into a limit, in which case the chain has to be followed.
+        """
+        steps = alias[3]
+        if not brain.guards_pass(alias[2], subbed_that, subbed_topic):
+            return None
+        if len(input_stack) + len(steps) - 1 > self._MAX_RECURSION_DEPTH:
+            return None
+        if self._srai_budget is not None and self._local.hops + len(steps) > self._srai_budget:
+            return None
+        that = ' '.join(subbed_that.upper().split())
+        topic = ' '.join(subbed_topic.upper().split())
+        states = [(' '.join(self._subbers['normal'].sub(input).upper().split()), that, topic,
+                   self._local.epoch) for input, _ in steps]
+        if any(state in self._local.states for state in states):
+            return None
+        self._local.states.update(states)
+        self._local.hops += len(steps)
+        input_stack.extend(input for input, _ in steps)
+        if self._hit_counts is not None:
+            for _, tem in steps:
+                self._count_hit(tem)
+        return states
+
     def _process_element(self, elem, session_id):
         """Process an AIML element.
         The first item of the elem list is the name of the element's XML tag.  The second item is a
@@ -399,6 +1439,9 @@ class Kernel():
         items in the list are the elements enclosed by the current element's begin and end tags;
         they are handled by each element's handler function.
         """
+        deadline = getattr(self._local, "deadline", None)
+        if deadline is not None and time.monotonic() > deadline:
+            raise pattern_mgr.MatchTimeout()
         try:
             handler_func = self._element_processors[elem[0]]
         except KeyError:
@@ -497,6 +1540,9 @@ class Kernel():
                             found_match = True
                             response += self._process_element(li, session_id)
                             break
+                    except pattern_mgr.MatchTimeout:
+                        # out of time; not an error in the condition
+                        raise
                     except:
                         # No attributes, no name/value attributes, no
                         # such predicate/session, or processing error.
@@ -510,11 +1556,15 @@ class Kernel():
                         li_attr = li[1]
                         if not ('name' in li_attr or 'value' in li_attr):
                             response += self._process_element(li, session_id)
+                    except pattern_mgr.MatchTimeout:
+                        raise
                     except:
                         # list_items was empty, no attributes, missing
                         # name/value attributes, or processing error.
                         logger.exception("error in default listitem")
                         raise
+            except pattern_mgr.MatchTimeout:
+                raise
             except:
                 # Some other catastrophic cataclysm
                 logger.fatal("Catastrophic condition failure")
@@ -622,7 +1672,10 @@ class Kernel():
         file_path = ""
         for e in elem[2:]:
             file_path += self._process_element(e, session_id)
-        self.learn(file_path)
+        if self._background_learn:
+            self.rebuild(file_path)
+        else:
+            self.learn(file_path)
         return ""
 
     # <li>
@@ -751,7 +1804,7 @@ class Kernel():
         <sr> elements are shortcuts for <srai><star/></srai>.
         """
         star = self._process_element(['star', {}], session_id)
-        response = self._respond(star, session_id)
+        response = self._srai(star, session_id)
         return response
 
     # <srai>
@@ -765,7 +1818,48 @@ class Kernel():
         new_input = ""
         for e in elem[2:]:
             new_input += self._process_element(e, session_id)
-        return self._respond(new_input, session_id)
+        return self._srai(new_input, session_id)
+
+    def _srai(self, input, session_id):
+        """Return the response to input, which comes from a <srai> or <sr> element.  If the
+        srai memo is enabled, the response is looked up there first, and memoized if it was
+        produced by pure templates only.  The memo remembers the reductions and category hits
+        the response took as well, which are counted again when it's used.
+        """
+        memo = self._srai_memo
+        if memo is None:
+            return self._respond(input, session_id)
+        output_history = self.get_predicate(self._OUTPUT_HISTORY, session_id)
+        that = output_history[-1] if output_history else ""
+        key = (input, that, self.get_predicate("topic", session_id))
+        version = (self._active_brain().version(), self._memo_generation)
+        entry = memo.get(key, version)
+        if entry is not None:
+            response, hops, hits = entry
+            # the reductions mustn't go past the limits they'd run into if they were made again
+            depth = len(self.get_predicate(self._INPUT_STACK, session_id)) + hops - 1
+            if depth <= self._MAX_RECURSION_DEPTH and (
+                    self._srai_budget is None or self._local.hops + hops <= self._srai_budget):
+                self._local.hops += hops
+                for tem in hits:
+                    self._count_hit(tem)
+                return response
+        outer_impure = getattr(self._local, "impure", False)
+        outer_hits = getattr(self._local, "hits", None)
+        self._local.impure = False
+        self._local.hits = []
+        start_hops = self._local.hops
+        try:
+            response = self._respond(input, session_id)
+            if not self._local.impure:
+                memo.put(key, (response, self._local.hops - start_hops, tuple(self._local.hits)),
+                         version)
+        finally:
+            self._local.impure = outer_impure or self._local.impure
+            if outer_hits is not None:
+                outer_hits.extend(self._local.hits)
+            self._local.hits = outer_hits
+        return response
 
     # <star>
     def _process_star(self, elem, session_id):
@@ -793,7 +1887,8 @@ class Kernel():
         except:
             that = ""  # there might not be any output yet
         topic = self.get_predicate("topic", session_id)
-        response = self._brain.star("star", input, that, topic, index)
+        response = self._active_brain().star("star", input, that, topic, index,
+                                             getattr(self._local, "deadline", None))
         return response
 
     # <system>
@@ -802,7 +1897,14 @@ class Kernel():
         <system> elements process their contents recursively, and then
         attempt to execute the results as a shell command on the
         server.  The AIML interpreter blocks until the command is
-        complete, and then returns the command's output.
+        complete, and then returns the command's output.  See
+        set_system_executor() for the limits imposed on commands.
+
+        While the command runs, responses of other sessions go on;
+        those of the same session wait for this one to finish.  If
+        the response runs out of time first, it stops waiting, and
+        the command goes on, until the executor's timeout if it has
+        one.
 
         For cross-platform compatibility, any file paths inside
         <system> tags should use Unix-style forward slashes ("/") as a
@@ -821,18 +1923,34 @@ class Kernel():
         #command = executable + " " + args
         command = os.path.normpath(command)
 
-        # execute the command.
-        response = ""
+        # execute the command, with a timeout and a limit on the output size.
+        if self._system_executor is None:
+            from . import system_pool
+            self._system_executor = system_pool.SystemExecutor()
+        future = self._system_executor.submit(command)
+        if future.done() or getattr(self._local, "brain", None) is None:
+            # outside of respond() (e.g. bootstrap()), there's no respond lock to let go of
+            return future.result()
+        # wait without holding the respond lock, so one slow command doesn't hold up every
+        # session
+        deadline = getattr(self._local, "deadline", None)
+        future.add_done_callback(self._notify_system_done)
+        self._system_sessions.add(session_id)
         try:
-            out = os.popen(command)
-        except RuntimeError as msg:
-            logger.warning("RuntimeError while processing \"system\" element:\n%s", msg)
-            return "There was an error while computing my response.  Please inform my botmaster."
-        time.sleep(0.01)  # I'm told this works around a potential IOError exception.
-        for line in out:
-            response += line + "\n"
-        response = ' '.join(response.splitlines()).strip()
-        return response
+            while not future.done():
+                timeout = None if deadline is None else deadline - time.monotonic()
+                if timeout is not None and timeout <= 0:
+                    raise pattern_mgr.MatchTimeout()
+                self._system_done.wait(timeout)
+        finally:
+            self._system_sessions.discard(session_id)
+            self._system_done.notify_all()
+        return future.result()
+
+    def _notify_system_done(self, future):
+        """Wake up the responses waiting for <system> commands; see _process_system()."""
+        with self._system_done:
+            self._system_done.notify_all()
 
     # <template>
     def _process_template(self, elem, session_id):
@@ -860,11 +1978,11 @@ class Kernel():
             raise TypeError("Text element contents are not text")
 
         # If the the whitespace behavior for this element is "default", we reduce all stretches of
-        # >1 whitespace characters to a single space.  To improve performance, we do this only once
-        # for each text element encountered, and save the results for the future.
+        # >1 whitespace characters to a single space.  This is done when templates are learned
+        # (see _reduce_whitespace()); only templates of brains saved by older versions get here
+        # with "default".  Templates may be shared, so they are left unchanged.
         if elem[1]["xml:space"] == "default":
-            elem[2] = re.sub("\s+", " ", elem[2])
-            elem[1]["xml:space"] = "preserve"
+            return re.sub(r"\s+", " ", elem[2])
         return elem[2]
 
     # <that>
@@ -918,7 +2036,8 @@ class Kernel():
         except:
             that = ""  # there might not be any output yet
         topic = self.get_predicate("topic", session_id)
-        response = self._brain.star("thatstar", input, that, topic, index)
+        response = self._active_brain().star("thatstar", input, that, topic, index,
+                                             getattr(self._local, "deadline", None))
         return response
 
     # <think>
@@ -958,7 +2077,8 @@ class Kernel():
         except:
             that = ""  # there might not be any output yet
         topic = self.get_predicate("topic", session_id)
-        response = self._brain.star("topicstar", input, that, topic, index)
+        response = self._active_brain().star("topicstar", input, that, topic, index,
+                                             getattr(self._local, "deadline", None))
         return response
 
     # <uppercase>
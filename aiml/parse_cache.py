@@ -0,0 +1,220 @@
+"""
+This module implements the ParseCache class, an on-disk cache of parsed AIML files.
+
+Each AIML file is stored in its own cache entry, keyed by the file's absolute path.  An entry
+records the SHA-1 digest of the file contents it was built from, so a file that changed on disk
+is simply reparsed.  Entries are stored in marshal format, which is the same format used for
+saved brains and is very fast to load.  The categories of an entry are stored one record at a
+time, so they can be written while the file is parsed and read back one by one.
+
+Usage:
+    > cache = ParseCache("/var/cache/pyaiml")
+    > categories = cache.load("std-hello.aiml")
+    > if categories is None:
+    >     categories = parse("std-hello.aiml")
+    >     cache.store("std-hello.aiml", categories)
+"""
+import hashlib
+import io
+import logging
+import marshal
+import os
+import tempfile
+
+from . import __version__
+
+
+logger = logging.getLogger(__name__)
+
+# Bump this whenever the parser starts producing differently shaped categories, or when the
+# layout of a cache entry changes.  Entries written with a different format are ignored.
+CACHE_FORMAT = 2
+
+
+def _iter_records(payload):
+    """Yield the (key, template) records stored in the bytes object payload."""
+    stream = io.BytesIO(payload)
+    while True:
+        record = marshal.load(stream)
+        if record is None:
+            return
+        yield record
+
+
+class ParseCache():
+    """On-disk cache of parsed AIML categories.
+
+    Besides the on-disk entries, the cache keeps the most recently used entry of every file in
+    memory, together with the file's modification time and size.  As long as those don't change,
+    loading the file again neither reads nor hashes it.
+    """
+    _SUFFIX = ".aimlc"
+
+    def __init__(self, cache_dir):
+        self._cache_dir = os.path.abspath(cache_dir)
+        os.makedirs(self._cache_dir, exist_ok=True)
+        # the header every valid entry must start with
+        self._header = (CACHE_FORMAT, __version__, marshal.version)
+        # maps a file path to a tuple (mtime_ns, size, digest, payload)
+        self._memo = {}
+        # maps a file path to the (mtime_ns, size, digest) seen by the last load() that missed,
+        # so that the entry written next records the version of the file that was parsed.
+        self._missed = {}
+
+    def _entry_path(self, file_path):
+        """Return the path of the cache entry for the AIML file file_path."""
+        name = hashlib.sha1(file_path.encode("utf-8")).hexdigest()
+        return os.path.join(self._cache_dir, name + self._SUFFIX)
+
+    def _digest(self, file_path):
+        """Return the hex digest of the contents of file_path."""
+        with open(file_path, "rb") as in_file:
+            return hashlib.sha1(in_file.read()).hexdigest()
+
+    def load(self, file_path):
+        """Return the categories dictionary cached for file_path, or None if there is no valid
+        entry for the current contents of the file.
+
+        Every call returns a fresh copy of the categories, so the caller is free to modify them.
+        """
+        records = self.load_records(file_path)
+        if records is None:
+            return None
+        return dict(records)
+
+    def load_records(self, file_path):
+        """Like load(), but return an iterator over the ((pattern, that, topic), template)
+        records of the entry, in the order they were added.  Keys can repeat, in which case the
+        later record wins.
+        """
+        file_path = os.path.abspath(file_path)
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return None
+        memo = self._memo.get(file_path)
+        if memo is not None and memo[:2] == (st.st_mtime_ns, st.st_size):
+            return _iter_records(memo[3])
+
+        digest = self._digest(file_path)
+        if memo is not None and memo[2] == digest:
+            # touched, but not changed
+            self._memo[file_path] = (st.st_mtime_ns, st.st_size, digest, memo[3])
+            return _iter_records(memo[3])
+        payload = None
+        try:
+            with open(self._entry_path(file_path), "rb") as in_file:
+                header = marshal.load(in_file)
+                entry_digest = marshal.load(in_file)
+                if header == self._header and entry_digest == digest:
+                    payload = in_file.read()
+        except (OSError, EOFError, ValueError, TypeError):
+            payload = None
+        if payload is None:
+            self._missed[file_path] = (st.st_mtime_ns, st.st_size, digest)
+            return None
+        self._memo[file_path] = (st.st_mtime_ns, st.st_size, digest, payload)
+        return _iter_records(payload)
+
+    def store(self, file_path, categories):
+        """Store the categories dictionary parsed from file_path in the cache.
+
+        Must be called before the categories are modified.
+        """
+        writer = self.writer(file_path)
+        for key, template in categories.items():
+            writer.add(key, template)
+        writer.commit()
+
+    def writer(self, file_path):
+        """Return an EntryWriter, which stores the categories of file_path one at a time."""
+        file_path = os.path.abspath(file_path)
+        try:
+            version = self._missed.pop(file_path)
+        except KeyError:
+            try:
+                st = os.stat(file_path)
+                version = (st.st_mtime_ns, st.st_size, self._digest(file_path))
+            except OSError:
+                return EntryWriter(None, None, None)
+        self._memo.pop(file_path, None)
+
+        def committed(payload):
+            # loading the file again needn't read the entry back
+            self._memo[file_path] = version + (payload,)
+
+        return EntryWriter(self._cache_dir, self._entry_path(file_path),
+                           (self._header, version[2]), committed)
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        self._memo.clear()
+        self._missed.clear()
+        for name in os.listdir(self._cache_dir):
+            if name.endswith(self._SUFFIX):
+                os.remove(os.path.join(self._cache_dir, name))
+
+
+class EntryWriter():
+    """Writes a cache entry one category at a time.
+
+    The entry is written to a temporary file, which replaces the actual entry on commit(), so
+    readers never see a partial entry.  If the entry can't be written, the writer silently
+    discards everything.  Otherwise on_commit, if given, is called with the records of the
+    entry once it's in place, as stored after the header.
+    """
+
+    def __init__(self, cache_dir, entry_path, header, on_commit=None):
+        self._entry_path = entry_path
+        self._on_commit = on_commit
+        self._out_file = self._tmp_path = None
+        # the records, which are written out on commit()
+        self._payload = io.BytesIO()
+        if entry_path is None:
+            return
+        try:
+            fd, self._tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+            self._out_file = os.fdopen(fd, "wb")
+            for item in header:
+                marshal.dump(item, self._out_file)
+        except OSError:
+            logger.exception("Error creating parse cache entry %s:", entry_path)
+            self.abort()
+
+    def add(self, key, template):
+        """Append a category to the entry.  Must be called before the template is modified."""
+        if self._out_file is None:
+            return
+        marshal.dump((key, template), self._payload)
+
+    def commit(self):
+        """Finish the entry and make it visible."""
+        if self._out_file is None:
+            return
+        marshal.dump(None, self._payload)
+        payload = self._payload.getvalue()
+        try:
+            self._out_file.write(payload)
+            self._out_file.close()
+            self._out_file = None
+            os.replace(self._tmp_path, self._entry_path)
+            self._tmp_path = None
+        except OSError:
+            logger.exception("Error writing parse cache entry %s:", self._entry_path)
+            self.abort()
+            return
+        if self._on_commit is not None:
+            self._on_commit(payload)
+
+    def abort(self):
+        """Discard the entry."""
+        self._payload = io.BytesIO()
+        if self._out_file is not None:
+            self._out_file.close()
+            self._out_file = None
+        if self._tmp_path is not None:
+            try:
+                os.remove(self._tmp_path)
+            except OSError:
+                pass
+            self._tmp_path = None
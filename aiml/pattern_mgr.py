@@ -1,12 +1,31 @@
+import collections
+import itertools
 import marshal
-import pprint
 import re
 import logging
+import threading
+import time
 
 
 logger = logging.getLogger(__name__)
 
 
+class MatchTimeout(Exception):
+    """Raised when a match runs past its deadline.  path lists the words of the pattern path
+    that was being explored at the time, with "<that>" and "<topic>" separating the parts of
+    the pattern; it's None if the deadline passed outside the matcher.
+    """
+
+    def __init__(self, path=None):
+        super().__init__()
+        self.path = path
+
+    def __str__(self):
+        if self.path is None:
+            return "deadline exceeded"
+        return "deadline exceeded while matching %r" % ' '.join(self.path)
+
+
 class PatternMgr():
     """This class implements the AIML pattern-matching algorithm described by Dr. Richard Wallace.
     http://www.alicebot.org/documentation/matching.html
@@ -18,15 +37,46 @@ class PatternMgr():
     _THAT = 3
     _TOPIC = 4
     _BOT_NAME = 5
+    _SOURCE = 6  # the file a template was learned from
+    _LENGTHS = 7  # how many words the subtree below a node can match; see _node_lengths()
+    _CONTEXTS = 8  # the 'that' and topic the subtree below a node can match; see _node_contexts()
+    _RUN = 9  # the words after the word leading to a node, in a compressed chain; see _compress()
+    _END_LENGTHS = (0, 0, False)  # the lengths where the current part of a pattern ends
+    _ANY_CONTEXTS = (None, None)  # the contexts of a template
+    # the keys whose values aren't child nodes, and the keys summarizing the children
+    _LEAF_KEYS = (_TEMPLATE, _SOURCE, _LENGTHS, _CONTEXTS, _RUN)
+    _SUMMARY_KEYS = frozenset([_LENGTHS, _CONTEXTS])
+    # how the special keys are written in patterns
+    _KEY_NAMES = {_UNDERSCORE: "_", _STAR: "*", _BOT_NAME: "BOT_NAME", _THAT: "<that>",
+                  _TOPIC: "<topic>"}
+
+    # source of version numbers, shared by all instances so that no two versions are alike
+    _versions = itertools.count(1)
 
     _PUNCTUATION = "\"`~!@#$%^&*()-_=+[{]}\|;:',<.>/?"
     _PUNC_STRIP_RE = re.compile("[" + re.escape(_PUNCTUATION) + "]")
-    _WHITESPACE_RE = re.compile("\s+", re.LOCALE | re.UNICODE)
 
     def __init__(self):
         self._root = {}
         self._template_count = 0
         self._botName = "Nameless"
+        # maps each source file to the set of (pattern, that, topic) keys learned from it
+        self._files = {}
+        # renewed on every change that can affect the result of a match
+        self._version = next(self._versions)
+        self._match_cache = None
+        self._memoize_failures = False
+        self._engine = "backtracking"
+        self._automaton = None  # (version, Automaton) compiled from the patterns
+        self._compress_paths = True
+        # maps the words of every pattern without wildcards to a list [node, guards,
+        # underscore_version]: node is where the words lead, and guards the "_" wildcards met on
+        # the way, as returned by _underscore_guards(), valid while _underscore_version is
+        # underscore_version
+        self._exact_index = {}
+        self._underscore_version = 0
+        self._index_hits = 0
+        self._index_misses = 0
 
     def num_templates(self):
         """Return the number of templates currently stored."""
@@ -38,9 +88,70 @@ class PatternMgr():
         """
         # Collapse a multi-word name into a single word
         self._botName = ' '.join(name.split())
+        self._version = next(self._versions)
+
+    def version(self):
+        """Return the version of the patterns.  It changes whenever patterns are added or
+        removed, and is different for every PatternMgr object.
+        """
+        return self._version
+
+    def set_match_cache(self, max_size):
+        """Cache the results of the last max_size distinct matches.  Inputs that recur often,
+        with the same 'that' and 'topic', are then matched without walking the node tree.  Any
+        change to the patterns empties the cache.  Pass 0 to disable the cache.
+        """
+        self._match_cache = MatchCache(max_size) if max_size > 0 else None
+
+    def match_cache_stats(self):
+        """Return a dictionary with the statistics of the match cache: hits, misses, hit_rate,
+        size and max_size.  Returns None if the cache is disabled.
+        """
+        if self._match_cache is None:
+            return None
+        return self._match_cache.stats()
+
+    def set_match_engine(self, engine):
+        """Choose how matches are searched for: "backtracking", the default, walks the node tree
+        trying the alternatives one after the other, and "automaton" compiles the patterns into
+        an automaton that goes through the input once (see the automaton module).  Both find the
+        same matches.  The automaton takes time linear in the length of the input whatever the
+        patterns are, but it's compiled again on the first match after every change to the
+        patterns.
+        """
+        if engine not in ("backtracking", "automaton"):
+            raise ValueError("engine must be in ['backtracking', 'automaton']")
+        self._engine = engine
+        self._automaton = None
+
+    def set_failure_memo(self, enabled):
+        """If enabled, every match remembers the (node, number of remaining words) states it
+        failed to match from, and doesn't explore them again.  This bounds the work of a match
+        to the number of nodes times the number of words, where plain backtracking takes
+        exponential time on inputs like "A A A A ..." against patterns with several wildcards,
+        at the price of some overhead on ordinary inputs.  The result of a match is the same
+        either way.
+        """
+        self._memoize_failures = enabled
+
+    def set_path_compression(self, enabled):
+        """If enabled, the default, chains of nodes that each lead on to a single word are
+        merged into one node, reached through the first word and holding the words that follow.
+        A long pattern like "WHAT IS THE CAPITAL OF FRANCE" then takes two nodes instead of six,
+        and its words are compared in one step when matching.  Disabling it expands the chains
+        again.  The result of a match is the same either way.
+        """
+        self._compress_paths = enabled
+        if enabled:
+            self._compress_tree(self._root)
+        else:
+            self._expand_tree(self._root)
 
     def dump(self):
-        """Print all learned patterns, for debugging purposes."""
+        """Print all learned patterns, for debugging purposes.  For a summary of big brains,
+        see the brain_report module.
+        """
+        import pprint
         pprint.pprint(self._root)
 
     def save(self, filename):
@@ -69,11 +180,41 @@ class PatternMgr():
         except:
             logger.exception("Error restoring PatternMgr from file %s:", filename)
             raise
+        self._version = next(self._versions)
+        if self._root and self._LENGTHS not in self._root:
+            # saved by a version that didn't keep the summaries of the nodes
+            self._compute_summaries(self._root)
+        if self._compress_paths:
+            self._compress_tree(self._root)
+        self._files = {}
+        for key, node in self._iter_categories():
+            if self._SOURCE in node:
+                self._files.setdefault(node[self._SOURCE], set()).add(key)
+        self._build_exact_index()
 
-    def add(self, pattern, that, topic, template):
-        """Add a [pattern/that/topic] tuple and its corresponding template to the node tree.
+    def copy(self):
+        """Return an independent copy of this PatternMgr.  The node tree and the templates are
+        copied as well, so changes to the copy never show up in the original.
         """
-        node = self._root
+        clone = type(self)()
+        clone._template_count = self._template_count
+        clone._botName = self._botName
+        # a marshal round trip is the fastest way to deep-copy the node tree
+        clone._root = marshal.loads(marshal.dumps(self._root))
+        clone._files = {source: set(keys) for source, keys in self._files.items()}
+        clone._build_exact_index()
+        if self._match_cache is not None:
+            clone.set_match_cache(self._match_cache.max_size)
+        clone._memoize_failures = self._memoize_failures
+        clone._compress_paths = self._compress_paths
+        clone._engine = self._engine
+        return clone
+
+    def _path_keys(self, pattern, that, topic):
+        """Return the list of node keys leading from the root to the template of a
+        [pattern/that/topic] tuple.
+        """
+        keys = []
         for word in pattern.split():
             if word == "_":
                 key = self._UNDERSCORE
@@ -83,11 +224,11 @@ class PatternMgr():
                 key = self._BOT_NAME
             else:
                 key = word
-            node = node.setdefault(key, {})
+            keys.append(key)
 
         # navigate further down, if a non-empty "that" pattern was included
         if len(that) > 0:
-            node = node.setdefault(self._THAT, {})
+            keys.append(self._THAT)
             for word in that.split():
                 if word == "_":
                     key = self._UNDERSCORE
@@ -95,11 +236,11 @@ class PatternMgr():
                     key = self._STAR
                 else:
                     key = word
-                node = node.setdefault(key, {})
+                keys.append(key)
 
         # navigate yet further down, if a non-empty "topic" string was included
         if len(topic) > 0:
-            node = node.setdefault(self._TOPIC, {})
+            keys.append(self._TOPIC)
             for word in topic.split():
                 if word == "_":
                     key = self._UNDERSCORE
@@ -107,42 +248,579 @@ class PatternMgr():
                     key = self._STAR
                 else:
                     key = word
-                node = node.setdefault(key, {})
+                keys.append(key)
+        return keys
+
+    def add(self, pattern, that, topic, template, source=None):
+        """Add a [pattern/that/topic] tuple and its corresponding template to the node tree.
+        The optional source argument names the file the category was learned from; see
+        remove_source().
+        """
+        path = []
+        node = self._root
+        for key in self._path_keys(pattern, that, topic):
+            path.append((node, key))
+            child = node.get(key)
+            if child is None:
+                child = node[key] = {}
+            elif self._RUN in child:
+                child = self._peel(node, key)
+            node = child
 
         # add the template.
         if self._TEMPLATE not in node:
             self._template_count += 1
         node[self._TEMPLATE] = template
+        self._version = next(self._versions)
+
+        words = pattern.split()
+        if "_" in words:
+            self._underscore_version += 1
+        elif "*" not in words and "BOT_NAME" not in words:
+            # path[len(words)] starts at the node the words of the pattern lead to
+            pattern_node = path[len(words)][0] if len(path) > len(words) else node
+            self._exact_index[tuple(words)] = [pattern_node, (), None]
+
+        # a new category can only widen the ranges of word counts and add to the contexts, so
+        # they are merged into the ancestors' summaries instead of recomputing those from all
+        # of their children
+        self._set_summaries(node)
+        child = node
+        for i in reversed(range(len(path))):
+            parent, key = path[i]
+            if self._LENGTHS not in parent:
+                self._set_summaries(parent)  # a new node
+            else:
+                lengths = self._combine_lengths(parent[self._LENGTHS],
+                                                self._edge_lengths(key, child))
+                old_contexts = parent.get(self._CONTEXTS, self._ANY_CONTEXTS)
+                contexts = self._combine_contexts(old_contexts, self._edge_contexts(key, child))
+                if (lengths == parent[self._LENGTHS] and contexts == old_contexts and
+                        not self._keys_summarized(path, i)):
+                    break
+                parent[self._LENGTHS] = lengths
+                self._set_contexts(parent, contexts)
+            child = parent
+
+        # record where the template came from
+        old_source = node.get(self._SOURCE)
+        if old_source != source:
+            key = (' '.join(pattern.split()), ' '.join(that.split()), ' '.join(topic.split()))
+            if old_source is not None:
+                self._discard_source_key(old_source, key)
+                del node[self._SOURCE]
+            if source is not None:
+                node[self._SOURCE] = source
+                self._files.setdefault(source, set()).add(key)
+        self._compress_path(path)
+
+    def _keys_summarized(self, path, i):
+        """Return True if the node at depth i along path, a list of (parent, key) tuples from
+        the root down, is reached through a <that> or <topic> edge, so that the contexts of its
+        parent depend on its keys, and not only on its summaries.
+        """
+        return i > 0 and path[i - 1][1] in (self._THAT, self._TOPIC)
+
+    def _discard_source_key(self, source, key):
+        keys = self._files.get(source)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._files[source]
+
+    def remove(self, pattern, that, topic):
+        """Remove the template of a [pattern/that/topic] tuple from the node tree.  Branches of
+        the tree that lead nowhere anymore are removed as well.
+
+        Returns False if there was no such template.
+        """
+        path = []
+        node = self._root
+        for key in self._path_keys(pattern, that, topic):
+            child = node.get(key)
+            if child is None:
+                self._compress_path(path)
+                return False
+            path.append((node, key))
+            if self._RUN in child:
+                child = self._peel(node, key)
+            node = child
+        if self._TEMPLATE not in node:
+            self._compress_path(path)
+            return False
+        del node[self._TEMPLATE]
+        self._template_count -= 1
+        self._version = next(self._versions)
+        source = node.pop(self._SOURCE, None)
+        if source is not None:
+            key = (' '.join(pattern.split()), ' '.join(that.split()), ' '.join(topic.split()))
+            self._discard_source_key(source, key)
+        words = pattern.split()
+        pattern_node = path[len(words)][0] if len(path) > len(words) else node
+
+        # prune the branches that have become empty, and update the summaries of the rest
+        while path and not node.keys() - self._SUMMARY_KEYS:
+            node, key = path.pop()
+            del node[key]
+        if "_" in words:
+            self._underscore_version += 1
+        elif self._THAT not in pattern_node and self._TEMPLATE not in pattern_node:
+            # no pattern ends at the node anymore
+            self._exact_index.pop(tuple(words), None)
+        nodes = [node] + [parent for parent, _ in reversed(path)]
+        for i, node in enumerate(nodes):
+            if not node.keys() - self._SUMMARY_KEYS:
+                node.clear()  # the root is empty
+                break
+            lengths = self._node_lengths(node)
+            contexts = self._node_contexts(node)
+            if (node.get(self._LENGTHS) == lengths and
+                    node.get(self._CONTEXTS, self._ANY_CONTEXTS) == contexts and
+                    not self._keys_summarized(path, len(path) - i)):
+                break
+            node[self._LENGTHS] = lengths
+            self._set_contexts(node, contexts)
+        self._compress_path(path)
+        return True
+
+    def exact_index_stats(self):
+        """Return a dictionary with statistics of the exact index, which answers matches for
+        the words of patterns without wildcards with a single lookup: the number of matches it
+        answered ("hits"), the number it didn't ("misses"), the hit_rate, and the number of
+        patterns in the index ("size").
+        """
+        total = self._index_hits + self._index_misses
+        return {"hits": self._index_hits, "misses": self._index_misses,
+                "hit_rate": self._index_hits / total if total else 0.0,
+                "size": len(self._exact_index)}
+
+    def _build_exact_index(self):
+        """Fill the exact index from the node tree."""
+        self._exact_index = {}
+        stack = [(self._root, ())]
+        while stack:
+            node, words = stack.pop()
+            if self._THAT in node or self._TEMPLATE in node:
+                self._exact_index[words] = [node, (), None]
+            for key, child in node.items():
+                if isinstance(key, str):
+                    stack.append((child, words + (key,) + child.get(self._RUN, ())))
+
+    def _underscore_guards(self, words):
+        """Return a tuple of (i, node) tuples, one for every node that has a "_" wildcard along
+        the path of words, where i is the position of the word the wildcard would start at and
+        node is the node the wildcard leads to.
+        """
+        guards = []
+        node = self._root
+        i = 0
+        while i < len(words):
+            if self._UNDERSCORE in node:
+                guards.append((i, node[self._UNDERSCORE]))
+            node = node[words[i]]
+            i += 1 + len(node.get(self._RUN, ()))
+        return tuple(guards)
+
+    def _indexed_match(self, words, that_words, topic_words, deadline):
+        """Like _match(), starting at the root, but using the exact index.  Returns None if the
+        index can't tell the result: when words aren't the words of a pattern without wildcards,
+        when a "_" wildcard might take precedence, or when the 'that' and topic don't match
+        there, so that the "*" wildcards would have to be tried.
+        """
+        entry = self._exact_index.get(words)
+        if entry is None:
+            return None
+        node, guards, version = entry
+        if version != self._underscore_version:
+            guards = entry[1] = self._underscore_guards(words)
+            entry[2] = self._underscore_version
+        for i, underscore in guards:
+            # the "_" comes first, so it must not match
+            suffix = words[i + 1:]
+            for j in self._split_points(suffix, underscore):
+                if (self._may_match_input(suffix[j:], underscore) and
+                        self._match(suffix[j:], that_words, topic_words, underscore,
+                                    deadline)[1] is not None):
+                    return None
+        try:
+            pattern, template = self._match((), that_words, topic_words, node, deadline)
+        except MatchTimeout as timeout:
+            timeout.path[:0] = words
+            raise
+        if template is None:
+            return None
+        return (list(words) + pattern, template)
+
+    def _edge_lengths(self, key, child):
+        """Return the lengths, as returned by _node_lengths(), of the matches that follow the
+        edge key to child.
+        """
+        if key in (self._THAT, self._TOPIC):
+            return self._END_LENGTHS
+        min_words, max_words, _ = child[self._LENGTHS]
+        if key in (self._UNDERSCORE, self._STAR):
+            return (min_words + 1, None, False)
+        num_words = 1 + len(child.get(self._RUN, ()))
+        return (min_words + num_words, None if max_words is None else max_words + num_words,
+                key != self._BOT_NAME)
+
+    @staticmethod
+    def _combine_lengths(lengths, other):
+        """Return the lengths of the matches of either of two sets of lengths."""
+        return (min(lengths[0], other[0]),
+                None if lengths[1] is None or other[1] is None else max(lengths[1], other[1]),
+                lengths[2] and other[2])
+
+    def _node_lengths(self, node):
+        """Return a tuple (min_words, max_words, literal_only) describing the matches of the
+        current part of a pattern (input, 'that' or topic) from node on.  Matching them takes
+        at least min_words words and at most max_words words; max_words is None if a wildcard
+        makes it unbounded.  If literal_only is true, every match starts with a word that's a
+        key of node.  The matcher uses this to skip the ways of splitting the input among
+        wildcards that can't succeed.
+
+        The lengths are kept up to date under the _LENGTHS key of every node, and computed from
+        those of the children.
+        """
+        lengths = None
+        for key, child in node.items():
+            if key in (self._SOURCE, self._LENGTHS, self._CONTEXTS, self._RUN):
+                continue
+            if key in (self._TEMPLATE, self._THAT, self._TOPIC):
+                edge_lengths = self._END_LENGTHS
+            else:
+                edge_lengths = self._edge_lengths(key, child)
+            lengths = edge_lengths if lengths is None else self._combine_lengths(lengths,
+                                                                                 edge_lengths)
+        return lengths or self._END_LENGTHS
+
+    def _edge_contexts(self, key, child):
+        """Return the contexts, as returned by _node_contexts(), of the matches that follow the
+        edge key to child.
+        """
+        if key == self._THAT:
+            return (self._first_words(child),
+                    child.get(self._CONTEXTS, self._ANY_CONTEXTS)[1])
+        if key == self._TOPIC:
+            return (frozenset(), self._first_words(child))
+        return child.get(self._CONTEXTS, self._ANY_CONTEXTS)
+
+    def _first_words(self, node):
+        """Return the set of words a match below node can start with, or None if it can start
+        with any word.
+        """
+        if self._UNDERSCORE in node or self._STAR in node:
+            return None
+        return frozenset(key for key in node if isinstance(key, str))
+
+    @staticmethod
+    def _combine_contexts(contexts, other):
+        """Return the contexts of the matches of either of two sets of contexts."""
+        return tuple(None if a is None or b is None else a | b for a, b in zip(contexts, other))
+
+    def _node_contexts(self, node):
+        """Return a tuple (that_words, topic_words) describing the 'that' and the topic the
+        matches below node can have: the first word of the 'that' is in the set that_words,
+        and the first word of the topic in the set topic_words.  Either is None if a wildcard,
+        or a template that doesn't care about the 'that' or topic, accepts any word.  The
+        matcher uses this to avoid descending into subtrees whose patterns can't match
+        because of the 'that' or the topic.
 
-    def match(self, pattern, that, topic):
+        The contexts are kept up to date under the _CONTEXTS key of every node, and computed
+        from those of the children.  Nodes whose contexts are (None, None), which is the
+        usual case, have no _CONTEXTS key, so the matcher can skip them quickly.  Only the
+        topic_words of the nodes below a <that> are meaningful.
+        """
+        contexts = None
+        for key, child in node.items():
+            if key in (self._SOURCE, self._LENGTHS, self._CONTEXTS, self._RUN):
+                continue
+            if key == self._TEMPLATE:
+                edge_contexts = self._ANY_CONTEXTS
+            else:
+                edge_contexts = self._edge_contexts(key, child)
+            contexts = edge_contexts if contexts is None else self._combine_contexts(
+                contexts, edge_contexts)
+        return contexts or (frozenset(), frozenset())
+
+    def _set_summaries(self, node):
+        """Compute the summaries of node from those of its children."""
+        node[self._LENGTHS] = self._node_lengths(node)
+        self._set_contexts(node, self._node_contexts(node))
+
+    def _set_contexts(self, node, contexts):
+        if contexts == self._ANY_CONTEXTS:
+            node.pop(self._CONTEXTS, None)
+        else:
+            node[self._CONTEXTS] = contexts
+
+    def _compute_summaries(self, node):
+        """Compute the summaries of node and all nodes below it."""
+        for key, child in node.items():
+            if key not in self._LEAF_KEYS:
+                self._compute_summaries(child)
+        self._set_summaries(node)
+
+    def _compress(self, parent, key):
+        """If the node parent[key] leads on to a single word, and nothing else, replace it
+        with the node that word leads to.  The words skipped are kept under the _RUN key of
+        that node, after those already there, and the matcher compares them in one step.  Only
+        nodes reached through a word are merged, so a _RUN always follows a word.
+        """
+        if not isinstance(key, str):
+            return
+        node = parent[key]
+        word = None
+        for child_key in node:
+            if child_key in (self._LENGTHS, self._CONTEXTS, self._RUN):
+                continue
+            if word is not None or not isinstance(child_key, str):
+                return
+            word = child_key
+        if word is None:
+            return
+        child = node[word]
+        # the summaries of child stay the same, since it's still the same matches from there
+        child[self._RUN] = node.get(self._RUN, ()) + (word,) + child.get(self._RUN, ())
+        parent[key] = child
+
+    def _compress_path(self, path):
+        """Compress the chains along path, a list of (parent, key) tuples from the root down,
+        after a change.
+        """
+        if self._compress_paths:
+            for parent, key in reversed(path):
+                self._compress(parent, key)
+
+    def _compress_tree(self, node):
+        """Compress all chains below node."""
+        for key in list(node):
+            if key not in self._LEAF_KEYS:
+                self._compress_tree(node[key])
+                self._compress(node, key)
+
+    def _peel(self, parent, key):
+        """Split the first of the _RUN words of the node parent[key] off into a node of its
+        own, which is returned, so that a change can follow the words one node at a time.
+        """
+        child = parent[key]
+        run = child.pop(self._RUN)
+        if len(run) > 1:
+            child[self._RUN] = run[1:]
+        node = parent[key] = {run[0]: child}
+        self._set_summaries(node)
+        return node
+
+    def _expand_tree(self, node):
+        """Undo the compression of all chains below node."""
+        for key in list(node):
+            if key not in self._LEAF_KEYS:
+                if self._RUN in node[key]:
+                    self._peel(node, key)
+                self._expand_tree(node[key])
+
+    def _split_points(self, words, node):
+        """Return the indices j for which words[j:] might match below node, in ascending
+        order.
+        """
+        lengths = node.get(self._LENGTHS)
+        if lengths is None:
+            return range(len(words) + 1)
+        min_words, max_words, literal_only = lengths
+        start = 0 if max_words is None else max(0, len(words) - max_words)
+        stop = len(words) - min_words + 1
+        if literal_only:
+            # jump to the words that can start a match
+            return [j for j in range(start, stop) if words[j] in node]
+        return range(start, stop)
+
+    def remove_source(self, source):
+        """Remove all templates that were learned from the file source.
+        Returns the number of templates removed.
+        """
+        keys = self._files.pop(source, ())
+        for pattern, that, topic in keys:
+            self.remove(pattern, that, topic)
+        return len(keys)
+
+    def sources(self):
+        """Return the list of files the current templates were learned from."""
+        return list(self._files)
+
+    def categories(self):
+        """Yield a ((pattern, that, topic), template) tuple for every category."""
+        for key, node in self._iter_categories():
+            yield key, node[self._TEMPLATE]
+
+    def replace_templates(self, func):
+        """Replace the template t of every category with func(t).  The patterns and sources
+        stay the same.
+        """
+        for key, node in self._iter_categories():
+            node[self._TEMPLATE] = func(node[self._TEMPLATE])
+        self._version = next(self._versions)
+
+    def literal_match(self, input):
+        """Find the template input matches through a category whose pattern consists of exactly
+        the words of input, and whose 'that' and topic are both "*".  When there is one, it's
+        the match for input whatever the 'that' and the topic are, unless a pattern with a "_"
+        wildcard takes precedence.
+
+        Returns a tuple (template, guards), or None if there's no such category.  guards lists
+        the "_" wildcards that might take precedence; once 'that' and the topic are known, pass
+        them to guards_pass() to find out.
+        """
+        words = self._normalize(input, "", "")[0]
+        if not words:
+            return None
+        guards = []
+        node = self._root
+        i = 0
+        while i < len(words):
+            rest = words[i + 1:]
+            if self._UNDERSCORE in node:
+                suffixes = [rest[j:] for j in range(len(rest) + 1)
+                            if self._may_match_input(rest[j:], node[self._UNDERSCORE])]
+                if suffixes:
+                    guards.append((node[self._UNDERSCORE], suffixes))
+            node = node.get(words[i])
+            if node is None:
+                return None
+            run = node.get(self._RUN, ())
+            if rest[:len(run)] != run:
+                return None
+            i += 1 + len(run)
+        # follow "<that>*</that> <topic>*</topic>", which must be the only way on
+        leaf_keys = self._LEAF_KEYS
+        for key in (self._THAT, self._STAR, self._TOPIC, self._STAR):
+            if key not in node or any(k != key and k not in leaf_keys for k in node):
+                return None
+            node = node[key]
+        if self._TEMPLATE not in node or any(k not in leaf_keys for k in node):
+            return None
+        return node[self._TEMPLATE], guards
+
+    def guards_pass(self, guards, that, topic):
+        """Return True if none of the "_" wildcards in guards, as returned by literal_match(),
+        matches with the given 'that' and topic.
+        """
+        if that.strip() == "":
+            that = "ULTRABOGUSDUMMYTHAT"  # 'that' must never be empty
+        if topic.strip() == "":
+            topic = "ULTRABOGUSDUMMYTOPIC"  # 'topic' must never be empty
+        _, that_words, topic_words = self._normalize("", that, topic)
+        for node, suffixes in guards:
+            for words in suffixes:
+                if self._match(words, that_words, topic_words, node)[1] is not None:
+                    return False
+        return True
+
+    def _may_match_input(self, words, node):
+        """Return True if words match the input part of a pattern below node.  Whether the
+        'that' and topic parts match as well is left open.
+        """
+        if not words:
+            return self._THAT in node or self._TOPIC in node or self._TEMPLATE in node
+        first = words[0]
+        suffix = words[1:]
+        for key in (self._UNDERSCORE, self._STAR):
+            if key in node and any(self._may_match_input(suffix[j:], node[key])
+                                   for j in self._split_points(suffix, node[key])):
+                return True
+        child = node.get(first)
+        if child is not None:
+            run = child.get(self._RUN, ())
+            if suffix[:len(run)] == run and self._may_match_input(suffix[len(run):], child):
+                return True
+        return (self._BOT_NAME in node and first == self._botName
+                and self._may_match_input(suffix, node[self._BOT_NAME]))
+
+    def _iter_categories(self):
+        """Yield a ((pattern, that, topic), node) tuple for every node of the tree that holds a
+        template.
+        """
+        names = self._KEY_NAMES
+        stack = [(self._root, [[]])]
+        while stack:
+            node, segments = stack.pop()
+            if self._TEMPLATE in node:
+                words = [' '.join(segment) for segment in segments]
+                words.extend([""] * (3 - len(words)))
+                yield tuple(words), node
+            for key, child in node.items():
+                if key in self._LEAF_KEYS:
+                    continue
+                if key == self._THAT:
+                    child_segments = segments + [[]]
+                elif key == self._TOPIC:
+                    # the "that" segment may have been left out
+                    child_segments = segments + [[]] * (3 - len(segments))
+                else:
+                    child_segments = segments[:-1] + [segments[-1] + [names.get(key, key)] +
+                                                      list(child.get(self._RUN, ()))]
+                stack.append((child, child_segments))
+
+    def match(self, pattern, that, topic, deadline=None):
         """Return the template which is the closest match to pattern. The
         'that' parameter contains the bot's previous response. The 'topic'
         parameter contains the current topic of conversation.
 
-        Returns None if no template is found.
+        Returns None if no template is found.  If deadline, a time.monotonic() value, passes
+        before the match is found, MatchTimeout is raised.
         """
         if len(pattern) == 0:
             return None
-        # Mutilate the input.  Remove all punctuation and convert the
-        # text to all caps.
-        input = pattern.upper()
-        input = re.sub(self._PUNC_STRIP_RE, " ", input)
         if that.strip() == "":
             that = "ULTRABOGUSDUMMYTHAT"  # 'that' must never be empty
-        that_input = that.upper()
-        that_input = re.sub(self._PUNC_STRIP_RE, " ", that_input)
-        that_input = re.sub(self._WHITESPACE_RE, " ", that_input)
         if topic.strip() == "":
             topic = "ULTRABOGUSDUMMYTOPIC"  # 'topic' must never be empty
-        topic_input = topic.upper()
-        topic_input = re.sub(self._PUNC_STRIP_RE, " ", topic_input)
 
-        # Pass the input off to the recursive call
-        pat_match, template = self._match(input.split(), that_input.split(), topic_input.split(),
-                                          self._root)
+        pat_match, template = self._cached_match(*self._normalize(pattern, that, topic),
+                                                  deadline=deadline)
         return template
 
-    def star(self, star_type, pattern, that, topic, index):
+    def _normalize(self, pattern, that, topic):
+        """Mutilate the input, that and topic strings the way the patterns are: remove all
+        punctuation and convert the text to all caps.  Returns a tuple of three word tuples.
+        """
+        input = re.sub(self._PUNC_STRIP_RE, " ", pattern.upper())
+        that_input = re.sub(self._PUNC_STRIP_RE, " ", that.upper())
+        topic_input = re.sub(self._PUNC_STRIP_RE, " ", topic.upper())
+        return tuple(input.split()), tuple(that_input.split()), tuple(topic_input.split())
+
+    def _cached_match(self, words, that_words, topic_words, deadline=None):
+        """Like _match(), starting at the root, but look up the result in the match cache
+        first.
+        """
+        cache = self._match_cache
+        if cache is None:
+            return self._search(words, that_words, topic_words, deadline)
+        key = (words, that_words, topic_words)
+        # read the version before matching, so a concurrent change can't leave a stale result
+        version = self._version
+        result = cache.get(key, version)
+        if result is None:
+            result = self._search(words, that_words, topic_words, deadline)
+            cache.put(key, result, version)
+        return result
+
+    def _search(self, words, that_words, topic_words, deadline):
+        """Like _match(), starting at the root, with the exact index or the selected engine."""
+        result = self._indexed_match(words, that_words, topic_words, deadline)
+        if result is not None:
+            self._index_hits += 1
+            return result
+        self._index_misses += 1
+        if self._engine == "automaton":
+            compiled = self._automaton
+            if compiled is None or compiled[0] != self._version:
+                from . import automaton
+                compiled = self._automaton = (self._version, automaton.Automaton(self))
+            return compiled[1].match(words, that_words, topic_words, deadline)[:2]
+        failed = set() if self._memoize_failures else None
+        return self._match(words, that_words, topic_words, self._root, deadline, failed)
+
+    def star(self, star_type, pattern, that, topic, index, deadline=None):
         """Returns a string, the portion of pattern that was matched by a *.
 
         The 'starType' parameter specifies which type of star to find.
@@ -151,38 +829,29 @@ class PatternMgr():
          - 'thatstar': matches a star in the that pattern.
          - 'topicstar': matches a star in the topic pattern.
 
+        deadline works as for match().
         """
-        # Mutilate the input.  Remove all punctuation and convert the text to all caps.
-        input = pattern.upper()
-        input = re.sub(self._PUNC_STRIP_RE, " ", input)
-        input = re.sub(self._WHITESPACE_RE, " ", input)
         if that.strip() == "":
             that = "ULTRABOGUSDUMMYTHAT"  # 'that' must never be empty
-        that_input = that.upper()
-        that_input = re.sub(self._PUNC_STRIP_RE, " ", that_input)
-        that_input = re.sub(self._WHITESPACE_RE, " ", that_input)
         if topic.strip() == "":
             topic = "ULTRABOGUSDUMMYTOPIC"  # 'topic' must never be empty
-        topic_input = topic.upper()
-        topic_input = re.sub(self._PUNC_STRIP_RE, " ", topic_input)
-        topic_input = re.sub(self._WHITESPACE_RE, " ", topic_input)
 
         # Pass the input off to the recursive pattern-matcher
-        pat_match, template = self._match(input.split(), that_input.split(), topic_input.split(),
-                                          self._root)
+        input_words, that_words, topic_words = self._normalize(pattern, that, topic)
+        pat_match, template = self._cached_match(input_words, that_words, topic_words, deadline)
         if template is None:
             return ""
 
         # Extract the appropriate portion of the pattern, based on the starType argument.
         if star_type == 'star':
             pat_match = pat_match[:pat_match.index(self._THAT)]
-            words = input.split()
+            words = input_words
         elif star_type == 'thatstar':
             pat_match = pat_match[pat_match.index(self._THAT) + 1: pat_match.index(self._TOPIC)]
-            words = that_input.split()
+            words = that_words
         elif star_type == 'topicstar':
             pat_match = pat_match[pat_match.index(self._TOPIC) + 1:]
-            words = topic_input.split()
+            words = topic_words
         else:
             # unknown value
             raise ValueError("starType must be in ['star', 'thatstar', 'topicstar']")
@@ -240,88 +909,200 @@ class PatternMgr():
         else:
             return ""
 
-    def _match(self, words, that_words, topic_words, root):
+    def _match(self, words, that_words, topic_words, root, deadline=None, failed=None):
         """Return a tuple (pat, tem) where pat is a list of nodes, starting
         at the root and leading to the matching pattern, and tem is the
         matched template.
 
+        If deadline isn't None, it's checked before every attempt to match
+        a wildcard, which is where the time goes on pathological inputs.
+
+        failed, if not None, is the set of the (id(node), len(words)) states
+        the current match has already failed from; see set_failure_memo().
+        The words are always a suffix of the input, the 'that' or the topic,
+        depending on the part of the pattern node belongs to, so the state
+        determines the result.
         """
-        # base-case: if the word list is empty, return the current node's
-        # template.
-        if len(words) == 0:
-            # we're out of words.
-            pattern = []
-            template = None
-            if len(that_words) > 0:
-                # If thatWords isn't empty, recursively
-                # pattern-match on the _THAT node with thatWords as words.
-                try:
-                    pattern, template = self._match(that_words, [], topic_words, root[self._THAT])
-                    if pattern is not None:
-                        pattern = [self._THAT] + pattern
-                except KeyError:
-                    pattern = []
-                    template = None
-            elif len(topic_words) > 0:
-                # If thatWords is empty and topicWords isn't, recursively pattern
-                # on the _TOPIC node with topicWords as words.
-                try:
-                    pattern, template = self._match(topic_words, [], [], root[self._TOPIC])
-                    if pattern is not None:
-                        pattern = [self._TOPIC] + pattern
-                except KeyError:
-                    pattern = []
-                    template = None
-            if template is None:
-                # we're totally out of input.  Grab the template at this node.
+        if failed is not None and (id(root), len(words)) in failed:
+            return (None, None)
+        contexts = root.get(self._CONTEXTS)
+        if contexts is not None:
+            # don't bother if no pattern below can match the 'that' or the topic
+            that_first, topic_first = contexts
+            if ((that_first is not None and that_words and that_words[0] not in that_first) or
+                    (topic_first is not None and topic_words and
+                     topic_words[0] not in topic_first)):
+                return (None, None)
+        # the branch being explored, reported in a MatchTimeout
+        key = None
+        try:
+            # base-case: if the word list is empty, return the current node's
+            # template.
+            if len(words) == 0:
+                # we're out of words.
                 pattern = []
-                try:
-                    template = root[self._TEMPLATE]
-                except KeyError:
-                    template = None
-            return (pattern, template)
+                template = None
+                if len(that_words) > 0:
+                    # If thatWords isn't empty, recursively
+                    # pattern-match on the _THAT node with thatWords as words.
+                    key = self._THAT
+                    try:
+                        pattern, template = self._match(that_words, [], topic_words,
+                                                        root[self._THAT], deadline, failed)
+                        if pattern is not None:
+                            pattern = [self._THAT] + pattern
+                    except KeyError:
+                        pattern = []
+                        template = None
+                elif len(topic_words) > 0:
+                    # If thatWords is empty and topicWords isn't, recursively pattern
+                    # on the _TOPIC node with topicWords as words.
+                    key = self._TOPIC
+                    try:
+                        pattern, template = self._match(topic_words, [], [], root[self._TOPIC],
+                                                        deadline, failed)
+                        if pattern is not None:
+                            pattern = [self._TOPIC] + pattern
+                    except KeyError:
+                        pattern = []
+                        template = None
+                if template is None:
+                    # we're totally out of input.  Grab the template at this node.
+                    pattern = []
+                    try:
+                        template = root[self._TEMPLATE]
+                    except KeyError:
+                        template = None
+                        if failed is not None:
+                            failed.add((id(root), 0))
+                return (pattern, template)
 
-        first = words[0]
-        suffix = words[1:]
+            first = words[0]
+            suffix = words[1:]
 
-        # Check underscore.
-        # Note: this is causing problems in the standard AIML set, and is
-        # currently disabled.
-        if self._UNDERSCORE in root:
-            # Must include the case where suf is [] in order to handle the case
-            # where a * or _ is at the end of the pattern.
-            for j in range(len(suffix) + 1):
-                suf = suffix[j:]
-                pattern, template = self._match(suf, that_words, topic_words,
-                                                root[self._UNDERSCORE])
-                if template is not None:
-                    new_pattern = [self._UNDERSCORE] + pattern
-                    return (new_pattern, template)
+            # Check underscore.
+            # Note: this is causing problems in the standard AIML set, and is
+            # currently disabled.
+            if self._UNDERSCORE in root:
+                key = self._UNDERSCORE
+                # Must include the case where suf is [] in order to handle the case
+                # where a * or _ is at the end of the pattern.
+                for j in self._split_points(suffix, root[self._UNDERSCORE]):
+                    if deadline is not None and time.monotonic() > deadline:
+                        raise MatchTimeout([])
+                    suf = suffix[j:]
+                    pattern, template = self._match(suf, that_words, topic_words,
+                                                    root[self._UNDERSCORE], deadline, failed)
+                    if template is not None:
+                        new_pattern = [self._UNDERSCORE] + pattern
+                        return (new_pattern, template)
+
+            # Check first, and the words compressed into the same edge
+            child = root.get(first)
+            if child is not None:
+                run = child.get(self._RUN)
+                if run is None:
+                    key = first
+                    pattern, template = self._match(suffix, that_words, topic_words, child,
+                                                    deadline, failed)
+                    if template is not None:
+                        new_pattern = [first] + pattern
+                        return (new_pattern, template)
+                elif suffix[:len(run)] == run:
+                    key = (first,) + run
+                    pattern, template = self._match(suffix[len(run):], that_words, topic_words,
+                                                    child, deadline, failed)
+                    if template is not None:
+                        new_pattern = list(key) + pattern
+                        return (new_pattern, template)
 
-        # Check first
-        if first in root:
-            pattern, template = self._match(suffix, that_words, topic_words, root[first])
-            if template is not None:
-                new_pattern = [first] + pattern
-                return (new_pattern, template)
-
-        # check bot name
-        if self._BOT_NAME in root and first == self._botName:
-            pattern, template = self._match(suffix, that_words, topic_words, root[self._BOT_NAME])
-            if template is not None:
-                new_pattern = [first] + pattern
-                return (new_pattern, template)
-
-        # check star
-        if self._STAR in root:
-            # Must include the case where suf is [] in order to handle the case
-            # where a * or _ is at the end of the pattern.
-            for j in range(len(suffix) + 1):
-                suf = suffix[j:]
-                pattern, template = self._match(suf, that_words, topic_words, root[self._STAR])
+            # check bot name
+            if self._BOT_NAME in root and first == self._botName:
+                key = self._BOT_NAME
+                pattern, template = self._match(suffix, that_words, topic_words,
+                                                root[self._BOT_NAME], deadline, failed)
                 if template is not None:
-                    new_pattern = [self._STAR] + pattern
+                    new_pattern = [first] + pattern
                     return (new_pattern, template)
 
+            # check star
+            if self._STAR in root:
+                key = self._STAR
+                # Must include the case where suf is [] in order to handle the case
+                # where a * or _ is at the end of the pattern.
+                for j in self._split_points(suffix, root[self._STAR]):
+                    if deadline is not None and time.monotonic() > deadline:
+                        raise MatchTimeout([])
+                    suf = suffix[j:]
+                    pattern, template = self._match(suf, that_words, topic_words,
+                                                    root[self._STAR], deadline, failed)
+                    if template is not None:
+                        new_pattern = [self._STAR] + pattern
+                        return (new_pattern, template)
+        except MatchTimeout as timeout:
+            # build up the path while unwinding
+            if isinstance(key, tuple):
+                timeout.path[:0] = key
+            else:
+                timeout.path.insert(0, self._KEY_NAMES.get(key, key))
+            raise
+
         # No matches were found.
+        if failed is not None:
+            failed.add((id(root), len(words)))
         return (None, None)
+
+
+class MatchCache():
+    """Bounded, thread-safe LRU cache of results that stay valid as long as a version doesn't
+    change.  Every lookup passes the current version; when it changes, the cache is emptied.
+    Cached values must not be None.
+
+    PatternMgr uses it to cache match results: the entries are keyed on the (input words, that
+    words, topic words) of a match, and hold the (pattern path, template) tuple returned by
+    _match(); the path is what star() uses to find the words captured by each wildcard.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key, version):
+        """Return the cached result for key, or None."""
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            try:
+                result = self._entries[key]
+            except KeyError:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return result
+
+    def put(self, key, result, version):
+        """Store the result for key, unless it was computed for an outdated version."""
+        with self._lock:
+            if version != self._version:
+                return
+            self._entries[key] = result
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        """Return a dictionary with the hits, misses, hit_rate, size and max_size of the cache."""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+            }
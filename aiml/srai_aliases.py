@@ -0,0 +1,211 @@
+"""
+This module implements the SraiAliases class, the table of collapsed <srai> redirects of a brain
+(see Kernel.set_srai_collapsing()).
+
+A redirect is a category whose template is nothing but a <srai> with constant text.  The table
+maps the template of every redirect to the end of its chain of redirects, as far as the chain
+can be followed with PatternMgr.literal_match().  The table is built once, and then kept up to
+date as categories are added and removed, without going through the whole brain again: every
+chain remembers the inputs it looked up, and only the chains that looked up an input one of the
+changed patterns can make a difference to are followed again.
+
+Usage:
+    > aliases = SraiAliases(brain, constant_srai, sub, max_length=100)
+    > aliases.build()
+    > brain.add(pattern, that, topic, template)
+    > aliases.added((pattern, that, topic), template)
+    > aliases.update()
+    > input, target, guards, steps = aliases.aliases[id(template)]
+"""
+import collections
+import logging
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+def _may_match(pattern, words):
+    """Return True if the list of words of a pattern might match the words of an input.
+    BOT_NAME is taken to match any word.
+    """
+    if not pattern:
+        return not words
+    first = pattern[0]
+    if first in ("_", "*"):
+        return any(_may_match(pattern[1:], words[j:]) for j in range(1, len(words) + 1))
+    return (bool(words) and first in ("BOT_NAME", words[0]) and
+            _may_match(pattern[1:], words[1:]))
+
+
+class SraiAliases():
+    """The collapsed <srai> redirects of a PatternMgr.
+
+    Args:
+        brain (PatternMgr): the brain holding the redirects.
+        constant_srai (callable): returns the text a template redirects to, or None if the
+            template isn't a redirect.
+        sub (callable): applies the substitutions <srai> applies to its input.
+        max_length (int): chains longer than this aren't collapsed.
+    """
+
+    def __init__(self, brain, constant_srai, sub, max_length):
+        self.brain = brain
+        self._constant_srai = constant_srai
+        self._sub = sub
+        self._max_length = max_length
+        # maps id(template) of a redirect to the (input, template, guards, steps) it leads to
+        self.aliases = {}
+        # the number of redirects with each template, by id(template); templates can be shared
+        self._uses = collections.Counter()
+        # maps the (pattern, that, topic) of every redirect to a tuple (template, inputs), where
+        # inputs are the words of the inputs its chain looked up
+        self._redirects = {}
+        # maps the words of an input to the keys of the redirects whose chains looked it up
+        self._lookups = collections.defaultdict(set)
+        # maps the keys of the categories changed since the last update() to their new
+        # templates, or None if they were removed
+        self._changes = {}
+
+    def build(self):
+        """Collapse the redirects of all categories of the brain."""
+        start = time.perf_counter()
+        self.aliases = {}
+        self._uses = collections.Counter()
+        self._redirects = {}
+        self._lookups = collections.defaultdict(set)
+        self._changes = {}
+        for key, tem in self.brain.categories():
+            self._add(key, tem)
+        logger.debug("Collapsed %d <srai> redirects in %.2f seconds", len(self.aliases),
+                     time.perf_counter() - start)
+
+    def added(self, key, tem):
+        """Record that the category key, a (pattern, that, topic) tuple, was added to the brain
+        with the template tem, or had its template replaced by tem.  The table isn't up to date
+        until update() is called.
+        """
+        self._changes[self._normalize_key(key)] = tem
+
+    def removed(self, key):
+        """Record that the category key was removed from the brain; see added()."""
+        self._changes[self._normalize_key(key)] = None
+
+    def update(self):
+        """Bring the table up to date with the changes recorded since the last call."""
+        changes, self._changes = self._changes, {}
+        for key in changes:
+            self._remove(key)
+        keys = set()
+        for pattern in {key[0] for key in changes}:
+            keys.update(self._affected(pattern))
+        for key in keys:
+            tem = self._redirects[key][0]
+            self._remove(key)
+            self._add(key, tem)
+        for key, tem in changes.items():
+            if tem is not None:
+                self._add(key, tem)
+
+    @staticmethod
+    def _normalize_key(key):
+        return tuple(' '.join(part.split()) for part in key)
+
+    def _add(self, key, tem):
+        """Collapse the chain starting with the category key, if it's a redirect."""
+        if self._constant_srai(tem) is None:
+            return
+        inputs = []
+        alias = self._resolve(tem, inputs)
+        self._redirects[key] = (tem, inputs)
+        self._uses[id(tem)] += 1
+        for words in inputs:
+            self._lookups[words].add(key)
+        if alias is not None:
+            self.aliases[id(tem)] = alias
+        else:
+            # other redirects may share the template
+            self.aliases.pop(id(tem), None)
+
+    def _remove(self, key):
+        """Forget the chain starting with the category key."""
+        entry = self._redirects.pop(key, None)
+        if entry is None:
+            return
+        tem, inputs = entry
+        self._uses[id(tem)] -= 1
+        if not self._uses[id(tem)]:
+            del self._uses[id(tem)]
+            self.aliases.pop(id(tem), None)
+        for words in inputs:
+            keys = self._lookups.get(words)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._lookups[words]
+
+    def _affected(self, pattern):
+        """Return the keys of the redirects whose chains looked up an input that a category
+        with pattern can make a difference to.
+        """
+        words = pattern.split()
+        literal = []
+        for word in words:
+            if word in ("_", "*", "BOT_NAME"):
+                break
+            literal.append(word)
+        literal = tuple(literal)
+        # the category changes the keys of the nodes along its literal words, which decide
+        # whether literal_match() succeeds for inputs ending there
+        keys = set()
+        for i in range(1, len(literal) + 1):
+            keys.update(self._lookups.get(literal[:i], ()))
+        if len(literal) < len(words) and words[len(literal)] == "_":
+            # a "_" guards the inputs going past its node, if the rest of the pattern can match
+            # what's left of them
+            start = len(literal) + 1
+            rest = words[start:]
+            # the last word of the pattern, if the inputs it matches must end with it
+            last = rest[-1] if rest and rest[-1] not in ("_", "*", "BOT_NAME") else None
+            for input_words, input_keys in self._lookups.items():
+                if (len(input_words) >= start and input_words[:len(literal)] == literal and
+                        (last is None or input_words[-1] == last) and
+                        any(_may_match(rest, input_words[j:])
+                            for j in range(start, len(input_words) + 1))):
+                    keys.update(input_keys)
+        return keys
+
+    def _resolve(self, tem, inputs):
+        """Follow the chain of redirects starting with the template tem, as far as it can be
+        done without knowing 'that' and the topic (see PatternMgr.literal_match()).
+        Returns the (input, template) of the last redirect, the guards to check before using
+        it and the (input, template) of every redirect followed, or None if the chain can't be
+        collapsed.  The words of the inputs looked up are appended to inputs.
+        """
+        brain = self.brain
+        result = None
+        guards = []
+        steps = ()
+        seen = {id(tem)}
+        while True:
+            srai_input = self._constant_srai(tem)
+            if srai_input is None:
+                return result
+            subbed_input = self._sub(srai_input)
+            inputs.append(tuple(brain._normalize(subbed_input, "", "")[0]))
+            match = brain.literal_match(subbed_input)
+            if match is None:
+                return result
+            target, target_guards = match
+            if id(target) in seen:
+                logger.warning("Not collapsing <srai> cycle through '%s'", srai_input)
+                return None
+            if len(seen) > self._max_length:
+                logger.warning("Not collapsing <srai> chain through '%s', it's too long",
+                               srai_input)
+                return None
+            seen.add(id(target))
+            guards = guards + target_guards
+            steps = steps + ((srai_input, target),)
+            result = (srai_input, target, guards, steps)
+            tem = target
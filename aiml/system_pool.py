@@ -0,0 +1,183 @@
+"""
+This module implements the SystemExecutor class, which runs the shell commands of <system>
+elements.
+
+Commands run in a pool of worker threads, each of which manages one subprocess at a time, so the
+number of commands running at once is bounded.  Commands can be given a timeout, after which they
+are killed, and their output is capped at a maximum number of bytes.  Optionally, the output of
+each command string is cached, for commands that always print the same thing.
+
+Usage:
+    > executor = SystemExecutor(max_workers=2, timeout=5)
+    > executor.run("echo hello")
+    'hello'
+    > future = executor.submit("uptime")   # returns a concurrent.futures.Future
+"""
+import collections
+import concurrent.futures
+import locale
+import logging
+import os
+import signal
+import subprocess
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+ERROR_RESPONSE = "There was an error while computing my response.  Please inform my botmaster."
+
+
+class SystemExecutor():
+    """Runs shell commands in a bounded pool of subprocesses.
+
+    Args:
+        max_workers (int): maximum number of commands running at the same time.  Further
+            commands wait for a free worker.
+        timeout (float): number of seconds after which a command is killed.  The output it
+            printed up to then is returned.  None, the default, lets commands run for as long
+            as they take.
+        max_output (int): maximum number of bytes of output read from a command.  A command
+            printing more is killed, and its output truncated.
+        cache_size (int): number of distinct command strings whose output is cached.  0
+            disables the cache.
+        metrics (callable): if given, called as metrics(command, seconds, status, num_bytes)
+            after every command, where status is one of "ok", "cached", "timeout",
+            "truncated" or "error".
+    """
+
+    def __init__(self, max_workers=4, timeout=None, max_output=65536, cache_size=0,
+                 metrics=None):
+        self._timeout = timeout
+        self._max_output = max_output
+        self._metrics = metrics
+        self._cache_size = cache_size
+        # maps command strings to their output, least recently used first
+        self._cache = collections.OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers,
+                                                           thread_name_prefix="aiml-system")
+
+    def run(self, command):
+        """Run command, and return its output with the lines joined by spaces."""
+        return self.submit(command).result()
+
+    def submit(self, command):
+        """Start running command, and return a concurrent.futures.Future for the result of
+        run().
+        """
+        if self._cache_size > 0:
+            output = self._cached_output(command)
+            if output is not None:
+                self._report(command, 0.0, "cached", len(output))
+                future = concurrent.futures.Future()
+                future.set_result(output)
+                return future
+        return self._pool.submit(self._execute, command)
+
+    async def run_async(self, command):
+        """Coroutine version of run(), for use with asyncio."""
+        import asyncio
+        return await asyncio.wrap_future(self.submit(command))
+
+    def shutdown(self, wait=True):
+        """Stop accepting commands, and release the worker threads."""
+        self._pool.shutdown(wait)
+
+    def _execute(self, command):
+        """Run command in a subprocess; executed by a worker thread."""
+        start = time.perf_counter()
+        try:
+            process = subprocess.Popen(command, shell=True, stdin=subprocess.DEVNULL,
+                                       stdout=subprocess.PIPE,
+                                       start_new_session=(os.name == "posix"))
+        except (OSError, ValueError) as msg:
+            logger.warning("Error while processing \"system\" element:\n%s", msg)
+            self._report(command, time.perf_counter() - start, "error", 0)
+            return ERROR_RESPONSE
+
+        timed_out = threading.Event()
+
+        def kill_on_timeout():
+            timed_out.set()
+            self._kill(process)
+
+        timer = None
+        if self._timeout is not None:
+            timer = threading.Timer(self._timeout, kill_on_timeout)
+            timer.daemon = True
+            timer.start()
+        chunks = []
+        num_bytes = 0
+        truncated = False
+        try:
+            while True:
+                chunk = process.stdout.read1(4096)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                num_bytes += len(chunk)
+                if num_bytes > self._max_output:
+                    truncated = True
+                    self._kill(process)
+                    break
+        finally:
+            if timer is not None:
+                timer.cancel()
+            process.stdout.close()
+            process.wait()
+
+        data = b"".join(chunks)[:self._max_output]
+        text = data.decode(locale.getpreferredencoding(False), "replace")
+        # same formatting as when commands were run with os.popen()
+        response = "".join(line + "\n" for line in text.splitlines(True))
+        response = ' '.join(response.splitlines()).strip()
+
+        if timed_out.is_set():
+            logger.warning("\"system\" command timed out after %.1f seconds: %s",
+                           self._timeout, command)
+            status = "timeout"
+        elif truncated:
+            logger.warning("Output of \"system\" command truncated to %d bytes: %s",
+                           self._max_output, command)
+            status = "truncated"
+        else:
+            status = "ok"
+            if self._cache_size > 0:
+                self._cache_output(command, response)
+        self._report(command, time.perf_counter() - start, status, len(data))
+        return response
+
+    def _cached_output(self, command):
+        """Return the cached output of command, or None."""
+        with self._cache_lock:
+            output = self._cache.get(command)
+            if output is not None:
+                self._cache.move_to_end(command)
+            return output
+
+    def _cache_output(self, command, output):
+        """Cache the output of command, dropping the least recently used entry if full."""
+        with self._cache_lock:
+            self._cache[command] = output
+            self._cache.move_to_end(command)
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+    def _kill(self, process):
+        """Kill process, and on POSIX every process it started."""
+        try:
+            if os.name == "posix":
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+        except OSError:
+            pass  # already gone
+
+    def _report(self, command, seconds, status, num_bytes):
+        if self._metrics is not None:
+            try:
+                self._metrics(command, seconds, status, num_bytes)
+            except Exception:
+                logger.exception("Error in \"system\" metrics hook:")
@@ -0,0 +1,111 @@
+"""
+This module implements the TagProfiler class, which measures where the time of processing
+templates goes, by element type.
+
+The profiler wraps functions, such as the element handlers of a Kernel, and records for each
+name the number of calls, the cumulative time (including the calls nested in them, counted
+once for recursive calls), the self time (excluding the calls nested in them that are profiled
+too), and the deepest nesting level it was called at.  If a dump interval is set, the
+statistics are logged at most that often, when a call that isn't nested in another one
+returns.
+
+Usage:
+    > profiler = TagProfiler(dump_interval=60)
+    > handler = profiler.wrap("srai", handler)
+    > profiler.stats()["srai"]["self"]
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TagProfiler():
+    """Collects the time taken by wrapped functions.
+
+    Args:
+        dump_interval (float): if not None, log the statistics every dump_interval seconds.
+    """
+
+    def __init__(self, dump_interval=None):
+        self.dump_interval = dump_interval
+        # [calls, cumulative time, self time, max depth] by name
+        self._stats = {}
+        self._lock = threading.Lock()
+        # the calls in progress in each thread: a stack of [time spent in nested calls], and
+        # the number of calls in progress by name
+        self._local = threading.local()
+        self._last_dump = time.perf_counter()
+
+    def wrap(self, name, func):
+        """Return a function calling func, whose calls are recorded under name."""
+        perf_counter = time.perf_counter
+        local = self._local
+
+        def profiled(*args, **kwargs):
+            try:
+                stack = local.stack
+                active = local.active
+            except AttributeError:
+                stack = local.stack = []
+                active = local.active = {}
+            nested = [0.0]
+            stack.append(nested)
+            active[name] = active.get(name, 0) + 1
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - start
+                depth = len(stack)
+                stack.pop()
+                active[name] -= 1
+                if stack:
+                    stack[-1][0] += elapsed
+                self._record(name, elapsed, elapsed - nested[0], depth, active[name] == 0)
+                if not stack and self.dump_interval is not None:
+                    self._dump_if_due()
+
+        return profiled
+
+    def _record(self, name, elapsed, self_time, depth, outermost):
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = [0, 0.0, 0.0, 0]
+            stats[0] += 1
+            if outermost:
+                stats[1] += elapsed
+            stats[2] += self_time
+            if depth > stats[3]:
+                stats[3] = depth
+
+    def stats(self, reset=False):
+        """Return a dictionary mapping every name to a dictionary with its calls, cumulative
+        and self time in seconds, and max_depth, the deepest nesting level it was called at
+        (1 for calls that aren't nested in another one).  If reset is true, the statistics
+        start over afterwards.
+        """
+        with self._lock:
+            stats = {name: {"calls": calls, "cumulative": cumulative, "self": self_time,
+                            "max_depth": max_depth}
+                     for name, (calls, cumulative, self_time, max_depth) in self._stats.items()}
+            if reset:
+                self._stats = {}
+        return stats
+
+    def format_stats(self):
+        """Return the statistics as text, the names with the most self time first."""
+        lines = ["%-16s %9s %12s %12s %9s" % ("name", "calls", "cumulative", "self",
+                                              "max depth")]
+        for name, stats in sorted(self.stats().items(), key=lambda item: -item[1]["self"]):
+            lines.append("%-16s %9d %10.3f s %10.3f s %9d" % (
+                name, stats["calls"], stats["cumulative"], stats["self"], stats["max_depth"]))
+        return "\n".join(lines)
+
+    def _dump_if_due(self):
+        now = time.perf_counter()
+        if now - self._last_dump >= self.dump_interval:
+            self._last_dump = now
+            logger.info("Template profile:\n%s", self.format_stats())
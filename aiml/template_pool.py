@@ -0,0 +1,81 @@
+"""
+This module implements the TemplatePool class, which shares the identical parts of templates.
+
+A template is a tree of lists [name, attributes, child, ...], where text is held by
+["text", attributes, string] elements.  AIML sets contain thousands of identical templates, such
+as the same <srai> redirect, and many more identical fragments, while nearly every element comes
+with an attribute dictionary of its own, with the same contents as many others.  The pool
+replaces every element and attribute dictionary with the first identical one it was given, so
+that the copies can be freed.
+
+Elements in the pool are shared by templates that have nothing to do with each other, so they
+must never be changed.
+
+Usage:
+    > pool = TemplatePool()
+    > template = pool.intern(template)
+    > pool.stats()["bytes_saved"]
+"""
+import sys
+
+
+class TemplatePool():
+    """Pool of the distinct elements and attribute dictionaries of templates."""
+
+    def __init__(self):
+        # map the key of every distinct element, and the items of every distinct attribute
+        # dictionary, to the element or dictionary in the pool.  The key of an element holds the
+        # ids of its children and attributes, which the pool keeps alive.
+        self._elements = {}
+        self._attrs = {}
+        self._num_elements = 0
+        self._num_shared = 0
+        self._bytes_saved = 0
+
+    def intern(self, elem):
+        """Return the element of the pool identical to elem, adding elem to the pool if there is
+        none.  The elements nested in elem, and the attribute dictionaries, are replaced by
+        those of the pool as well, which changes elem.
+        """
+        for i in range(2, len(elem)):
+            if isinstance(elem[i], list):
+                elem[i] = self.intern(elem[i])
+        attr_items = tuple(sorted(elem[1].items()))
+        attrs = self._attrs.setdefault(attr_items, elem[1])
+        if attrs is not elem[1]:
+            self._bytes_saved += sys.getsizeof(elem[1])
+            elem[1] = attrs
+        key = (elem[0], id(attrs)) + tuple(id(child) if isinstance(child, list) else child
+                                           for child in elem[2:])
+        shared = self._elements.setdefault(key, elem)
+        if shared is not elem:
+            self._num_shared += 1
+            self._bytes_saved += sys.getsizeof(elem) + sum(
+                sys.getsizeof(child) for child in elem[2:] if not isinstance(child, list))
+        self._num_elements += 1
+        return shared
+
+    def clear(self):
+        """Forget the elements of the pool; elements interned later are only shared with each
+        other.  The statistics are kept.
+        """
+        self._elements = {}
+        self._attrs = {}
+
+    def stats(self):
+        """Return a dictionary with the statistics of the pool: the number of elements interned,
+        how many of them were replaced by an identical element ("shared"), the number of
+        distinct elements and attribute dictionaries in the pool, an estimate of the bytes
+        freed by sharing, and the bytes taken up by the pool's own tables ("pool_bytes").
+        """
+        pool_bytes = (sys.getsizeof(self._elements) + sys.getsizeof(self._attrs) +
+                      sum(sys.getsizeof(key) for key in self._elements) +
+                      sum(sys.getsizeof(items) for items in self._attrs))
+        return {
+            "elements": self._num_elements,
+            "shared": self._num_shared,
+            "distinct_elements": len(self._elements),
+            "distinct_attrs": len(self._attrs),
+            "bytes_saved": self._bytes_saved,
+            "pool_bytes": pool_bytes,
+        }
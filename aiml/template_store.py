@@ -0,0 +1,89 @@
+"""
+This module implements the TemplateStore class, an on-disk store of templates, which keeps
+rarely used templates out of memory.
+
+Templates are appended to a single file in marshal format, the format of saved brains, and read
+back by the key they were given.  The offsets of the templates in the file are kept in memory,
+in an array indexed by key, and the templates read most recently in an LRU cache, so that a
+template that is used again soon is read from disk only once.  The file is only meant to live
+as long as the store: it's created with the store, which refuses to overwrite an existing file,
+and removed when the store is closed.
+
+Usage:
+    > store = TemplateStore("/var/tmp/pyaiml-templates", cache_size=1000)
+    > key = store.add(template)
+    > template = store.get(key)
+    > store.close()
+"""
+import array
+import marshal
+import os
+import threading
+
+from . import pattern_mgr
+
+
+class TemplateStore():
+    """On-disk store of templates.
+
+    Args:
+        path (str): the file to keep the templates in.  It's created, and mustn't exist yet;
+            FileExistsError is raised otherwise.
+        cache_size (int): number of templates kept in memory after they were read.  0 disables
+            the cache.
+    """
+
+    def __init__(self, path, cache_size=1000):
+        self.path = os.path.abspath(path)
+        self._file = open(self.path, "x+b")
+        # offset of every template in the file, indexed by key
+        self._offsets = array.array("q")
+        self._cache = pattern_mgr.MatchCache(cache_size) if cache_size > 0 else None
+        self._lock = threading.Lock()
+        self._reads = 0
+
+    def add(self, template):
+        """Store template, and return the key to get() it back with."""
+        with self._lock:
+            self._file.seek(0, os.SEEK_END)
+            self._offsets.append(self._file.tell())
+            marshal.dump(template, self._file)
+            return len(self._offsets) - 1
+
+    def get(self, key):
+        """Return the template stored under key.  Raises KeyError if there is none."""
+        if self._cache is not None:
+            template = self._cache.get(key, 0)
+            if template is not None:
+                return template
+        with self._lock:
+            if not 0 <= key < len(self._offsets):
+                raise KeyError(key)
+            self._file.seek(self._offsets[key])
+            template = marshal.load(self._file)
+            self._reads += 1
+        if self._cache is not None:
+            self._cache.put(key, template, 0)
+        return template
+
+    def stats(self):
+        """Return a dictionary with the number of templates stored, the size of the file in
+        bytes, the number of templates read from the file ("reads"), and the statistics of the
+        cache, as returned by MatchCache.stats(), or None if it's disabled.
+        """
+        with self._lock:
+            self._file.seek(0, os.SEEK_END)
+            return {
+                "templates": len(self._offsets),
+                "bytes": self._file.tell(),
+                "reads": self._reads,
+                "cache": None if self._cache is None else self._cache.stats(),
+            }
+
+    def close(self):
+        """Close and remove the file.  The store can't be used anymore afterwards."""
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.close()
+            os.remove(self.path)
@@ -0,0 +1,109 @@
+"""
+Compare the backtracking and automaton pattern-matching engines.
+
+Usage:
+    python benchmarks/bench_automaton.py [--limit SECONDS]
+
+Matches inputs against two brains with both engines (PatternMgr.set_match_engine()), checks that
+they find the same matches, and prints the time taken by each:
+
+- the standard AIML set in sets/standard, with inputs made from its own patterns;
+- a synthetic brain of patterns with many wildcards, which all fail on long inputs made of the
+  same few words, but only after backtracking tried a great many ways of splitting the input.
+
+Matches taking longer than the limit are cut short with a deadline, and reported as such.
+"""
+import argparse
+import glob
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from aiml import Kernel
+from aiml import pattern_mgr
+
+
+ENGINES = ["backtracking", "automaton"]
+
+
+def standard_brain():
+    kernel = Kernel()
+    kernel.set_parser_backend("expat")
+    for f in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+                                           "sets", "standard", "*.aiml"))):
+        kernel.learn(f)
+    brain = kernel._brain
+    rng = random.Random(1)
+    patterns = [key[0] for key, _ in brain.categories()]
+    inputs = []
+    for _ in range(3000):
+        input = rng.choice(patterns).replace("*", "foo bar").replace("_", "baz")
+        inputs.append((input, "", ""))
+    return brain, inputs
+
+
+def synthetic_brain():
+    rng = random.Random(2)
+    brain = pattern_mgr.PatternMgr()
+    words = ["A", "B", "C", "D"]
+    for i in range(2000):
+        # the inputs never contain "E", so these patterns don't match after all
+        pattern = " ".join(rng.choice(words + ["*", "*", "_"]) for _ in range(rng.randint(3, 8)))
+        brain.add(pattern + " E", rng.choice(["*", "A *", "* B"]), "*", "template %d" % i)
+    brain.add("* D", "*", "*", "ends with D")
+    inputs = []
+    for length in (10, 20, 40, 80):
+        for _ in range(5):
+            input = " ".join(rng.choice(words) for _ in range(length))
+            inputs.append((input, "a b", ""))
+    return brain, inputs
+
+
+def run(brain, inputs, limit):
+    """Match every input, returning the results and the time taken, or None as the time if a
+    match exceeded the limit.
+    """
+    results = []
+    start = time.perf_counter()
+    for input, that, topic in inputs:
+        try:
+            results.append(brain.match(input, that, topic, deadline=time.monotonic() + limit))
+        except pattern_mgr.MatchTimeout:
+            return None, None
+    return results, time.perf_counter() - start
+
+
+def main(args):
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--limit", type=float, default=10.0,
+                            help="maximum number of seconds per match (default: 10)")
+    options = arg_parser.parse_args(args)
+    logging.disable(logging.CRITICAL)
+
+    status = 0
+    for name, make_brain in [("sets/standard", standard_brain), ("synthetic", synthetic_brain)]:
+        brain, inputs = make_brain()
+        print("%s: %d categories, %d inputs" % (name, brain.num_templates(), len(inputs)))
+        results = {}
+        for engine in ENGINES:
+            brain.set_match_engine(engine)
+            start = time.perf_counter()
+            brain.match("warm up", "", "")  # compiles the automaton
+            setup = time.perf_counter() - start
+            results[engine], seconds = run(brain, inputs, options.limit)
+            if seconds is None:
+                print("  %-13s exceeded the limit of %.0f s" % (engine, options.limit))
+            else:
+                print("  %-13s %8.3f s  (%.3f s to set up)" % (engine, seconds, setup))
+        if None not in results.values() and results["backtracking"] != results["automaton"]:
+            print("ERROR: the engines found different matches")
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
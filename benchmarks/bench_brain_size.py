@@ -0,0 +1,158 @@
+"""
+Measure the memory taken up by the brain of the standard AIML set.
+
+Usage:
+    python benchmarks/bench_brain_size.py [--inputs N] [--hot FRACTION]
+
+Learns the standard AIML set in sets/standard with and without template sharing
+(Kernel.set_template_sharing()), and reports the memory the brain takes up either way.  Then
+responds to inputs made from a --hot fraction of the set's patterns, offloads the templates of
+the categories that weren't matched (Kernel.offload_templates()), and reports the memory the
+kernel takes up before and after, and the time taken to respond.  Finally it reports for each setting of PatternMgr.set_path_compression() the number of nodes of the tree,
+the memory they take up (dictionaries, and the tuples of compressed words, but not the
+templates), the memory taken by a copy of the whole tree, templates included, and the time taken
+to match inputs made from the set's own patterns.
+"""
+import argparse
+import gc
+import glob
+import logging
+import marshal
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from aiml import Kernel
+
+
+def standard_kernel(share_templates):
+    kernel = Kernel()
+    kernel.set_parser_backend("expat")
+    kernel.set_template_sharing(share_templates)
+    for f in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+                                           "sets", "standard", "*.aiml"))):
+        kernel.learn(f)
+    return kernel
+
+
+def learned_size(share_templates):
+    """Return a Kernel that learned the standard set, and the bytes its brain takes up,
+    including the template pool.
+    """
+    tracemalloc.start()
+    kernel = standard_kernel(share_templates)
+    gc.collect()
+    num_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return kernel, num_bytes
+
+
+def tree_size(brain):
+    """Return the number of nodes of the tree of brain, and the bytes they take up."""
+    num_nodes = num_bytes = 0
+    stack = [brain._root]
+    while stack:
+        node = stack.pop()
+        num_nodes += 1
+        num_bytes += sys.getsizeof(node) + sys.getsizeof(node.get(brain._RUN, ()))
+        for key, child in node.items():
+            if key not in brain._LEAF_KEYS:
+                stack.append(child)
+    return num_nodes, num_bytes
+
+
+def copy_size(brain):
+    """Return the bytes allocated by a copy of the tree of brain, templates included."""
+    data = marshal.dumps(brain._root)
+    tracemalloc.start()
+    copy = marshal.loads(data)  # still alive while measuring
+    num_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return num_bytes
+
+
+def offload(inputs, store_path):
+    """Learn the standard set, respond to inputs, and offload the templates that weren't used.
+    Print the memory taken up by the kernel before and after, and the time to respond.
+    """
+    tracemalloc.start()
+    kernel = standard_kernel(True)
+    kernel.set_hit_counting(True)
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    for input in inputs:
+        kernel.respond(input)
+    seconds = time.perf_counter() - start
+    num_moved = kernel.offload_templates(store_path)
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    for input in inputs:
+        kernel.respond(input)
+    offloaded_seconds = time.perf_counter() - start
+    tracemalloc.stop()
+    print("offloading %d of %d templates: kernel %.1f MB -> %.1f MB, responding %.3f s -> "
+          "%.3f s, %d templates read back" % (
+              num_moved, kernel.num_categories(), before / 1e6, after / 1e6, seconds,
+              offloaded_seconds, kernel.offload_stats()["reads"]))
+    kernel.close()
+
+
+def time_matches(brain, inputs):
+    start = time.perf_counter()
+    results = [brain.match(input, "", "") for input in inputs]
+    return results, time.perf_counter() - start
+
+
+def main(args):
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--inputs", type=int, default=5000,
+                            help="number of inputs to match (default: 5000)")
+    arg_parser.add_argument("--hot", type=float, default=0.05,
+                            help="fraction of the patterns used before offloading (default: 0.05)")
+    options = arg_parser.parse_args(args)
+    logging.disable(logging.CRITICAL)
+
+    for share_templates in (False, True):
+        kernel, num_bytes = learned_size(share_templates)
+        print("template sharing %-3s  brain: %6.1f MB" % ("on" if share_templates else "off",
+                                                        num_bytes / 1e6))
+    stats = kernel.template_pool_stats()
+    print("  %d of %d template elements shared, %.1f MB saved, %.1f MB taken by the pool" % (
+        stats["shared"], stats["elements"], stats["bytes_saved"] / 1e6,
+        stats["pool_bytes"] / 1e6))
+
+    brain = kernel._brain
+    rng = random.Random(1)
+    patterns = [key[0] for key, _ in brain.categories()]
+    inputs = [rng.choice(patterns).replace("*", "foo bar").replace("_", "baz")
+              for _ in range(options.inputs)]
+    print("sets/standard: %d categories, %d inputs" % (brain.num_templates(), len(inputs)))
+    hot = rng.sample(patterns, int(len(patterns) * options.hot))
+    hot_inputs = [rng.choice(hot).replace("*", "foo bar").replace("_", "baz")
+                  for _ in range(options.inputs)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        offload(hot_inputs, os.path.join(tmp_dir, "templates"))
+    print("%-12s %8s %12s %12s %10s" % ("compression", "nodes", "node bytes", "copy bytes",
+                                        "matching"))
+    results = {}
+    for enabled in (False, True):
+        brain.set_path_compression(enabled)
+        num_nodes, num_bytes = tree_size(brain)
+        results[enabled], seconds = time_matches(brain, inputs)
+        print("%-12s %8d %12d %12d %8.3f s" % ("on" if enabled else "off", num_nodes, num_bytes,
+                                               copy_size(brain), seconds))
+    if results[False] != results[True]:
+        print("ERROR: compression changed the matches")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,116 @@
+"""
+Measure the pauses of the cyclic garbage collector while responding, with and without freezing
+the brain (Kernel.set_gc_freeze()).
+
+Usage:
+    python benchmarks/bench_gc.py [--responses N] [--churn N]
+
+Learns the standard AIML set in sets/standard, then responds to inputs made from its own
+patterns, and reports the time taken by a full collection, the pauses of the collections that
+happened while responding, and the tail of the request latencies.  The first round runs with
+the brain tracked by the garbage collector, the second after freezing it.  To make the
+collector run as it would in a busy server, every response also leaves --churn container
+objects behind, which stay alive for a while; the latency of a request includes the time
+taken by that.
+"""
+import argparse
+import collections
+import gc
+import glob
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from aiml import Kernel
+
+
+def standard_kernel():
+    kernel = Kernel()
+    kernel.set_parser_backend("expat")
+    for f in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+                                           "sets", "standard", "*.aiml"))):
+        kernel.learn(f)
+    return kernel
+
+
+class PauseRecorder():
+    """Records the duration of every garbage collection, by generation."""
+
+    def __init__(self):
+        self.pauses = collections.defaultdict(list)
+        self._start = None
+
+    def __call__(self, phase, info):
+        if phase == "start":
+            self._start = time.perf_counter()
+        elif self._start is not None:
+            self.pauses[info["generation"]].append(time.perf_counter() - self._start)
+            self._start = None
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(kernel, inputs, churn):
+    """Respond to inputs, and print the collection pauses and response latencies."""
+    full = []
+    for _ in range(3):
+        start = time.perf_counter()
+        gc.collect()
+        full.append(time.perf_counter() - start)
+    print("  full collection:  %8.1f ms" % (min(full) * 1000))
+
+    recorder = PauseRecorder()
+    survivors = collections.deque(maxlen=200000)
+    latencies = []
+    gc.callbacks.append(recorder)
+    try:
+        for input in inputs:
+            start = time.perf_counter()
+            kernel.respond(input)
+            survivors.extend([input, i] for i in range(churn))
+            latencies.append(time.perf_counter() - start)
+    finally:
+        gc.callbacks.remove(recorder)
+    for generation in sorted(recorder.pauses):
+        pauses = recorder.pauses[generation]
+        print("  generation %d:     %5d collections, max %7.2f ms, total %8.1f ms" % (
+            generation, len(pauses), max(pauses) * 1000, sum(pauses) * 1000))
+    print("  requests:         p50 %.2f ms, p99 %.2f ms, p99.9 %.2f ms, max %.2f ms" % tuple(
+        value * 1000 for value in (percentile(latencies, 0.5), percentile(latencies, 0.99),
+                                   percentile(latencies, 0.999), max(latencies))))
+
+
+def main(args):
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--responses", type=int, default=20000,
+                            help="number of responses per round (default: 20000)")
+    arg_parser.add_argument("--churn", type=int, default=50,
+                            help="objects left behind by every response (default: 50)")
+    options = arg_parser.parse_args(args)
+    logging.disable(logging.CRITICAL)
+
+    kernel = standard_kernel()
+    rng = random.Random(1)
+    patterns = [key[0] for key, _ in kernel._brain.categories()]
+    inputs = [rng.choice(patterns).replace("*", "foo bar").replace("_", "baz")
+              for _ in range(options.responses)]
+    print("sets/standard: %d categories, %d responses per round" % (kernel.num_categories(),
+                                                                    len(inputs)))
+    print("brain tracked by the garbage collector:")
+    run(kernel, inputs, options.churn)
+    kernel.set_gc_freeze(True)
+    print("brain frozen (%d objects):" % gc.get_freeze_count())
+    run(kernel, inputs, options.churn)
+    kernel.set_gc_freeze(False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
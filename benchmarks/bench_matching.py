@@ -0,0 +1,64 @@
+"""
+Measure how the pattern matcher copes with inputs that cause excessive backtracking.
+
+Usage:
+    python benchmarks/bench_matching.py [--limit SECONDS]
+
+Matches runs of growing length of a single word against patterns with several wildcards, which
+fail only after trying every way of splitting the input among the wildcards, with plain
+backtracking and with the failure memo (PatternMgr.set_failure_memo()).  Matches taking longer
+than the limit are cut short with a deadline, and reported as such.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from aiml import pattern_mgr
+
+
+# (pattern, input word, input lengths); none of the inputs match
+CASES = [
+    ("* * * * * * NEVER", "X", [10, 20, 40, 80]),
+    ("* A * A * A * A * B", "A", [10, 20, 40, 80]),
+    ("_ A _ A _ A * A * B", "A", [10, 20, 40, 80]),
+]
+
+
+def time_match(brain, input, limit):
+    """Return the seconds a match of input takes, or None if it exceeds limit."""
+    start = time.perf_counter()
+    try:
+        brain.match(input, "", "", deadline=time.monotonic() + limit)
+    except pattern_mgr.MatchTimeout:
+        return None
+    return time.perf_counter() - start
+
+
+def main(args):
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--limit", type=float, default=5.0,
+                            help="maximum number of seconds per match (default: 5)")
+    options = arg_parser.parse_args(args)
+
+    def fmt(seconds):
+        return ">%.0f s" % options.limit if seconds is None else "%.4f s" % seconds
+
+    print("%-22s %6s %12s %12s" % ("pattern", "words", "backtracking", "failure memo"))
+    for pattern, word, lengths in CASES:
+        brain = pattern_mgr.PatternMgr()
+        brain.add(pattern, "*", "*", "never")
+        for length in lengths:
+            input = " ".join([word] * length)
+            brain.set_failure_memo(False)
+            plain = time_match(brain, input, options.limit)
+            brain.set_failure_memo(True)
+            memo = time_match(brain, input, options.limit)
+            print("%-22s %6d %12s %12s" % (pattern, length, fmt(plain), fmt(memo)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,74 @@
+"""
+Compare the throughput of the AIML parser backends.
+
+Usage:
+    python benchmarks/bench_parser.py [file_or_glob ...]
+
+Parses every file (by default the files in sets/standard) with each backend, checks that the
+backends agree on the categories and error counts, and prints the time taken by each.
+"""
+import glob
+import logging
+import os
+import sys
+import time
+import xml.sax
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from aiml import aiml_parser
+
+
+BACKENDS = ["sax", "expat"]
+ROUNDS = 5
+
+
+def parse_all(backend, files):
+    results = {}
+    for f in files:
+        parser = aiml_parser.create_parser(backend)
+        handler = parser.getContentHandler()
+        try:
+            parser.parse(f)
+        except xml.sax.SAXParseException:
+            # not well-formed XML; the Kernel skips such files altogether
+            results[f] = None
+            continue
+        results[f] = (handler.categories, handler.get_num_errors())
+    return results
+
+
+def main(args):
+    logging.disable(logging.CRITICAL)  # parse errors in the sets would flood the output
+    base_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    patterns = args or [os.path.join(base_dir, "sets", "standard", "*.aiml")]
+    files = sorted(f for pattern in patterns for f in glob.glob(pattern))
+    num_bytes = sum(os.path.getsize(f) for f in files)
+    print("%d files, %.1f MB" % (len(files), num_bytes / 1e6))
+
+    reference = None
+    timings = {}
+    for backend in BACKENDS:
+        results = parse_all(backend, files)  # warm-up, and the result to compare
+        if reference is None:
+            reference = results
+        elif results != reference:
+            print("ERROR: %s backend disagrees with %s" % (backend, BACKENDS[0]))
+            return 1
+        best = float("inf")
+        for _ in range(ROUNDS):
+            start = time.perf_counter()
+            parse_all(backend, files)
+            best = min(best, time.perf_counter() - start)
+        timings[backend] = best
+
+    num_categories = sum(len(result[0]) for result in reference.values() if result is not None)
+    for backend in BACKENDS:
+        print("%-6s %7.3f s  %6.2f MB/s  %8.0f categories/s  (x%.2f)" % (
+            backend, timings[backend], num_bytes / 1e6 / timings[backend],
+            num_categories / timings[backend], timings[BACKENDS[0]] / timings[backend]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,106 @@
+"""
+Measure how long it takes to import aiml and create a Kernel.
+
+Usage:
+    python benchmarks/bench_startup.py [--budget MS]
+
+Every measurement runs in a fresh interpreter.  The import is profiled with python -X importtime,
+and the slowest modules are listed.  The script fails (exit status 1) if importing aiml pulls in
+one of the modules that are supposed to be imported lazily, or if the best import time exceeds
+the budget given in milliseconds.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+ROUNDS = 5
+# modules only needed by some features; importing aiml must not import them
+LAZY_MODULES = [
+    "numpy",
+    "aiml.big5",
+    "aiml.aiml_parser",
+    "aiml.automaton",
+    "aiml.parse_cache",
+    "aiml.brain_watcher",
+    "aiml.system_pool",
+    "aiml.template_pool",
+    "aiml.template_store",
+    "aiml.brain_report",
+    "aiml.hotspots",
+    "aiml.tag_profiler",
+    "aiml.srai_aliases",
+    "subprocess",
+    "xml.sax",
+    "configparser",
+    "pprint",
+]
+
+KERNEL_SCRIPT = """
+import time
+start = time.perf_counter()
+import aiml
+imported = time.perf_counter()
+aiml.Kernel()
+print(imported - start, time.perf_counter() - imported)
+"""
+
+
+def run(args):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [BASE_DIR, env.get("PYTHONPATH")]))
+    return subprocess.run([sys.executable] + args, env=env, check=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+
+
+def import_profile():
+    """Return a dictionary mapping each module imported by 'import aiml' to its cumulative
+    import time in microseconds.
+    """
+    stderr = run(["-X", "importtime", "-c", "import aiml"]).stderr
+    profile = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        try:
+            profile[name.strip()] = int(cumulative)
+        except ValueError:
+            pass  # the header line
+    return profile
+
+
+def main(args):
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--budget", type=float, help="maximum import time in milliseconds")
+    options = arg_parser.parse_args(args)
+
+    profile = import_profile()
+    status = 0
+    for name in LAZY_MODULES:
+        if name in profile:
+            print("ERROR: importing aiml imports %s" % name)
+            status = 1
+    print("Slowest imports (cumulative):")
+    for name, cumulative in sorted(profile.items(), key=lambda item: -item[1])[:10]:
+        print("  %-30s %7.1f ms" % (name, cumulative / 1000))
+
+    import_times, kernel_times = [], []
+    for _ in range(ROUNDS):
+        import_time, kernel_time = map(float, run(["-c", KERNEL_SCRIPT]).stdout.split())
+        import_times.append(import_time)
+        kernel_times.append(kernel_time)
+    best_import = min(import_times) * 1000
+    print("import aiml:  %7.1f ms  (best of %d)" % (best_import, ROUNDS))
+    print("Kernel():     %7.1f ms  (best of %d)" % (min(kernel_times) * 1000, ROUNDS))
+    if options.budget is not None and best_import > options.budget:
+        print("ERROR: import time exceeds the budget of %.1f ms" % options.budget)
+        status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,35 @@
+import os
+import shutil
+import tempfile
+
+
+def write_aiml(path, *categories):
+    """Write an AIML file with the given (pattern, template) or (pattern, that, template)
+    categories.
+    """
+    with open(path, "w") as out:
+        out.write("<aiml version='1.0.1'>")
+        for category in categories:
+            pattern, template = category[0], category[-1]
+            that = "<that>%s</that>" % category[1] if len(category) == 3 else ""
+            out.write("<category><pattern>%s</pattern>%s<template>%s</template></category>"
+                      % (pattern, that, template))
+        out.write("</aiml>")
+
+
+class TempDirMixin(object):
+    """Give each test a temporary directory, removed when the test is done."""
+
+    def setUp(self):
+        super(TempDirMixin, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def temp_path(self, name):
+        return os.path.join(self.directory, name)
+
+    def write_aiml(self, name, *categories):
+        """Write an AIML file named name into the temporary directory, and return its path."""
+        path = self.temp_path(name)
+        write_aiml(path, *categories)
+        return path
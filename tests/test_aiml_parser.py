@@ -0,0 +1,70 @@
+import io
+import os
+import unittest
+import xml.sax
+
+from aiml import aiml_parser
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# A document full of AIML (not XML) errors, each of which makes the parser skip a category.
+BROKEN_AIML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<aiml version="1.0.1">
+<category><pattern>GOOD</pattern><template>Fine <star index="1"/></template></category>
+<category><pattern>BAD STAR</pattern><template><star index="x"/></template></category>
+<category><pattern>BAD NESTING</pattern><template><random>text</random></template></category>
+<category><pattern>BAD LI</pattern><template><li>item</li></template></category>
+<category><pattern>BAD SPACE</pattern><template xml:space="weird">x</template></category>
+<category><pattern>BAD <get name="x"/></pattern><template>x</template></category>
+<category><pattern>UNKNOWN</pattern><template><blink>x</blink></template></category>
+<topic name="FRUIT">
+<category><pattern>APPLE</pattern><that>* RED</that>
+<template><condition name="x"><li value="1">one</li><li>two</li><li>three</li></condition>
+</template></category>
+</topic>
+<category><pattern>GOOD AGAIN</pattern><template>
+  <random><li>a</li><li>b</li></random>
+</template></category>
+</aiml>
+"""
+
+
+def parse(backend, source):
+    parser = aiml_parser.create_parser(backend)
+    handler = parser.getContentHandler()
+    parser.parse(source)
+    return handler.categories, handler.get_num_errors()
+
+
+class ParserBackendTests(unittest.TestCase):
+
+    def test_same_categories(self):
+        path = os.path.join(BASE_DIR, "self-test.aiml")
+        sax_result = parse("sax", path)
+        self.assertEqual(parse("expat", path), sax_result)
+        self.assertEqual(sax_result[1], 0)
+
+    def test_same_errors(self):
+        sax_result = parse("sax", io.BytesIO(BROKEN_AIML))
+        self.assertEqual(parse("expat", io.BytesIO(BROKEN_AIML)), sax_result)
+        categories, num_errors = sax_result
+        self.assertEqual(num_errors, 7)
+        self.assertEqual(sorted(pattern for pattern, that, topic in categories),
+                         ["GOOD", "GOOD AGAIN"])
+
+    def test_malformed_xml(self):
+        for backend in ("sax", "expat"):
+            with self.assertRaises(xml.sax.SAXParseException):
+                parse(backend, io.BytesIO(b"<aiml><category></aiml>"))
+
+    def test_unknown_backend(self):
+        self.assertRaises(ValueError, aiml_parser.create_parser, "lxml")
+
+    def test_category_callback(self):
+        for backend in ("sax", "expat"):
+            emitted = []
+            parser = aiml_parser.create_parser(backend, lambda key, tem: emitted.append(key))
+            parser.parse(io.BytesIO(BROKEN_AIML))
+            self.assertEqual(parser.getContentHandler().categories, {})
+            self.assertEqual(emitted, [("GOOD", "*", "*"), ("GOOD AGAIN", "*", "*")])
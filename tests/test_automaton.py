@@ -0,0 +1,64 @@
+import random
+import unittest
+
+from aiml import automaton
+from aiml import pattern_mgr
+
+
+def random_pattern(rng, max_words, words=("A", "B", "C", "*", "_")):
+    return " ".join(rng.choice(words) for _ in range(rng.randint(1, max_words)))
+
+
+def random_words(rng, max_words):
+    return " ".join(rng.choice(["a", "b", "c", "nameless"])
+                    for _ in range(rng.randint(1, max_words)))
+
+
+class AutomatonTests(unittest.TestCase):
+
+    def test_spans(self):
+        brain = pattern_mgr.PatternMgr()
+        brain.add("HELLO * WORLD _", "*", "*", "hello")
+        brain.add("HELLO BIG *", "YES", "_ FRUIT", "big")
+        matcher = automaton.Automaton(brain)
+        star, underscore = brain._STAR, brain._UNDERSCORE
+        that, topic = brain._THAT, brain._TOPIC
+        self.assertEqual(matcher.match(("HELLO", "BIG", "WIDE", "WORLD", "AGAIN"), ("NO",), ("X",)),
+                         (["HELLO", star, "WORLD", underscore, that, star, topic, star], "hello",
+                          [(0, 1, 3), (0, 4, 5), (1, 0, 1), (2, 0, 1)]))
+        self.assertEqual(matcher.match(("HELLO", "BIG", "WORLD"), ("YES",), ("RED", "FRUIT")),
+                         (["HELLO", "BIG", star, that, "YES", topic, underscore, "FRUIT"], "big",
+                          [(0, 2, 3), (2, 0, 1)]))
+        self.assertEqual(matcher.match(("HELLO",), ("YES",), ("FRUIT",)), (None, None, None))
+
+    def test_same_matches_as_backtracking(self):
+        rng = random.Random(4)
+        for _ in range(20):
+            brain = pattern_mgr.PatternMgr()
+            brain.set_bot_name("NAMELESS")
+            for i in range(40):
+                pattern = random_pattern(rng, 5, ("A", "B", "C", "*", "_", "BOT_NAME"))
+                brain.add(pattern, random_pattern(rng, 2), random_pattern(rng, 2),
+                          "template %d" % i)
+            brain.add("*", "*", "*", "default")
+            matcher = automaton.Automaton(brain)
+            for _ in range(50):
+                words, that_words, topic_words = brain._normalize(
+                    random_words(rng, 8), random_words(rng, 3), random_words(rng, 3))
+                expected = brain._match(words, that_words, topic_words, brain._root)
+                self.assertEqual(matcher.match(words, that_words, topic_words)[:2], expected,
+                                 (words, that_words, topic_words))
+
+    def test_match_engine(self):
+        brain = pattern_mgr.PatternMgr()
+        brain.add("HELLO *", "*", "*", "hello")
+        brain.set_match_engine("automaton")
+        self.assertEqual(brain.match("hello there", "", ""), "hello")
+        self.assertEqual(brain.star("star", "hello out there", "", "", 1), "out there")
+        # changes are picked up
+        brain.add("HELLO THERE", "*", "*", "hello-there")
+        self.assertEqual(brain.match("hello there", "", ""), "hello-there")
+        # which takes linear time
+        brain.add("* * * * * * NEVER", "*", "*", "never")
+        self.assertIsNone(brain.match("X " * 500, "", ""))
+        self.assertRaises(ValueError, brain.set_match_engine, "regex")
@@ -0,0 +1,45 @@
+import unittest
+
+from aiml import brain_report
+from aiml import pattern_mgr
+
+
+def text(string):
+    return ["text", {"xml:space": "preserve"}, string]
+
+
+class BrainReportTests(unittest.TestCase):
+
+    def setUp(self):
+        self.brain = pattern_mgr.PatternMgr()
+        self.brain.add("HELLO", "*", "*", ["template", {}, text("Hi")], "a.aiml")
+        self.brain.add("HELLO *", "*", "*", ["template", {}, text("Hi")], "b.aiml")
+        self.brain.add("GOOD BYE", "*", "*",
+                       ["template", {"#id": 1}, ["random", {}, ["li", {}, text("Bye")],
+                                                 ["li", {}, text("Ciao")]]], "b.aiml")
+
+    def test_analyze(self):
+        report = brain_report.analyze(self.brain, top=2)
+        self.assertEqual(report["categories"], 3)
+        # root, HELLO, HELLO *, GOOD BYE (compressed), and <that> * <topic> * below each
+        self.assertEqual(report["nodes"], 16)
+        self.assertEqual(sum(row["nodes"] for row in report["by_depth"]), 16)
+        self.assertEqual(report["by_depth"][1]["nodes"], 2)
+        by_source = {row["source"]: row for row in report["by_source"]}
+        self.assertEqual(by_source["b.aiml"]["categories"], 2)
+        # the root and HELLO lead to categories of both files
+        self.assertEqual(by_source[None]["nodes"], 2)
+        self.assertEqual(by_source["a.aiml"]["nodes"], 4)
+        self.assertEqual(report["fanout"], {0: 3, 1: 11, 2: 2})
+        # the <that> * <topic> chains, and HELLO's
+        self.assertEqual(report["chain_lengths"], {2: 1, 4: 2})
+        self.assertEqual(report["wildcards"], {"*": 7})
+        self.assertEqual(report["wildcard_density"], 7 / 15)
+        self.assertEqual(report["biggest_templates"][0]["category"], ("GOOD BYE", "*", "*"))
+        self.assertEqual(report["biggest_templates"][0]["elements"], 6)
+        self.assertEqual(len(report["biggest_templates"]), 2)
+        # the two "Hi" templates are separate copies
+        self.assertEqual(report["duplicates"], 1)
+        self.assertEqual(report["duplicate_groups"][0]["copies"], 2)
+        self.assertGreater(report["duplicate_bytes"], 0)
+        self.assertIn("3 categories, 16 nodes", brain_report.format_report(report))
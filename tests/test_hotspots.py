@@ -0,0 +1,53 @@
+import unittest
+
+from aiml import Kernel
+from aiml import hotspots
+from tests.support import TempDirMixin
+
+
+class HotspotTests(TempDirMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(HotspotTests, self).setUp()
+        self.filename = self.write_aiml("hotspots.aiml",
+                                        ("HELLO", "hi"), ("HI", "<srai>HELLO</srai>"),
+                                        ("* * NEVER", "never"), ("_ A", "a"),
+                                        ("X * Y * Z *", "xyz"))
+        self.kernel = Kernel()
+        self.kernel.learn(self.filename)
+
+    def test_find_risky_patterns(self):
+        risky = hotspots.find_risky_patterns(self.kernel._brain, max_fanout=3)
+        self.assertEqual(risky, {
+            ("* * NEVER", "*", "*"): ["adjacent wildcards in the pattern"],
+            ("_ A", "*", "*"): ['"_" at a node with 5 children, first'],
+            ("X * Y * Z *", "*", "*"): ["3 wildcards in the pattern"],
+        })
+
+    def test_replay(self):
+        self.kernel.set_match_cache(10)
+        profiler = hotspots.HotspotProfiler(self.kernel)
+        self.assertEqual(profiler.replay(["hi", "hello", "a b c d e f g h", "b a"]),
+                         ["hi", "hi", "", "a"])
+        report = profiler.report(max_fanout=3)
+        self.assertEqual(report["inputs"], 4)
+        self.assertEqual(report["matches"], 5)
+        self.assertEqual(report["srai_hops"], 1)
+        categories = {row["category"]: row for row in report["categories"]}
+        self.assertEqual(categories["HELLO", "*", "*"]["matches"], 2)
+        self.assertEqual(categories["HI", "*", "*"]["srai_hops"], 1)
+        self.assertEqual(categories[None]["matches"], 1)
+        # every node visited for the input that matched nothing was a dead end
+        self.assertGreater(categories[None]["nodes"], 0)
+        self.assertEqual(categories[None]["backtracks"], categories[None]["nodes"])
+        self.assertEqual(categories["HELLO", "*", "*"]["backtracks"], 0)
+        self.assertEqual([row["nodes"] for row in report["categories"]],
+                         sorted((row["nodes"] for row in report["categories"]), reverse=True))
+        self.assertEqual(categories["_ A", "*", "*"]["issues"],
+                         ['"_" at a node with 5 children, first'])
+        self.assertEqual(report["files"][0]["source"], self.filename)
+        self.assertEqual(report["files"][0]["risky"], 3)
+        # the settings bypassed while replaying are back
+        self.assertIsNotNone(self.kernel._brain.match_cache_stats())
+        self.assertNotIn("match", vars(self.kernel._brain))
+        self.assertIn("4 inputs, 5 matches", hotspots.format_report(report))
@@ -0,0 +1,73 @@
+import os
+import unittest
+
+from aiml import Kernel
+from aiml import journal
+from aiml import pattern_mgr
+from tests.support import TempDirMixin
+
+
+class JournalTests(TempDirMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(JournalTests, self).setUp()
+        self.brain_path = self.temp_path("brain.brn")
+        self.journal_path = journal.journal_path(self.brain_path)
+
+    def test_replay(self):
+        log = journal.Journal(self.journal_path)
+        log.add("HELLO", "*", "*", "hello", "a.aiml")
+        log.add("BYE", "*", "*", "bye", "b.aiml")
+        log.remove_source("a.aiml")
+        log.close()
+        brain = pattern_mgr.PatternMgr()
+        self.assertEqual(journal.replay(self.journal_path, brain), 3)
+        self.assertEqual(brain.num_templates(), 1)
+        self.assertEqual(brain.match("bye", "", ""), "bye")
+
+    def test_incomplete_record_is_discarded(self):
+        log = journal.Journal(self.journal_path)
+        log.add("HELLO", "*", "*", "hello", "a.aiml")
+        log.close()
+        with open(self.journal_path, "ab") as out:
+            out.write(b"\xa9\x05")
+        self.assertEqual(journal.replay(self.journal_path, pattern_mgr.PatternMgr()), 1)
+        # appending after reopening works
+        log = journal.Journal(self.journal_path)
+        log.add("BYE", "*", "*", "bye", "b.aiml")
+        log.close()
+        self.assertEqual(journal.replay(self.journal_path, pattern_mgr.PatternMgr()), 2)
+
+    def test_kernel_round_trip(self):
+        a_path = self.write_aiml("a.aiml", ("A", "a"))
+        kernel = Kernel()
+        kernel.learn(a_path)
+        kernel.save_brain(self.brain_path)
+        kernel.set_brain_journal(self.brain_path)
+        kernel.learn(self.write_aiml("b.aiml", ("B", "b")))
+        kernel.unlearn(a_path)
+        kernel.set_brain_journal(None)
+
+        kernel = Kernel()
+        kernel.load_brain(self.brain_path)
+        self.assertEqual(kernel.respond("a"), "")
+        self.assertEqual(kernel.respond("b"), "b")
+        self.assertEqual(kernel.num_categories(), 1)
+
+    def test_compaction(self):
+        kernel = Kernel()
+        kernel.learn(self.write_aiml("a.aiml", ("A", "a")))
+        kernel.save_brain(self.brain_path)
+        kernel.set_brain_journal(self.brain_path)
+        kernel.learn(self.write_aiml("b.aiml", ("B", "b")))
+        kernel.compact_brain().join()
+        self.assertEqual(journal.replay(self.journal_path, pattern_mgr.PatternMgr()), 0)
+        self.assertFalse(os.path.exists(journal.rotated_path(self.brain_path)))
+        kernel.learn(self.write_aiml("c.aiml", ("C", "c")))
+        kernel.set_brain_journal(None)
+
+        kernel = Kernel()
+        kernel.load_brain(self.brain_path)
+        self.assertEqual(kernel.num_categories(), 3)
+        self.assertEqual(kernel.respond("b"), "b")
+        self.assertEqual(kernel.respond("c"), "c")
@@ -1,8 +1,14 @@
+import gc
 import unittest
 import os
+import subprocess
+import sys
+import threading
 import time
+from unittest import mock
 
-from aiml import Kernel
+from aiml import Kernel, pattern_mgr, srai_aliases
+from tests.support import TempDirMixin, write_aiml
 
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -95,3 +101,527 @@ class KernelTests(unittest.TestCase):
         self._test_tag('uppercase', 'test uppercase', ["The Last Word Should Be UPPERCASE"])
         self._test_tag('version', 'test version', ["PyAIML is version %s" % self.kernel.version()])
         self._test_tag('whitespace preservation', 'test whitespace', ["Extra   Spaces\n   Rule!   (but not in here!)    But   Here   They   Do!"])
+
+
+class ImportTests(unittest.TestCase):
+
+    def test_heavy_modules_are_imported_lazily(self):
+        script = ("import sys, aiml; aiml.Kernel(); "
+                  "print(' '.join(m for m in ('numpy', 'xml.sax', 'configparser') "
+                  "if m in sys.modules))")
+        output = subprocess.check_output([sys.executable, "-c", script],
+                                         cwd=os.path.dirname(BASE_DIR), universal_newlines=True)
+        self.assertEqual(output.strip(), "")
+
+
+class LearnTests(TempDirMixin, unittest.TestCase):
+
+    def test_streaming_learn(self):
+        path = os.path.join(BASE_DIR, "self-test.aiml")
+        kernel = Kernel()
+        kernel.learn(path)
+        streaming_kernel = Kernel()
+        streaming_kernel.set_streaming_learn(True)
+        streaming_kernel.learn(path)
+        self.assertEqual(streaming_kernel.num_categories(), kernel.num_categories())
+        self.assertEqual(streaming_kernel.respond("test srai"), "srai test passed")
+
+    def test_streaming_learn_malformed_file(self):
+        path = self.temp_path("malformed.aiml")
+        with open(path, "w") as out:
+            out.write("<aiml version='1.0.1'><category><pattern>A</pattern><template>a</template>"
+                      "</category><category></aiml>")
+        kernel = Kernel()
+        kernel.learn(path)
+        self.assertEqual(kernel.num_categories(), 0)
+        kernel.set_streaming_learn(True)
+        kernel.learn(path)
+        self.assertEqual(kernel.num_categories(), 1)
+
+    def test_streaming_learn_in_batches(self):
+        path = self.write_aiml("abc.aiml", ("A", "a"), ("B", "b"), ("C", "c"), ("D", "d"), ("E", "e"))
+        kernel = Kernel()
+        kernel.set_streaming_learn(True)
+        parse_file = kernel._parse_file
+        responses = []
+
+        def parse_and_respond(file_path, callback):
+            def parsed(key, tem):
+                if key[0] == "E":
+                    # the earlier batches are in the brain, and responses aren't held up
+                    thread = threading.Thread(
+                        target=lambda: responses.append(kernel.respond("c")))
+                    thread.start()
+                    thread.join(10)
+                callback(key, tem)
+            return parse_file(file_path, parsed)
+
+        kernel._parse_file = parse_and_respond
+        with mock.patch.object(Kernel, "_STREAMING_BATCH_SIZE", 2):
+            kernel.learn(path)
+        self.assertEqual(responses, ["c"])
+        self.assertEqual(kernel.num_categories(), 5)
+
+    def test_thats_of_the_same_length(self):
+        path = self.write_aiml("that.aiml",
+                               ("CHEESE", "Do you like cheese?"),
+                               ("HAPPY", "Are you happy today?"),
+                               ("YES", "DO YOU LIKE CHEESE", "Me too."),
+                               ("YES", "ARE YOU HAPPY TODAY", "Glad to hear it."))
+        kernel = Kernel()
+        kernel.learn(path)
+        for question, answer in (("cheese", "Me too."), ("happy", "Glad to hear it.")):
+            kernel.respond(question)
+            self.assertEqual(kernel.respond("yes"), answer)
+
+    def test_reload(self):
+        path = self.write_aiml("reload.aiml", ("A", "a"), ("B", "b"))
+        kernel = Kernel()
+        kernel.learn(os.path.join(BASE_DIR, "self-test.aiml"))
+        kernel.learn(path)
+        num_categories = kernel.num_categories()
+        write_aiml(path, ("A", "new a"))
+        kernel.reload(path)
+        self.assertEqual(kernel.num_categories(), num_categories - 1)
+        self.assertEqual(kernel.respond("a"), "new a")
+        self.assertEqual(kernel.respond("b"), "")
+        self.assertEqual(kernel.unlearn(path), 1)
+        self.assertEqual(kernel.respond("a"), "")
+        self.assertEqual(kernel.respond("test srai"), "srai test passed")
+
+    def test_rebuild(self):
+        path = self.write_aiml("rebuild.aiml", ("A", "a"), ("B", "b"))
+        kernel = Kernel()
+        kernel.learn(path)
+        old_brain = kernel._brain
+        write_aiml(path, ("A", "new a"))
+        kernel.rebuild(path).join()
+        self.assertIsNot(kernel._brain, old_brain)
+        self.assertEqual(kernel.respond("a"), "new a")
+        self.assertEqual(kernel.respond("b"), "")
+        # the old version is left alone
+        self.assertEqual(old_brain.num_templates(), 2)
+
+    def test_templates_are_shared(self):
+        path = self.write_aiml("shared.aiml",
+                               ("A", "<srai>HELLO   THERE</srai>"), ("B", "<srai>HELLO   THERE</srai>"),
+                               ("HELLO THERE", "Hi   <star/>"), ("HELLO *", "Hi   <star/>"))
+        kernel = Kernel()
+        kernel.learn(path)
+        self.assertIsNone(kernel.template_pool_stats())
+        kernel = Kernel()
+        kernel.set_template_sharing(True)
+        kernel.learn(path)
+        templates = dict(kernel._brain.categories())
+        self.assertIs(templates["A", "*", "*"], templates["B", "*", "*"])
+        self.assertIs(templates["HELLO THERE", "*", "*"], templates["HELLO *", "*", "*"])
+        self.assertEqual(kernel.template_pool_stats()["shared"], 6)
+        before = repr(templates["A", "*", "*"])
+        self.assertEqual(kernel.respond("a"), "Hi")
+        self.assertEqual(kernel.respond("hello  world"), "Hi world")
+        # responding leaves the templates unchanged
+        self.assertEqual(repr(templates["A", "*", "*"]), before)
+        kernel.set_template_sharing(False)
+        self.assertIsNone(kernel.template_pool_stats())
+
+    def test_gc_freeze(self):
+        path = self.write_aiml("a.aiml", ("A", "a"))
+        kernel = Kernel()
+        self.addCleanup(gc.unfreeze)
+        kernel.set_gc_freeze(True)
+        self.assertGreater(gc.get_freeze_count(), 0)
+        gc.unfreeze()
+        kernel.bootstrap(learn_file_paths=path)
+        # the brain is out of the collector's sight
+        self.assertGreater(gc.get_freeze_count(), 0)
+        self.assertFalse(any(o is kernel._brain._root for o in gc.get_objects()))
+        self.assertEqual(kernel.respond("a"), "a")
+        kernel.set_gc_freeze(False)
+        self.assertEqual(gc.get_freeze_count(), 0)
+
+    def test_hit_counting(self):
+        path = self.write_aiml("hits.aiml", ("A", "a"), ("B", "<srai>A</srai>"), ("C", "a"))
+        kernel = Kernel()
+        kernel.learn(path)
+        self.assertIsNone(kernel.category_hits())
+        kernel.set_hit_counting(True)
+        kernel.respond("a")
+        kernel.respond("b")
+        self.assertEqual(kernel.category_hits(reset=True),
+                         {("A", "*", "*"): 2, ("B", "*", "*"): 1, ("C", "*", "*"): 0})
+        # categories learned later are counted, and collapsed redirects count for their target
+        write_aiml(path, ("A", "a"), ("B", "<srai>A</srai>"), ("D", "d"))
+        kernel.learn(path)
+        kernel.set_srai_collapsing(True)
+        kernel.respond("b")
+        kernel.respond("d")
+        self.assertEqual(kernel.category_hits(),
+                         {("A", "*", "*"): 1, ("B", "*", "*"): 1, ("C", "*", "*"): 0,
+                          ("D", "*", "*"): 1})
+        kernel.set_hit_counting(False)
+        self.assertIsNone(kernel.category_hits())
+
+    def test_hit_counts_stay_bounded(self):
+        stable_path = self.write_aiml("stable.aiml", ("A", "a"), ("B", "b"))
+        changing_path = self.write_aiml("changing.aiml", ("C", "c"))
+        kernel = Kernel()
+        kernel.set_hit_counting(True)
+        kernel.learn(stable_path)
+        kernel.learn(changing_path)
+        kernel.respond("a")
+        for _ in range(10):
+            kernel.reload(changing_path)
+            kernel.rebuild([changing_path], background=False)
+        # the ids of replaced categories don't pile up, and the hits are kept
+        self.assertLessEqual(len(kernel._hit_counts), 2 * kernel.num_categories())
+        self.assertEqual(kernel.category_hits(),
+                         {("A", "*", "*"): 1, ("B", "*", "*"): 0, ("C", "*", "*"): 0})
+        kernel.respond("b")
+        self.assertEqual(kernel.category_hits()[("B", "*", "*")], 1)
+
+    def test_offload_templates(self):
+        path = self.write_aiml("offload.aiml", ("A", "a"), ("B", "<srai>A</srai>"),
+                               ("C", "c <star/>"), ("C *", "c <star/>"))
+        store_path = self.temp_path("templates.store")
+        brain_path = self.temp_path("offload.brn")
+        kernel = Kernel()
+        kernel.learn(path)
+        self.assertRaises(RuntimeError, kernel.offload_templates, store_path)
+        kernel.set_hit_counting(True)
+        kernel.respond("a")
+        self.assertEqual(kernel.offload_templates(store_path, cache_size=1), 3)
+        self.addCleanup(kernel.close)
+        self.assertEqual(kernel.offload_stats()["templates"], 3)
+        templates = dict(kernel._brain.categories())
+        self.assertEqual(templates["C", "*", "*"][2:], [])
+        self.assertEqual(templates["A", "*", "*"][2][2], "a")
+        # offloaded templates are read back when needed
+        self.assertEqual(kernel.respond("b"), "a")
+        self.assertEqual(kernel.respond("c d"), "c d")
+        self.assertEqual(kernel.respond("c"), "c")
+        self.assertEqual(kernel.offload_stats()["reads"], 3)
+        self.assertEqual(kernel.category_hits()["C *", "*", "*"], 1)
+        # saved brains contain the offloaded templates
+        kernel.save_brain(brain_path)
+        self.addCleanup(os.remove, brain_path)
+        loaded_kernel = Kernel()
+        loaded_kernel.load_brain(brain_path)
+        self.assertEqual(loaded_kernel.respond("c d"), "c d")
+        # offloading to another file moves the templates there
+        other_path = self.temp_path("templates.other")
+        self.assertEqual(kernel.offload_templates(other_path), 0)
+        self.assertFalse(os.path.exists(store_path))
+        self.assertEqual(kernel.offload_stats()["templates"], 3)
+        self.assertEqual(kernel.respond("c d"), "c d")
+        # the file is the Kernel's own
+        loaded_kernel.set_hit_counting(True)
+        self.assertRaises(FileExistsError, loaded_kernel.offload_templates, path)
+        kernel.close()
+        self.assertFalse(os.path.exists(other_path))
+
+    def test_template_profiling(self):
+        path = self.write_aiml("profile.aiml",
+                               ("A", "<person>I am <srai>B</srai></person>"), ("B", "here"))
+        kernel = Kernel()
+        kernel.learn(path)
+        plain_processors = kernel._element_processors
+        response = kernel.respond("a")
+        self.assertIsNone(kernel.profile_stats())
+        kernel.set_template_profiling(True)
+        self.assertEqual(kernel.respond("a"), response)
+        stats = kernel.profile_stats(reset=True)
+        self.assertEqual(stats["template"]["calls"], 2)
+        self.assertEqual(stats["srai"]["calls"], 1)
+        self.assertEqual(stats["wordsub person"]["calls"], 1)
+        # template > person > srai > template > text
+        self.assertEqual(stats["text"]["max_depth"], 5)
+        self.assertEqual(kernel.profile_stats(), {})
+        kernel.set_template_profiling(False)
+        self.assertIs(kernel._element_processors, plain_processors)
+        self.assertNotIn("sub", vars(kernel._subbers["person"]))
+        self.assertEqual(kernel.respond("a"), response)
+
+    def test_learn_during_response(self):
+        a_path = self.write_aiml("a.aiml", ("A", "a <think>wait</think>"))
+        b_path = self.write_aiml("b.aiml", ("B", "b"))
+        c_path = self.write_aiml("c.aiml", ("C", "c"))
+        kernel = Kernel()
+        kernel.learn(a_path)
+        started = threading.Event()
+        release = threading.Event()
+        process_think = kernel._element_processors["think"]
+
+        def wait_then_process_think(elem, session_id):
+            started.set()
+            release.wait(10)
+            return process_think(elem, session_id)
+
+        kernel._element_processors["think"] = wait_then_process_think
+        responses = []
+        thread = threading.Thread(target=lambda: responses.append(kernel.respond("a")))
+        thread.start()
+        self.assertTrue(started.wait(10))
+        # the response in progress neither holds up learn() nor sees the brain change
+        old_brain = kernel._brain
+        kernel.learn(b_path)
+        self.assertIsNot(kernel._brain, old_brain)
+        self.assertEqual(old_brain.num_templates(), 1)
+        self.assertEqual(kernel.num_categories(), 2)
+        self.assertEqual(kernel.unlearn(b_path), 1)
+        self.assertEqual(kernel.num_categories(), 1)
+        # all files of a call go into one copy
+        with mock.patch.object(pattern_mgr.PatternMgr, "copy", autospec=True,
+                               side_effect=pattern_mgr.PatternMgr.copy) as copy:
+            kernel.bootstrap(learn_file_paths=[b_path, c_path])
+            kernel.learn(self.temp_path("[bc].aiml"))
+        self.assertEqual(copy.call_count, 2)
+        self.assertEqual(kernel.num_categories(), 3)
+        release.set()
+        thread.join()
+        self.assertEqual(responses, ["a"])
+        # with no response in progress, the brain is changed in place
+        brain = kernel._brain
+        kernel.unlearn(b_path)
+        kernel.learn(b_path)
+        self.assertIs(kernel._brain, brain)
+        self.assertEqual(kernel.respond("b"), "b")
+
+    def test_respond_sticks_to_brain(self):
+        kernel = Kernel()
+        kernel.learn(os.path.join(BASE_DIR, "self-test.aiml"))
+        brains = []
+        process_star = kernel._element_processors["star"]
+
+        def rebuild_then_process_star(elem, session_id):
+            # publish a new version in the middle of the response
+            brains.append(kernel._brain)
+            kernel.rebuild([], background=False)
+            brains.append(kernel._brain)
+            brains.append(kernel._active_brain())
+            return process_star(elem, session_id)
+
+        kernel._element_processors["star"] = rebuild_then_process_star
+        self.assertEqual(kernel.respond("You should test star begin"),
+                         "Begin star matched: You should")
+        old_brain, new_brain, active_brain = brains
+        self.assertIsNot(new_brain, old_brain)
+        self.assertIs(active_brain, old_brain)
+        self.assertIs(kernel._active_brain(), new_brain)
+
+    def test_watcher(self):
+        a_path = self.write_aiml("a.aiml", ("A", "a"))
+        kernel = Kernel()
+        kernel.learn(a_path)
+        watcher = kernel.watch([self.temp_path("*.aiml")], interval=3600)
+        self.addCleanup(watcher.stop)
+        self.assertEqual(watcher.poll(), [])
+        b_path = self.write_aiml("b.aiml", ("B", "b"))
+        self.assertEqual(watcher.poll(), [b_path])
+        self.assertEqual(kernel.respond("b"), "b")
+        os.remove(a_path)
+        self.assertEqual(watcher.poll(), [a_path])
+        self.assertEqual(kernel.respond("a"), "")
+        self.assertEqual(kernel.learned_files(), [b_path])
+
+
+class SraiTests(TempDirMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(SraiTests, self).setUp()
+        self.path = self.temp_path("srai.aiml")
+        write_aiml(self.path,
+                   ("HI", "<srai>HELLO</srai>"),
+                   ("HEY", "<srai>HELLO</srai>"),
+                   ("HELLO", "Hello <sr/>"),
+                   ("COUNT", "<srai>INCREMENT</srai>"),
+                   ("INCREMENT", "<think><set name='count'><get name='count'/>1</set></think>"
+                                 "<get name='count'/>"))
+        self.kernel = Kernel()
+        self.kernel.learn(self.path)
+        self.kernel.set_srai_memo(10)
+
+    def test_pure_results_are_memoized(self):
+        # in a new session, so that 'that' is the same
+        self.assertEqual(self.kernel.respond("hi", "alice"), "Hello")
+        self.assertEqual(self.kernel.respond("hey", "bob"), "Hello")
+        self.assertEqual(self.kernel.srai_memo_stats()["hits"], 1)
+
+    def test_memo_keeps_limits_and_hits(self):
+        greet_path = self.write_aiml("greet.aiml", ("GREET", "<srai>HI</srai>"))
+        results = []
+        for memo_size in (0, 10):
+            kernel = Kernel()
+            kernel.learn(self.path)
+            kernel.learn(greet_path)
+            kernel.set_srai_memo(memo_size)
+            kernel.set_hit_counting(True)
+            responses = []
+            with self.assertLogs("aiml.kernel", "WARNING"):
+                for budget in (None, 1, 2, None):
+                    kernel.set_srai_budget(budget)
+                    responses += [kernel.respond("greet", "alice"), kernel.respond("hi", "bob")]
+            results.append((responses, kernel.srai_limit_stats(), kernel.category_hits()))
+        # memoized results count their reductions and hits like the ones made again
+        self.assertEqual(results[1], results[0])
+
+    def test_impure_results_are_not_memoized(self):
+        self.assertEqual(self.kernel.respond("count"), "1")
+        self.assertEqual(self.kernel.respond("count"), "11")
+        self.assertEqual(self.kernel.srai_memo_stats()["hits"], 0)
+
+    def test_memo_is_invalidated_by_changes(self):
+        self.assertEqual(self.kernel.respond("hi"), "Hello")
+        write_aiml(self.path, ("HI", "<srai>HELLO</srai>"), ("HELLO", "Hi there"))
+        self.kernel.reload(self.path)
+        self.assertEqual(self.kernel.respond("hi"), "Hi there")
+
+    def test_collapsing(self):
+        write_aiml(self.path,
+                   ("TURING", "<srai>WHO IS TURING</srai>"),
+                   ("WHO IS TURING", "<srai>WHO IS ALAN TURING</srai>"),
+                   ("WHO IS ALAN TURING", "A mathematician."),
+                   ("_ IS ALAN TURING", "QUIZ", "You tell me, <star/>."),
+                   ("QUIZ", "Quiz"))
+        self.kernel.reload(self.path)
+        expected = ["A mathematician.", "Quiz", "You tell me, WHO."]
+        self.assertEqual([self.kernel.respond(i) for i in ("turing", "quiz", "turing")], expected)
+        kernel = Kernel()
+        kernel.set_srai_collapsing(True)
+        kernel.learn(self.path)
+        self.assertEqual([kernel.respond(i) for i in ("turing", "quiz", "turing")], expected)
+        aliases = kernel._get_srai_aliases(kernel._brain)
+        self.assertEqual(sorted(alias[0] for alias in aliases.values()),
+                         ["WHO IS ALAN TURING", "WHO IS ALAN TURING"])
+
+    def test_collapsing_keeps_limits_and_hits(self):
+        write_aiml(self.path,
+                   ("TURING", "<srai>WHO IS TURING</srai>"),
+                   ("WHO IS TURING", "<srai>WHO IS ALAN TURING</srai>"),
+                   ("WHO IS ALAN TURING", "A mathematician, <srai>TURING</srai>"))
+        results = []
+        for collapse in (False, True):
+            kernel = Kernel()
+            kernel.set_srai_collapsing(collapse)
+            kernel.set_hit_counting(True)
+            kernel.learn(self.path)
+            responses = []
+            with self.assertLogs("aiml.kernel", "WARNING"):
+                for budget in (None, 1, 2, 3, 5):
+                    kernel.set_srai_budget(budget)
+                    responses.append(kernel.respond("turing"))
+            results.append((responses, kernel.srai_limit_stats(), kernel.category_hits()))
+        # the redirects skipped count as reductions and hits, and the cycle is caught alike
+        self.assertEqual(results[1], results[0])
+
+    def test_collapsing_is_kept_up_to_date(self):
+        write_aiml(self.path,
+                   ("TURING", "<srai>WHO IS TURING</srai>"),
+                   ("WHO IS TURING", "<srai>WHO IS ALAN TURING</srai>"),
+                   ("WHO IS ALAN TURING", "A mathematician."))
+        other_path = self.write_aiml("other.aiml",
+                                     ("WHO IS ALAN TURING", "A computer scientist."),
+                                     ("_ ALAN TURING", "QUIZ", "You tell me."))
+        kernel = Kernel()
+        kernel.set_srai_collapsing(True)
+        kernel.learn(self.path)
+        # changes to the brain update the redirects they affect, not all of them
+        with mock.patch.object(srai_aliases.SraiAliases, "build") as build:
+            kernel.learn(other_path)
+            kernel.set_bot_predicate("age", "1")
+            self.assertEqual(kernel.respond("turing"), "A computer scientist.")
+            aliases = kernel._get_srai_aliases(kernel._brain)
+            self.assertEqual(len(aliases), 2)
+            # the "_" pattern has to be ruled out first
+            self.assertTrue(all(alias[2] for alias in aliases.values()))
+            kernel.unlearn(other_path)
+            kernel.learn(self.path)
+            self.assertEqual(kernel.respond("turing"), "A mathematician.")
+        build.assert_not_called()
+        aliases = kernel._get_srai_aliases(kernel._brain)
+        self.assertEqual(sorted(alias[0] for alias in aliases.values()),
+                         ["WHO IS ALAN TURING", "WHO IS ALAN TURING"])
+        self.assertFalse(any(alias[2] for alias in aliases.values()))
+
+    def test_collapsing_cycle(self):
+        write_aiml(self.path, ("PING", "<srai>PONG</srai>"), ("PONG", "<srai>PING</srai>"))
+        kernel = Kernel()
+        kernel.set_srai_collapsing(True)
+        # the redirects are collapsed when they're learned
+        with self.assertLogs("aiml.srai_aliases", "WARNING") as logs:
+            kernel.learn(self.path)
+        self.assertIn("Not collapsing <srai> cycle", logs.output[0])
+        with self.assertLogs("aiml.kernel", "WARNING"):
+            self.assertEqual(kernel.respond("ping"), "")
+
+    def test_cycle_detection(self):
+        write_aiml(self.path,
+                   ("PING", "ping <srai>PONG</srai>"),
+                   ("PONG", "<srai>PING</srai>"),
+                   ("COUNTDOWN", "<think><set name='n'><get name='n'/>I</set></think>"
+                                 "<condition name='n'><li value='III'>done</li>"
+                                 "<li><srai>COUNTDOWN</srai></li></condition>"))
+        kernel = Kernel()
+        kernel.learn(self.path)
+        with self.assertLogs("aiml.kernel", "WARNING"):
+            self.assertEqual(kernel.respond("ping"), "ping")
+        self.assertEqual(kernel.srai_limit_stats(), {"max_depth": 0, "cycle": 1, "budget": 0})
+        # repeating an input is fine if something has changed in between
+        self.assertEqual(kernel.respond("countdown"), "done")
+        self.assertEqual(kernel.srai_limit_stats()["cycle"], 1)
+
+    def test_srai_budget(self):
+        write_aiml(self.path,
+                   ("TURING", "<srai>WHO IS TURING</srai>"),
+                   ("WHO IS TURING", "<srai>WHO IS ALAN TURING</srai>"),
+                   ("WHO IS ALAN TURING", "A mathematician."))
+        kernel = Kernel()
+        kernel.learn(self.path)
+        kernel.set_srai_budget(1)
+        with self.assertLogs("aiml.kernel", "WARNING"):
+            self.assertEqual(kernel.respond("turing"), "")
+        self.assertEqual(kernel.srai_limit_stats()["budget"], 1)
+        kernel.set_srai_budget(2)
+        self.assertEqual(kernel.respond("turing"), "A mathematician.")
+
+    def test_deadline(self):
+        write_aiml(self.path,
+                   ("* * * * * * NEVER", "never"),
+                   ("SLOW", "<srai>" + "X " * 60 + "</srai>"),
+                   ("FAST", "fast"))
+        kernel = Kernel()
+        kernel.learn(self.path)
+        kernel.set_response_deadline(0.05, "Sorry, that took too long.")
+        start = time.monotonic()
+        with self.assertLogs("aiml.kernel", "WARNING"):
+            self.assertEqual(kernel.respond("slow. fast"), "Sorry, that took too long.")
+        self.assertLess(time.monotonic() - start, 1.0)
+        stats = kernel.timeout_stats()
+        self.assertEqual(stats["count"], 1)
+        timeout = stats["recent"][0]
+        self.assertEqual(timeout["input"], "slow")
+        self.assertEqual(timeout["stack"], ["slow", "X " * 60])
+        self.assertTrue(timeout["path"].startswith("* * *"), timeout["path"])
+        # the session is left in a usable state, and respond()'s deadline takes precedence
+        self.assertEqual(kernel.get_predicate(kernel._INPUT_STACK), [])
+        self.assertEqual(kernel.respond("fast", deadline=1.0), "fast")
+        with self.assertLogs("aiml.kernel", "WARNING"):
+            self.assertEqual(kernel.respond("fast", deadline=-1), "Sorry, that took too long.")
+        self.assertEqual(kernel.timeout_stats()["recent"][-1]["path"], "FAST <that> *")
+
+    def test_deadline_in_condition(self):
+        slow = "<srai>" + "X " * 60 + "</srai>"
+        write_aiml(self.path,
+                   ("* * * * * * NEVER", "never"),
+                   ("SLOW", "<think><set name='x'>a</set></think>"
+                            "<condition name='x'><li value='a'>%s</li></condition>" % slow),
+                   ("SLOWER", "<condition name='x'><li value='b'>b</li><li>%s</li></condition>"
+                              % slow))
+        kernel = Kernel()
+        kernel.learn(self.path)
+        kernel.set_response_deadline(0.05, "Sorry, that took too long.")
+        for input in ("slow", "slower"):
+            # a timeout isn't an error in the condition
+            with self.assertLogs("aiml.kernel", "WARNING") as logs:
+                self.assertEqual(kernel.respond(input), "Sorry, that took too long.")
+            self.assertEqual([record.levelname for record in logs.records], ["WARNING"])
+        self.assertEqual(kernel.timeout_stats()["count"], 2)
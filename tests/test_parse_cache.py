@@ -0,0 +1,76 @@
+import os
+import unittest
+from unittest import mock
+
+import aiml
+import aiml.parse_cache
+from tests.support import TempDirMixin
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+AIML_FILE = os.path.join(BASE_DIR, "self-test.aiml")
+
+
+class ParseCacheTests(TempDirMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(ParseCacheTests, self).setUp()
+        self.cache_dir = self.directory
+
+    def test_round_trip(self):
+        cache = aiml.parse_cache.ParseCache(self.cache_dir)
+        self.assertIsNone(cache.load(AIML_FILE))
+        categories = {("HELLO", "*", "*"): ["template", {}, ["text", {"xml:space": "default"}, "Hi"]]}
+        cache.store(AIML_FILE, categories)
+        self.assertEqual(cache.load(AIML_FILE), categories)
+        # a new cache object has to go to disk
+        cache = aiml.parse_cache.ParseCache(self.cache_dir)
+        self.assertEqual(cache.load(AIML_FILE), categories)
+        # loads return copies
+        self.assertIsNot(cache.load(AIML_FILE), cache.load(AIML_FILE))
+
+    def test_changed_file_is_a_miss(self):
+        path = self.temp_path("changing.aiml")
+        with open(path, "w") as f:
+            f.write("<aiml/>")
+        cache = aiml.parse_cache.ParseCache(self.cache_dir)
+        cache.load(path)
+        cache.store(path, {})
+        self.assertEqual(cache.load(path), {})
+        with open(path, "w") as f:
+            f.write("<aiml version='1.0'/>")
+        self.assertIsNone(cache.load(path))
+
+    def test_format_change_invalidates(self):
+        cache = aiml.parse_cache.ParseCache(self.cache_dir)
+        cache.store(AIML_FILE, {})
+        with mock.patch.object(aiml.parse_cache, "CACHE_FORMAT", aiml.parse_cache.CACHE_FORMAT + 1):
+            self.assertIsNone(aiml.parse_cache.ParseCache(self.cache_dir).load(AIML_FILE))
+
+    def test_kernel_skips_parse(self):
+        kernel = aiml.Kernel()
+        kernel.set_parse_cache(self.cache_dir)
+        kernel.learn(AIML_FILE)
+        num_categories = kernel.num_categories()
+
+        kernel = aiml.Kernel()
+        kernel.set_parse_cache(self.cache_dir)
+        with mock.patch("aiml.aiml_parser.create_parser") as create_parser:
+            kernel.learn(AIML_FILE)
+        create_parser.assert_not_called()
+        self.assertEqual(kernel.num_categories(), num_categories)
+        self.assertEqual(kernel.respond("test srai"), "srai test passed")
+
+    def test_stored_entry_is_memoized(self):
+        kernel = aiml.Kernel()
+        kernel.set_parse_cache(self.cache_dir)
+        kernel.learn(AIML_FILE)
+        num_categories = kernel.num_categories()
+        # learning the file again neither hashes it nor reads the entry back
+        cache = kernel._parse_cache
+        with mock.patch.object(cache, "_digest") as digest, \
+                mock.patch("aiml.aiml_parser.create_parser") as create_parser:
+            kernel.learn(AIML_FILE)
+        digest.assert_not_called()
+        create_parser.assert_not_called()
+        self.assertEqual(kernel.num_categories(), num_categories)
@@ -0,0 +1,236 @@
+import time
+import unittest
+
+from aiml import pattern_mgr
+from tests.support import TempDirMixin
+
+
+class PatternMgrTests(TempDirMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(PatternMgrTests, self).setUp()
+        self.brain = pattern_mgr.PatternMgr()
+        self.brain.add("HELLO", "*", "*", "hello-star", "a.aiml")
+        self.brain.add("HELLO", "HI", "*", "hello-hi", "a.aiml")
+        self.brain.add("HELLO THERE", "*", "*", "hello-there", "b.aiml")
+        self.brain.add("_ THERE", "*", "FRUIT", "underscore", "b.aiml")
+
+    def test_match(self):
+        self.assertEqual(self.brain.match("hello", "hi", ""), "hello-hi")
+        self.assertEqual(self.brain.match("hello", "bye", ""), "hello-star")
+        self.assertEqual(self.brain.match("hello there", "", ""), "hello-there")
+        self.assertEqual(self.brain.match("hello there", "", "fruit"), "underscore")
+
+    def test_remove(self):
+        self.assertTrue(self.brain.remove("HELLO", "HI", "*"))
+        self.assertFalse(self.brain.remove("HELLO", "HI", "*"))
+        self.assertEqual(self.brain.num_templates(), 3)
+        self.assertEqual(self.brain.match("hello", "hi", ""), "hello-star")
+        # the branch leading to the removed template is pruned
+        self.assertNotIn("HI", self.brain._root["HELLO"][self.brain._THAT])
+
+    def test_remove_prunes_empty_branches(self):
+        for pattern, that, topic in [("HELLO", "*", "*"), ("HELLO", "HI", "*"),
+                                     ("HELLO THERE", "*", "*"), ("_ THERE", "*", "FRUIT")]:
+            self.assertTrue(self.brain.remove(pattern, that, topic))
+        self.assertEqual(self.brain._root, {})
+        self.assertEqual(self.brain.num_templates(), 0)
+        self.assertEqual(self.brain.sources(), [])
+
+    def test_copy(self):
+        clone = self.brain.copy()
+        self.assertEqual(clone.remove_source("a.aiml"), 2)
+        clone.add("BYE", "*", "*", "bye", "c.aiml")
+        self.assertEqual(clone.num_templates(), 3)
+        self.assertEqual(clone.match("hello there", "", ""), "hello-there")
+        # the original is unaffected
+        self.assertEqual(self.brain.num_templates(), 4)
+        self.assertEqual(self.brain.match("hello", "hi", ""), "hello-hi")
+        self.assertIsNone(self.brain.match("bye", "", ""))
+        self.assertEqual(self.brain.sources(), ["a.aiml", "b.aiml"])
+
+    def test_match_cache(self):
+        self.brain.set_match_cache(2)
+        self.assertEqual(self.brain.match("hello", "hi", ""), "hello-hi")
+        self.assertEqual(self.brain.match("Hello!", "hi", ""), "hello-hi")
+        self.assertEqual(self.brain.match_cache_stats(),
+                         {"hits": 1, "misses": 1, "hit_rate": 0.5, "size": 1, "max_size": 2})
+        # star() is served from the cache as well
+        self.brain.add("HELLO *", "*", "*", "hello-star-star")
+        self.assertEqual(self.brain.star("star", "hello big world", "", "", 1), "big world")
+        self.assertEqual(self.brain.star("star", "hello big world", "", "", 1), "big world")
+        self.assertEqual(self.brain.match_cache_stats()["hits"], 2)
+        # changes invalidate the cache
+        self.brain.add("HELLO", "HI", "*", "hello-hi-2")
+        self.assertEqual(self.brain.match("hello", "hi", ""), "hello-hi-2")
+        self.brain.match("hello there", "", "")
+        self.brain.match("bye", "", "")
+        self.assertEqual(self.brain.match_cache_stats()["size"], 2)
+        self.brain.set_match_cache(0)
+        self.assertIsNone(self.brain.match_cache_stats())
+
+    def test_remove_source(self):
+        self.assertEqual(self.brain.remove_source("a.aiml"), 2)
+        self.assertEqual(self.brain.num_templates(), 2)
+        self.assertIsNone(self.brain.match("hello", "hi", ""))
+        self.assertEqual(self.brain.match("hello there", "", ""), "hello-there")
+        self.assertEqual(self.brain.sources(), ["b.aiml"])
+
+    def test_overriding_template_changes_source(self):
+        self.brain.add("HELLO", "*", "*", "hello-again", "b.aiml")
+        self.assertEqual(self.brain.remove_source("a.aiml"), 1)
+        self.assertEqual(self.brain.match("hello", "", ""), "hello-again")
+
+    def test_sources_survive_save(self):
+        filename = self.temp_path("brain.brn")
+        self.brain.save(filename)
+        brain = pattern_mgr.PatternMgr()
+        brain.restore(filename)
+        self.assertEqual(sorted(brain.sources()), ["a.aiml", "b.aiml"])
+        self.assertEqual(brain.remove_source("b.aiml"), 2)
+        self.assertEqual(brain.num_templates(), 2)
+
+    def test_match_deadline(self):
+        brain = pattern_mgr.PatternMgr()
+        brain.add("* * * * * * NEVER", "*", "*", "never")
+        with self.assertRaises(pattern_mgr.MatchTimeout) as cm:
+            brain.match("X " * 60, "", "", deadline=time.monotonic() + 0.05)
+        self.assertEqual(cm.exception.path[:3], ["*", "*", "*"])
+        self.assertEqual(brain.match("X " * 6 + "never", "", "", deadline=time.monotonic() + 60),
+                         "never")
+
+    def test_lengths(self):
+        brain = pattern_mgr.PatternMgr()
+        brain.add("HELLO * WORLD", "*", "*", "hello-world")
+        brain.add("HELLO _ THERE WORLD", "*", "*", "hello-there-world")
+        star = brain._root["HELLO"][brain._STAR]
+        self.assertEqual(star[brain._LENGTHS], (1, 1, True))
+        self.assertEqual(brain._root["HELLO"][brain._LENGTHS], (2, None, False))
+        self.assertEqual(brain._root[brain._LENGTHS], (3, None, True))
+        # the rest of the input must be the single word "WORLD"
+        self.assertEqual(list(brain._split_points(("A", "WORLD", "B", "WORLD"), star)), [3])
+        self.assertEqual(list(brain._split_points(("A", "WORLD", "B"), star)), [])
+        self.assertEqual(brain.match("hello big wide world", "", ""), "hello-world")
+        self.assertEqual(brain.match("hello big there world", "", ""), "hello-there-world")
+        self.assertIsNone(brain.match("hello world", "", ""))
+        brain.remove("HELLO _ THERE WORLD", "*", "*")
+        self.assertEqual(brain._root[brain._LENGTHS], (3, None, True))
+        brain.add("HI", "*", "*", "hi")
+        self.assertEqual(brain._root[brain._LENGTHS], (1, None, True))
+
+    def test_summaries_of_old_brains_are_computed(self):
+        def strip_summaries(node):
+            node.pop(self.brain._LENGTHS, None)
+            node.pop(self.brain._CONTEXTS, None)
+            for child in node.values():
+                if isinstance(child, dict):
+                    strip_summaries(child)
+        lengths = self.brain._root[self.brain._LENGTHS]
+        contexts = self.brain._root[self.brain._UNDERSCORE][self.brain._CONTEXTS]
+        strip_summaries(self.brain._root)
+        filename = self.temp_path("brain.brn")
+        self.brain.save(filename)
+        brain = pattern_mgr.PatternMgr()
+        brain.restore(filename)
+        self.assertEqual(brain._root[brain._LENGTHS], lengths)
+        self.assertEqual(brain._root[brain._UNDERSCORE][brain._CONTEXTS], contexts)
+        self.assertEqual(brain.match("hello there", "", "fruit"), "underscore")
+
+    def test_failure_memo(self):
+        self.brain.add("* A * A * B", "*", "*", "a-a-b")
+        self.brain.add("_ A _ A _ A * C", "HI", "*", "a-a-a-c")
+        inputs = [("hello there", "", "fruit"), ("x a y a z b", "", ""), ("hello", "hi", ""),
+                  ("a a a a a a a a c", "hi", ""), ("a a a a a a a a c", "", "")]
+        expected = [(self.brain.match(*input), self.brain.star("star", *input, index=2))
+                    for input in inputs]
+        self.brain.set_failure_memo(True)
+        self.assertEqual([(self.brain.match(*input), self.brain.star("star", *input, index=2))
+                          for input in inputs], expected)
+        # failures aren't explored again, which keeps this from taking ages
+        deadline = time.monotonic() + 10
+        self.assertIsNone(self.brain.match("A " * 200, "", "", deadline))
+
+    def test_exact_index(self):
+        self.assertEqual(self.brain.match("hello", "hi", ""), "hello-hi")
+        self.assertEqual(self.brain.match("hello", "bye", ""), "hello-star")
+        # "_ THERE" takes precedence with this topic, so the index can't answer
+        self.assertEqual(self.brain.match("hello there", "", "fruit"), "underscore")
+        self.assertEqual(self.brain.match("hello there", "", "veg"), "hello-there")
+        self.assertEqual(self.brain.exact_index_stats(),
+                         {"hits": 3, "misses": 1, "hit_rate": 0.75, "size": 2})
+        self.brain.add("HELLO *", "*", "*", "hello-star-star")
+        self.brain.remove("HELLO", "*", "*")
+        self.brain.remove("HELLO", "HI", "*")
+        self.assertEqual(self.brain.exact_index_stats()["size"], 1)
+        self.assertEqual(self.brain.match("hello", "hi", ""), None)
+        self.assertEqual(self.brain.copy().exact_index_stats()["size"], 1)
+
+    def test_contexts(self):
+        brain = pattern_mgr.PatternMgr()
+        brain.add("HELLO *", "HI", "*", "hello-hi")
+        brain.add("HELLO THERE", "YES _", "FRUIT", "hello-yes")
+        hello = brain._root["HELLO"]
+        self.assertEqual(hello[brain._CONTEXTS], ({"HI", "YES"}, None))
+        self.assertEqual(hello["THERE"][brain._CONTEXTS], ({"YES"}, {"FRUIT"}))
+        self.assertEqual(brain.match("hello there", "yes indeed", "fruit"), "hello-yes")
+        self.assertEqual(brain.match("hello there", "hi", "veg"), "hello-hi")
+        self.assertIsNone(brain.match("hello there", "yes indeed", "veg"))
+        brain.add("HELLO THERE", "*", "*", "hello-there")
+        self.assertNotIn(brain._CONTEXTS, hello)
+        brain.remove("HELLO THERE", "*", "*")
+        self.assertEqual(hello[brain._CONTEXTS], ({"HI", "YES"}, None))
+
+    def test_contexts_of_same_length_thats(self):
+        # the <that>s end up with the same summaries; only their first words differ
+        brain = pattern_mgr.PatternMgr()
+        brain.add("A *", "C B", "*", "c-b")
+        brain.add("A *", "D D", "*", "d-d")
+        brain.add("B *", "*", "E", "e")
+        brain.add("B *", "*", "F", "f")
+        self.assertEqual(brain.match("a x", "d d", ""), "d-d")
+        self.assertEqual(brain.match("a x", "c b", ""), "c-b")
+        self.assertEqual(brain.match("b x", "", "f"), "f")
+
+    def test_removal_leaves_the_tree_of_a_fresh_build(self):
+        categories = [(pattern, that, topic)
+                      for pattern in ("WHAT DOES THAT MEAN", "WHAT DOES *", "NOPE")
+                      for that in ("DO YOU LIKE CHEESE", "ARE YOU HAPPY TODAY", "YES I AM TOO")
+                      for topic in ("*", "FOOD", "DRINK")]
+        brain = pattern_mgr.PatternMgr()
+        for key in categories:
+            brain.add(*key, template=" ".join(key))
+        kept = [key for key in categories if key[1].startswith("YES") or key[2] == "FOOD"]
+        for key in categories:
+            if key not in kept:
+                brain.remove(*key)
+        fresh = pattern_mgr.PatternMgr()
+        for key in kept:
+            fresh.add(*key, template=" ".join(key))
+        self.assertEqual(brain._root, fresh._root)
+
+    def test_path_compression(self):
+        brain = pattern_mgr.PatternMgr()
+        brain.add("WHAT IS THE TIME", "*", "*", "time")
+        brain.add("WHAT IS THE DATE", "*", "*", "date")
+        brain.add("WHAT IS *", "*", "*", "what")
+        # the node after WHAT leads on to IS alone, so the two are merged
+        what = brain._root["WHAT"]
+        self.assertEqual(what[brain._RUN], ("IS",))
+        self.assertNotIn(brain._RUN, what["THE"])
+        self.assertEqual(brain.match("what is the time", "", ""), "time")
+        self.assertEqual(brain.match("what is the weather", "", ""), "what")
+        self.assertEqual(brain.star("star", "what is the weather", "", "", 1), "the weather")
+        self.assertEqual(sorted(key for key, _ in brain.categories()),
+                         [("WHAT IS *", "*", "*"), ("WHAT IS THE DATE", "*", "*"),
+                          ("WHAT IS THE TIME", "*", "*")])
+        self.assertEqual(brain._root[brain._LENGTHS], (3, None, True))
+        # removing the branches merges what's left
+        brain.remove("WHAT IS *", "*", "*")
+        brain.remove("WHAT IS THE DATE", "*", "*")
+        self.assertEqual(brain._root["WHAT"][brain._RUN], ("IS", "THE", "TIME"))
+        self.assertEqual(brain._root[brain._LENGTHS], (4, 4, True))
+        self.assertIsNone(brain.match("what is the date", "", ""))
+        self.assertEqual(brain.literal_match("what is the time"), ("time", []))
+        brain.set_path_compression(False)
+        self.assertNotIn(brain._RUN, brain._root["WHAT"])
+        self.assertEqual(brain.match("what is the time", "", ""), "time")
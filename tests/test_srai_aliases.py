@@ -0,0 +1,67 @@
+import unittest
+
+from aiml import pattern_mgr, srai_aliases
+
+
+def template(srai=None, text=None):
+    if srai is not None:
+        return ["template", {}, ["srai", {}, ["text", {"xml:space": "preserve"}, srai]]]
+    return ["template", {}, ["text", {"xml:space": "preserve"}, text]]
+
+
+def constant_srai(tem):
+    return tem[2][2][2] if tem[2][0] == "srai" else None
+
+
+class SraiAliasesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.brain = pattern_mgr.PatternMgr()
+        self.aliases = srai_aliases.SraiAliases(self.brain, constant_srai, str.upper, 100)
+
+    def add(self, pattern, tem, that="*"):
+        self.brain.add(pattern, that, "*", tem)
+        self.aliases.added((pattern, that, "*"), tem)
+
+    def remove(self, pattern, that="*"):
+        self.brain.remove(pattern, that, "*")
+        self.aliases.removed((pattern, that, "*"))
+
+    def assertUpToDate(self):
+        fresh = srai_aliases.SraiAliases(self.brain, constant_srai, str.upper, 100)
+        fresh.build()
+        self.assertEqual({key: (alias[0], id(alias[1]), len(alias[2]))
+                          for key, alias in self.aliases.aliases.items()},
+                         {key: (alias[0], id(alias[1]), len(alias[2]))
+                          for key, alias in fresh.aliases.items()})
+
+    def test_may_match(self):
+        self.assertTrue(srai_aliases._may_match(["*", "B"], ["A", "A", "B"]))
+        self.assertTrue(srai_aliases._may_match(["BOT_NAME", "_"], ["ALICE", "A"]))
+        self.assertFalse(srai_aliases._may_match(["_", "B"], ["B"]))
+        self.assertFalse(srai_aliases._may_match([], ["A"]))
+
+    def test_updates(self):
+        hi = template("say hello")
+        self.add("HI", hi)
+        self.add("HEY", template("hi"))
+        self.add("SAY HELLO", template(text="Hello"))
+        self.aliases.update()
+        self.assertEqual(self.aliases.aliases[id(hi)][0], "say hello")
+        self.assertUpToDate()
+        # a longer pattern makes SAY HELLO depend on more than the input
+        self.add("SAY HELLO THERE", template(text="Hello there"))
+        self.aliases.update()
+        self.assertNotIn(id(hi), self.aliases.aliases)
+        self.assertUpToDate()
+        self.remove("SAY HELLO THERE")
+        self.add("_ HELLO", template(text="Well, hello"), that="QUIZ")
+        self.add("_ GOODBYE", template(text="Well, goodbye"), that="QUIZ")
+        self.aliases.update()
+        self.assertEqual(len(self.aliases.aliases[id(hi)][2]), 1)
+        self.assertUpToDate()
+        self.remove("SAY HELLO")
+        self.aliases.update()
+        # HEY still leads to HI, whose redirect goes nowhere now
+        self.assertEqual([alias[:2] for alias in self.aliases.aliases.values()], [("hi", hi)])
+        self.assertUpToDate()
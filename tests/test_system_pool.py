@@ -0,0 +1,125 @@
+import asyncio
+import os
+import threading
+import time
+import unittest
+from unittest import mock
+
+from aiml import Kernel
+from aiml import system_pool
+from tests.support import TempDirMixin
+
+
+@unittest.skipUnless(os.name == "posix", "the commands need a POSIX shell")
+class SystemExecutorTests(TempDirMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(SystemExecutorTests, self).setUp()
+        self.calls = []
+        self.executor = system_pool.SystemExecutor(
+            max_workers=2, timeout=1.0, max_output=64, cache_size=4,
+            metrics=lambda command, seconds, status, num_bytes: self.calls.append(
+                (command, status, num_bytes)))
+        self.addCleanup(self.executor.shutdown)
+
+    def test_run(self):
+        self.assertEqual(self.executor.run("echo hello"), "hello")
+        # lines are joined the way os.popen() output used to be
+        self.assertEqual(self.executor.run("printf 'a\\nb\\n'"), "a  b")
+        self.assertEqual(self.calls, [("echo hello", "ok", 6), ("printf 'a\\nb\\n'", "ok", 4)])
+
+    def test_timeout(self):
+        self.assertEqual(self.executor.run("echo early; sleep 10"), "early")
+        self.assertEqual(self.calls[-1][1], "timeout")
+
+    def test_no_timeout_by_default(self):
+        executor = system_pool.SystemExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+        with mock.patch.object(system_pool.threading, "Timer") as timer:
+            self.assertEqual(executor.run("sleep 0.1; echo done"), "done")
+        timer.assert_not_called()
+
+    def test_output_is_truncated(self):
+        self.assertEqual(self.executor.run("yes"), "  ".join(["y"] * 32))
+        self.assertEqual(self.calls[-1][1:], ("truncated", 64))
+        # output of exactly max_output bytes is complete
+        self.assertEqual(self.executor.run("printf %064d 0"), "0" * 64)
+        self.assertEqual(self.calls[-1][1:], ("ok", 64))
+
+    def test_cache(self):
+        first = self.executor.run("date +%N")
+        self.assertEqual(self.executor.run("date +%N"), first)
+        self.assertEqual([status for _, status, _ in self.calls], ["ok", "cached"])
+        # the least recently used command is dropped first
+        for i in range(4):
+            self.executor.run("echo %d" % i)
+        self.executor.run("echo 0")
+        self.executor.run("echo 4")
+        self.executor.run("echo 0")
+        self.assertEqual(self.calls[-1][1], "cached")
+        self.executor.run("echo 1")
+        self.assertEqual(self.calls[-1][1], "ok")
+
+    def test_run_async(self):
+        async def run_both():
+            return await asyncio.gather(self.executor.run_async("echo a"),
+                                        self.executor.run_async("echo b"))
+        self.assertEqual(asyncio.run(run_both()), ["a", "b"])
+
+    def test_kernel(self):
+        kernel = Kernel()
+        kernel.set_system_executor(self.executor)
+        elem = ['system', {}, ['text', {'xml:space': 'default'}, 'echo from kernel']]
+        self.assertEqual(kernel._process_element(elem, kernel._GLOBAL_SESSION_ID), "from kernel")
+        self.assertEqual(self.calls[-1][0], "echo from kernel")
+
+    def _slow_kernel(self):
+        self.aiml_file = self.write_aiml("slow.aiml",
+                                         ("SLOW", "<system>sleep 0.5; echo slow</system>"),
+                                         ("FAST", "fast"))
+        kernel = Kernel()
+        kernel.set_system_executor(self.executor)
+        kernel.learn(self.aiml_file)
+        return kernel
+
+    def test_other_sessions_respond_during_command(self):
+        kernel = self._slow_kernel()
+        responses = []
+        thread = threading.Thread(target=lambda: responses.append(kernel.respond("slow", "a")))
+        thread.start()
+        while not kernel._system_sessions:
+            time.sleep(0.01)
+        self.assertEqual(kernel.respond("fast", "b"), "fast")
+        self.assertEqual(responses, [])
+        # the same session waits for the command
+        self.assertEqual(kernel.respond("fast", "a"), "fast")
+        self.assertEqual(responses, ["slow"])
+        thread.join()
+        self.assertEqual(kernel.get_predicate("_outputHistory", "a")[-2:], ["slow", "fast"])
+
+    def test_learn_during_command(self):
+        kernel = self._slow_kernel()
+        brain = kernel._brain
+        thread = threading.Thread(target=kernel.respond, args=("slow", "a"))
+        thread.start()
+        while not kernel._system_sessions:
+            time.sleep(0.01)
+        # the waiting response keeps its brain; the change goes to a copy
+        kernel.learn(self.aiml_file)
+        self.assertIsNot(kernel._brain, brain)
+        # nor does reload() wait for it
+        brain = kernel._brain
+        kernel.reload(self.aiml_file)
+        self.assertIsNot(kernel._brain, brain)
+        self.assertTrue(kernel._system_sessions)
+        thread.join()
+        self.assertEqual(kernel.get_predicate("_outputHistory", "a")[-1], "slow")
+        self.assertEqual(kernel.respond("fast"), "fast")
+
+    def test_deadline_stops_waiting(self):
+        kernel = self._slow_kernel()
+        start = time.monotonic()
+        kernel.respond("slow", deadline=0.1)
+        self.assertLess(time.monotonic() - start, 0.4)
+        self.assertEqual(kernel.timeout_stats()["count"], 1)
+        self.assertEqual(kernel.respond("fast"), "fast")
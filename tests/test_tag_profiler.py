@@ -0,0 +1,32 @@
+import unittest
+
+from aiml import tag_profiler
+
+
+class TagProfilerTests(unittest.TestCase):
+
+    def test_wrap(self):
+        profiler = tag_profiler.TagProfiler()
+
+        def countdown(n):
+            return leaf() if n == 0 else recurse(n - 1)
+
+        recurse = profiler.wrap("recurse", countdown)
+        leaf = profiler.wrap("leaf", lambda: "done")
+        self.assertEqual(recurse(2), "done")
+        stats = profiler.stats()
+        self.assertEqual(stats["recurse"]["calls"], 3)
+        self.assertEqual(stats["recurse"]["max_depth"], 3)
+        self.assertEqual(stats["leaf"]["max_depth"], 4)
+        # nested calls count once in the cumulative time, and not at all in the self time
+        self.assertLessEqual(stats["recurse"]["self"] + stats["leaf"]["self"],
+                             stats["recurse"]["cumulative"])
+        self.assertIn("recurse", profiler.format_stats())
+        profiler.stats(reset=True)
+        self.assertEqual(profiler.stats(), {})
+
+    def test_dump(self):
+        profiler = tag_profiler.TagProfiler(dump_interval=0)
+        with self.assertLogs("aiml.tag_profiler", "INFO") as logs:
+            profiler.wrap("leaf", lambda: None)()
+        self.assertIn("leaf", logs.output[0])
@@ -0,0 +1,38 @@
+import unittest
+
+from aiml import template_pool
+
+
+def text(string):
+    return ["text", {"xml:space": "preserve"}, string]
+
+
+class TemplatePoolTests(unittest.TestCase):
+
+    def test_intern(self):
+        pool = template_pool.TemplatePool()
+        hello = pool.intern(["template", {}, ["srai", {}, text("HELLO")]])
+        self.assertIs(pool.intern(["template", {}, ["srai", {}, text("HELLO")]]), hello)
+        bye = pool.intern(["template", {}, text("Bye"), ["srai", {}, text("HELLO")]])
+        self.assertIsNot(bye, hello)
+        # the <srai> elements and the attribute dictionaries are shared
+        self.assertIs(bye[3], hello[2])
+        self.assertIs(bye[1], hello[1])
+        self.assertIs(bye[2][1], hello[2][2][1])
+        # elements only differing in their attributes aren't
+        star = pool.intern(["star", {"index": "1"}])
+        self.assertIsNot(pool.intern(["star", {"index": "2"}]), star)
+        self.assertIs(pool.intern(["star", {"index": "1"}]), star)
+        stats = pool.stats()
+        self.assertEqual(stats["elements"], 13)
+        self.assertEqual(stats["shared"], 6)
+        self.assertEqual(stats["distinct_elements"], 7)
+        self.assertEqual(stats["distinct_attrs"], 4)
+        self.assertGreater(stats["bytes_saved"], 0)
+
+    def test_clear(self):
+        pool = template_pool.TemplatePool()
+        hello = pool.intern(text("Hello"))
+        pool.clear()
+        self.assertIsNot(pool.intern(text("Hello")), hello)
+        self.assertEqual(pool.stats()["elements"], 2)
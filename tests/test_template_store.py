@@ -0,0 +1,47 @@
+import os
+import unittest
+
+from aiml import template_store
+from tests.support import TempDirMixin
+
+
+class TemplateStoreTests(TempDirMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(TemplateStoreTests, self).setUp()
+        self.filename = self.temp_path("templates")
+
+    def test_add_get(self):
+        store = template_store.TemplateStore(self.filename, cache_size=1)
+        self.addCleanup(store.close)
+        hello = ["template", {}, ["text", {"xml:space": "preserve"}, "Hello"]]
+        bye = ["template", {"#id": 3}, ["srai", {}, ["text", {"xml:space": "preserve"}, "BYE"]]]
+        hello_key = store.add(hello)
+        bye_key = store.add(bye)
+        self.assertEqual(store.get(hello_key), hello)
+        self.assertEqual(store.get(bye_key), bye)
+        # the last template read is cached
+        self.assertIs(store.get(bye_key), store.get(bye_key))
+        self.assertRaises(KeyError, store.get, 2)
+        stats = store.stats()
+        self.assertEqual(stats["templates"], 2)
+        self.assertEqual(stats["reads"], 2)
+        self.assertEqual(stats["bytes"], os.path.getsize(self.filename))
+        self.assertEqual(stats["cache"]["hits"], 2)
+
+    def test_no_cache(self):
+        store = template_store.TemplateStore(self.filename, cache_size=0)
+        self.addCleanup(store.close)
+        key = store.add(["template", {}])
+        self.assertIsNot(store.get(key), store.get(key))
+        self.assertEqual(store.stats()["reads"], 2)
+        self.assertIsNone(store.stats()["cache"])
+
+    def test_file_lives_as_long_as_the_store(self):
+        store = template_store.TemplateStore(self.filename)
+        store.add(["template", {}])
+        # an existing file is never overwritten
+        self.assertRaises(FileExistsError, template_store.TemplateStore, self.filename)
+        store.close()
+        self.assertFalse(os.path.exists(self.filename))
+        store.close()